@@ -14,10 +14,16 @@ import sys
 import os
 import logging
 import time
+import sympy
+import sympy.abc
 
 import scs_instance_hier
 import scs_circuit
 import scs_parser
+import scs_solver
+import scs_cache
+import scs_worker
+import scs_errors
 
 __author__ = "Tomasz Kniola"
 __credits__ = ["Tomasz Kniola"]
@@ -44,6 +50,59 @@ def main():
                         help='output files name, on default name from input file before prefix will be used')
     parser.add_argument('-v', action='store_true',
                         help='verbose mode - displays output warning and errors onto standard output')
+    parser.add_argument('--engine', choices=sorted(scs_solver.engined.keys()) + ['auto'], default='auto',
+                        help='elimination engine used to solve instances, on default (auto) engine predicted to be '
+                             'the fastest is picked for each instance')
+    parser.add_argument('--estimate', action='store_true',
+                        help="dry run - print predicted time of solving each instance and quit without solving")
+    parser.add_argument('--lazy', action='store_true',
+                        help='lazy solve - calculate only those parts of solution which analysis are asking for')
+    parser.add_argument('--exact', action='store_true',
+                        help='exact mode - numbers are read as rationals instead of floats, and equations are kept '
+                             'as rational functions with rational coefficients until instances are solved')
+    parser.add_argument('--keep', nargs='+', default=[], metavar='SYMBOL',
+                        help='symbols which stay symbolic (added to ones declared by .symbolic), all other symbols '
+                             'which have nominal values (.nominal) are replaced with them before solving')
+    parser.add_argument('--nested', action='store_true',
+                        help='keep solution as sequence of expressions: entries of solutions of subinstances are used '
+                             'as symbols, results are written with definitions of symbols they use, and evaluated '
+                             'numerically through them, instead of expanding them into single expressions')
+    parser.add_argument('--alter', action='append', default=[], metavar='ELEMENT',
+                        help='element definition as in netlist (name can be in dot notation) which replaces or adds '
+                             'an element after solving, solution is updated and analysis are performed again into '
+                             'files with _alter<n> suffix, can be repeated, changes accumulate')
+    parser.add_argument('--low-rank', action='store_true',
+                        help='update solutions for --alter with Sherman-Morrison-Woodbury formula instead of '
+                             'factorizing changed instances again')
+    parser.add_argument('--approximate', type=float, metavar='TOL',
+                        help='approximate solve - terms which are insignificant at nominal values of symbols (given by '
+                             '.nominal lines) are dropped while solving, so that each coefficient of powers of s keeps '
+                             'relative error within TOL, instances are then solved with ddd engine')
+    parser.add_argument('--no-symmetry', action='store_true',
+                        help="don't split symmetric (like fully differential) instances into differential and common "
+                             "mode halves, which are otherwise solved separately")
+    parser.add_argument('--no-reduce', action='store_true',
+                        help="don't merge series and parallel passive elements and remove nets between them before "
+                             "solving")
+    parser.add_argument('--partition', type=int, default=0, metavar='NETS',
+                        help='instances with more than NETS inner nets are torn into subinstances connected by small '
+                             'number of nets, which are solved separately, on default 0 (off), as nesting solutions '
+                             'of parts in equations of their parents can make solving much slower')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes solving subinstances in parallel and cancelling large entries of '
+                             'equations, on default 1')
+    parser.add_argument('--worker', action='append', default=[], metavar='HOST:PORT', type=scs_worker.parse_address,
+                        help='address of scs_worker.py process solving subinstances instead of local processes, can '
+                             'be given many times')
+    parser.add_argument('--authkey', default=scs_worker.default_authkey,
+                        help='key shared with workers (printed by them if they made it), on default SCS_AUTHKEY '
+                             'environment variable, required with --worker')
+    parser.add_argument('--cache-dir',
+                        help='directory of persistent cache of solved instances (like ~/.scs_cache), not used if not '
+                             'given, files in it are unpickled and evaluated, so it must be writable only by trusted '
+                             'users')
+    parser.add_argument('--cache-size', type=float, default=100,
+                        help='maximal size of cache directory in MB, least recently used solutions are removed')
     args = parser.parse_args(sys.argv[1:])
 
     input_file_name = args.i
@@ -77,15 +136,30 @@ def main():
 
     # Create top circtuit by parsing input file
     time1 = time.clock()
+    scs_parser.exact = args.exact
     top_cir = scs_parser.parse_file(input_file_name, scs_circuit.TopCircuit())
     if not top_cir:
         logging.error("Failed to parse a circuit.")
         exit()
     logging.info('Input file parsed in: %f s' % (time.clock() - time1))
 
+    # Symbols which are not declared to stay symbolic are replaced with their nominal values while instantiating
+    numeric = None
+    symbolic = top_cir.symbolicl + args.keep
+    if symbolic:
+        try:
+            nominal = scs_parser.evaluate_nominal(top_cir.nominald, scs_parser.evaluate_params(top_cir.parametersd))
+        except scs_errors.ScsParameterError, e:
+            logging.error(e)
+            exit()
+        numeric = dict((symbol, value) for symbol, value in nominal.iteritems()
+                       if str(symbol) not in symbolic and str(symbol) != 's')
+        logging.info('Symbols kept symbolic: %s, replaced with nominal values: %s' %
+                     (', '.join(sorted(set(symbolic))), ', '.join(sorted(str(symbol) for symbol in numeric))))
+
     # Instantiate circuit
     time1 = time.clock()
-    top_instance = scs_instance_hier.make_top_instance(top_cir)
+    top_instance = scs_instance_hier.make_top_instance(top_cir, numeric)
     if not top_instance:
         logging.error("Failed to instanace a circuit.")
         exit()
@@ -95,15 +169,109 @@ def main():
     if not top_instance.check_path_to_gnd(): exit()
     if not top_instance.check_voltage_loop(): exit()
 
+    # Merge series and parallel elements and partition large instances, leaving elements which are going to be
+    # altered (and their nets) where they are
+    keep = []
+    for alter in args.alter:
+        try:
+            name, element = scs_parser.parse_element(alter)
+        except scs_errors.ScsParserError:
+            continue
+        prefix = name[:name.rfind('.') + 1]
+        keep += [name] + [prefix + net for net in element.paramsl]
+    if not args.no_reduce:
+        time1 = time.clock()
+        removed = top_instance.reduce(keep)
+        logging.info('Removed %d nets by topological reduction in: %f s' % (removed, time.clock() - time1))
+    if args.partition > 0:
+        time1 = time.clock()
+        parts = top_instance.partition(args.partition, keep)
+        logging.info('Partitioned circuit into %d subinstances in: %f s' % (parts, time.clock() - time1))
+
+    # Check that equations can be solved before solving them symbolically
+    time1 = time.clock()
+    if not top_instance.check_singularity(): exit()
+    logging.info('Checked equations in: %f s' % (time.clock() - time1))
+
+    approximation = None
+    if args.approximate is not None:
+        if args.nested:
+            logging.error("Approximation can't be used with --nested, symbols of nested solutions hide powers of s.")
+            exit()
+        try:
+            nominal = scs_parser.evaluate_nominal(top_cir.nominald, top_instance.paramsd)
+        except scs_errors.ScsParameterError, e:
+            logging.error(e)
+            exit()
+        approximation = (nominal, args.approximate)
+
+    if args.estimate:
+        time1 = time.clock()
+        total = 0.0
+        print '%-30s %8s %6s %8s %14s %10s' % ('Instance', 'Unknowns', 'Ports', 'Symbols', 'Engine', 'Time [s]')
+        for name, estimate, shared in top_instance.estimate():
+            engine = 'ddd' if approximation else estimate.engine if args.engine == 'auto' else args.engine
+            name = name if name else 'TOP INSTANCE'
+            symbols = '%d%s' % (estimate.symbols, ' + s' if estimate.s else '')
+            if shared:
+                print '%-30s %8d %6d %8s %14s %10s' % (name, estimate.n, estimate.columns - 1, symbols, engine,
+                                                       'shared')
+                continue
+            total += estimate.costs[engine]
+            print '%-30s %8d %6d %8s %14s %10.3g' % (name, estimate.n, estimate.columns - 1, symbols, engine,
+                                                     estimate.costs[engine])
+            logging.info('Estimated %s: %s engine, predicted time %s' %
+                         (name, engine, ', '.join('%s %.3g s' % (other, estimate.costs[other])
+                                                  for other in sorted(estimate.costs))))
+        print 'Predicted time of solving: %.3g s' % total
+        logging.info('Predicted time of solving: %g s, estimated in: %f s' % (total, time.clock() - time1))
+        exit()
+
+    templates = None
+    if args.cache_dir:
+        try:
+            tag = '%s%s' % (args.engine, ' exact' if args.exact else '')
+            if approximation:
+                tag = 'approximate %g %s%s' % (args.approximate, sorted(approximation[0].iteritems()),
+                                               ' exact' if args.exact else '')
+            if args.no_symmetry:
+                tag += ' no symmetry'
+            if args.nested:
+                tag += ' nested'
+            templates = scs_cache.SolutionCache(args.cache_dir, int(args.cache_size * 2 ** 20), tag)
+        except OSError, e:
+            logging.warning("Can't use cache directory %s: %s" % (args.cache_dir, e))
+
+    workers = None
+    if args.worker:
+        if not args.authkey:
+            logging.error('Key shared with workers has to be given with --authkey or SCS_AUTHKEY')
+            exit()
+        workers = scs_worker.WorkerPool(args.worker, args.authkey)
+
     time1 = time.clock()
     try:
-        top_instance.solve()
+        top_instance.solve(args.engine, args.lazy, templates, args.jobs, args.exact, approximation,
+                           not args.no_symmetry, workers, args.nested)
     except:
         exit()
     logging.info('Solved circuit in: %f s' % (time.clock() - time1))
 
     top_cir.perform_analysis(top_instance, output_file_prefix)
 
+    for n, alter in enumerate(args.alter, 1):
+        time1 = time.clock()
+        try:
+            name, element = scs_parser.parse_element(alter)
+            top_instance.alter_element(name, element, args.engine, args.exact, args.low_rank, approximation,
+                                       not args.no_symmetry)
+        except (scs_errors.ScsParserError, scs_errors.ScsInstanceError, scs_errors.ScsElementError), e:
+            logging.error(e)
+            logging.error("Alteration %d: %s not performed" % (n, alter))
+            exit()
+        logging.info('Updated solution for %s in: %f s' % (alter, time.clock() - time1))
+        top_cir.perform_analysis(top_instance, '%s_alter%d' % (output_file_prefix, n))
+
 
 if __name__ == "__main__":
     main()
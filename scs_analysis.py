@@ -4,10 +4,12 @@
 import sympy
 import sympy.abc
 import warnings
+import logging
 import numpy as np
 import matplotlib.pyplot as plt
 
 import scs_parser
+import scs_solver
 import scs_errors
 
 __author__ = "Tomasz Kniola"
@@ -38,6 +40,9 @@ def measure_analysis(param_d, param_l, instance, file_sufix):
 
         value of a measue will be saved on instance.paramsd dictionary with measute_name which allows it to be used
         in next analysis. This feature can be abused to show parametric plots of ac and dc.
+
+        If instance was solved in nested mode value is written as expression of symbols standing for shared
+        subexpressions, followed by their definitions (see write_sequence).
     """
     filename = "%s.results" % file_sufix
     subst = []
@@ -61,7 +66,151 @@ def measure_analysis(param_d, param_l, instance, file_sufix):
         with open(filename, 'a') as fil:
             fil.write("%s: %s \n---------------------\n" % (print_name, expresion))
             fil.write(str(value))
-            fil.write("\n\n")
+            fil.write("\n")
+            write_sequence(fil, instance.sequence([value]), subst)
+            fil.write("\n")
+
+
+def print_analysis(param_d, param_l, instance, file_sufix):
+    """ Performs print analysis
+
+        param_d: substitutions for symbols, expresions which can use parameters
+
+        param_l: expresions to print
+
+        file_sufix: prefix of a file for output of print analysis
+
+        Print analysis format is:
+        .print expresion1 [expresion2 ...]  [symbol0 = value0 symbol1 = value1 ...]
+
+        expresions are like in measure analysis, additionaly v(*) prints voltages of all nets of all instances in the
+        hierarchy (in dot notation), which are calculated in one pass by instance.all_voltages(). Values are printed
+        without simplification, in nested mode followed by definitions of symbols they use.
+    """
+    filename = "%s.results" % file_sufix
+    subst = []
+    for symbol, value in param_d.iteritems():
+        tokens = scs_parser.parse_param_expresion(value)
+        subst.append((symbol, sympy.sympify(scs_parser.params2values(tokens, instance.paramsd), sympy.abc._clash)))
+
+    with open(filename, 'a') as fil:
+        for expresion in param_l:
+            if expresion.replace(' ', '') == 'v(*)':
+                values = [('v(%s)' % net, value) for net, value in sorted(instance.all_voltages().iteritems())]
+            else:
+                tokens = scs_parser.parse_analysis_expresion(expresion)
+                values = [(expresion, scs_parser.results2values(tokens, instance))]
+            fil.write("%s: %s \n---------------------\n" % ('Print of', expresion))
+            values = [(name, sympy.sympify(value, sympy.abc._clash)) for name, value in values]
+            for name, value in values:
+                fil.write("%s = %s\n" % (name, str(value.subs(subst))))
+            write_sequence(fil, instance.sequence([value for name, value in values]), subst)
+            fil.write("\n")
+
+
+def tf_analysis(param_d, param_l, instance, file_sufix):
+    """ Performs transfer analysis
+
+        param_d: substitutions for symbols, expresions which can use parameters
+
+        param_l: outputs, 'from' keyword and sources
+
+        file_sufix: prefix of a file for output of transfer analysis
+
+        Transfer analysis format is:
+        .tf output0[,output1 ...] from source0[,source1 ...] [symbol0 = value0 symbol1 = value1 ...]
+
+        outputs are names of nets or expresions like in measure analysis (v(out), v(outp,outm), i(R1)), which must be
+        linear in sources, sources are names of independent voltage and current sources (in dot notation). Transfer
+        function from each source to each output is calculated with all other sources set to 0, all of them solved
+        with one factorization of each instance (see Instance.transfer), so whole matrix costs about as much as one
+        solve. Transfer functions are printed factored in s, in nested mode followed by definitions of symbols they use.
+    """
+    filename = "%s.results" % file_sufix
+    if 'from' not in param_l:
+        raise scs_errors.ScsAnalysisError("Transfer analysis needs outputs and sources separated with 'from'.")
+    outputs = split_list(param_l[:param_l.index('from')])
+    sources = split_list(param_l[param_l.index('from') + 1:])
+    if not outputs or not sources:
+        raise scs_errors.ScsAnalysisError("Transfer analysis needs at least one output and one source.")
+    outputs = [output if '(' in output else 'v(%s)' % output for output in outputs]
+    subst = []
+    for symbol, value in param_d.iteritems():
+        tokens = scs_parser.parse_param_expresion(value)
+        subst.append((symbol, sympy.sympify(scs_parser.params2values(tokens, instance.paramsd), sympy.abc._clash)))
+
+    def evaluate(instance):
+        return [sympy.sympify(scs_parser.results2values(scs_parser.parse_analysis_expresion(output), instance),
+                              sympy.abc._clash) for output in outputs]
+
+    transfer = instance.transfer(sources, evaluate)
+    with open(filename, 'a') as fil:
+        fil.write("%s: %s from %s \n---------------------\n" % ('Transfer of', ','.join(outputs), ','.join(sources)))
+        for output, row in zip(outputs, transfer):
+            for source, value in zip(sources, row):
+                value = sympy.factor(sympy.cancel(value), sympy.symbols('s')).subs(subst)
+                fil.write("%s/%s = %s\n" % (output, source, str(value)))
+        write_sequence(fil, instance.sequence([value for row in transfer for value in row]), subst)
+        fil.write("\n")
+
+
+def write_sequence(fil, sequence, subst=()):
+    """ Writes definitions of symbols standing for shared subexpressions
+
+        fil: file where definitions are written
+
+        sequence: list of symbol,definition pairs, as provided by Instance.sequence() (empty if instance wasn't solved
+        in nested mode, then nothing is written)
+
+        subst: substitutions for symbols done in definitions
+    """
+    if sequence:
+        fil.write("where:\n")
+    for symbol, definition in sequence:
+        fil.write("%s = %s\n" % (symbol, str(definition.subs(subst))))
+
+
+def evaluate_sequence(value, sequence, subst=()):
+    """ Evaluates value which uses symbols standing for shared subexpressions
+
+        value: expression as provided by Instance v(), i() and isub() (in nested mode)
+
+        sequence: list of symbol,definition pairs, as provided by Instance.sequence()
+
+        subst: substitutions for symbols
+
+        Definitions are evaluated one by one in their order, with substitutions done and symbols defined before
+        replaced by their values, each of them cancelled. With all symbols but s substituted each of them is a small
+        rational function of s, so value is evaluated without ever expanding it into one expression of circuit symbols.
+        Floats are replaced with rationals, so common factors of numerators and denominators cancel exactly, instead of
+        leaving pairs of close poles and zeros. Returns value with all symbols of sequence replaced.
+    """
+    values = {}
+    for symbol, definition in sequence:
+        values.update({symbol: sympy.cancel(scs_solver.rationalize(definition.subs(subst)).xreplace(values))})
+    return sympy.cancel(scs_solver.rationalize(value.subs(subst)).xreplace(values))
+
+
+def split_list(param_l):
+    """ Splits positional parameters into list of names or expresions separated by commas
+
+        param_l: list of positional parameters, like ['out1,v(a,b)', 'out2']
+
+        Commas inside brackets (like in v(a,b)) don't split.
+    """
+    items = []
+    for param in param_l:
+        depth = 0
+        item = ''
+        for char in param:
+            depth += {'(': 1, ')': -1}.get(char, 0)
+            if char == ',' and not depth:
+                items.append(item)
+                item = ''
+            else:
+                item += char
+        items.append(item)
+    return [item.strip() for item in items if item.strip()]
 
 
 class PlotNumber:
@@ -156,8 +305,13 @@ def dc_analysis(param_d, param_l, instance, file_sufix):
 
     for expresion in param_l:
         tokens = scs_parser.parse_analysis_expresion(expresion)
-        value0 = sympy.sympify(scs_parser.results2values(tokens, instance),sympy.abc._clash).subs(s, 0).simplify()
-        value = value0.subs(subst)
+        value0 = sympy.sympify(scs_parser.results2values(tokens, instance),sympy.abc._clash)
+        sequence = instance.sequence([value0])
+        if sequence:
+            value = evaluate_sequence(value0, sequence, [(s, 0)] + subst)
+        else:
+            value0 = value0.subs(s, 0).simplify()
+            value = value0.subs(subst)
         yf = sympy.lambdify(xsym, value)
         try:
             ys = [float(yf(x)) for x in xs]
@@ -208,6 +362,13 @@ def ac_analysis(param_d, param_l, instance, file_sufix):
         hold:           hold plot for next analysis and don't save it to file [yes | no]
         show_poles:     show poles of function on plot [yes | no]
         show_zeroes:    show zeros of function on plot [yes | no]
+        roots:          how poles and zeros are found [numeric | symbolic], numeric ones are eigenvalues of companion
+                        matrices of numerator and denominator with substitutions done, symbolic ones are solutions of
+                        symbolic equations (slow for degree above 2)
+
+        If instance was solved in nested mode expresion is written with definitions of symbols it uses, and DC gain,
+        poles, zeros and plot are found from value evaluated through the definitions with substitutions done (see
+        evaluate_sequence), so with all symbols substituted they are numeric.
         title:          display title above ac plot [string]
         show_legend:    show legend on plot [yes | no]
         xkcd:           style plot to be xkcd like scetch
@@ -223,6 +384,7 @@ def ac_analysis(param_d, param_l, instance, file_sufix):
               'hold': 'no',
               'show_poles': 'yes',
               'show_zeros': 'yes',
+              'roots': 'numeric',
               'title': None,
               'show_legend': 'no',
               'xkcd': 'no'}
@@ -252,6 +414,9 @@ def ac_analysis(param_d, param_l, instance, file_sufix):
     if config['yscale'] != 'log' and config['yscale'] != 'linear':
         raise scs_errors.ScsAnalysisError(("Option %s for yscale invalid!" % config['fscale']))
 
+    if config['roots'] != 'numeric' and config['roots'] != 'symbolic':
+        raise scs_errors.ScsAnalysisError(("Option %s for roots invalid!" % config['roots']))
+
     filename = "%s.results" % file_sufix
 
     with open(filename, 'a') as fil:
@@ -264,32 +429,46 @@ def ac_analysis(param_d, param_l, instance, file_sufix):
             tokens = scs_parser.parse_analysis_expresion(expresion)
             value0 = sympy.factor(sympy.sympify(scs_parser.results2values(tokens, instance),sympy.abc._clash), s).simplify()
             fil.write("%s = %s \n\n" % (expresion, str(value0)))
+            sequence = instance.sequence([value0])
+            if sequence:
+                write_sequence(fil, sequence)
+                fil.write("\n")
+                value0 = sympy.factor(evaluate_sequence(value0, sequence, subst), s)
             denominator = sympy.denom(value0)
             numerator = sympy.numer(value0)
-            poles = sympy.solve(denominator, s)
-            zeros = sympy.solve(numerator, s)
-            poles_r = sympy.roots(denominator, s)
-            zeros_r = sympy.roots(numerator, s)
+            if config['roots'] == 'symbolic':
+                poles = sympy.solve(denominator, s)
+                zeros = sympy.solve(numerator, s)
+                poles_r = sympy.roots(denominator, s)
+                zeros_r = sympy.roots(numerator, s)
+            else:
+                try:
+                    poles = numeric_roots(denominator.subs(subst), s)
+                    zeros = numeric_roots(numerator.subs(subst), s)
+                except scs_errors.ScsAnalysisError, e:
+                    logging.warning(e)
+                    poles, zeros = [], []
             gdc = str(value0.subs(s, 0).simplify())
             fil.write('G_DC = %s\n\n' % gdc)
 
-            p = 0
-            titled = 1
-            for pole, degree in poles_r.iteritems():
-                if pole == 0:
-                    titled *= s ** degree
-                else:
-                    titled *= (s / sympy.symbols("\\omega_p%d" % p) + 1)
-                p += 1
-            z = 0
-            titlen = 1
-            for zero, degree in zeros_r.iteritems():
-                if zero == 0:
-                    titlen *= s ** degree
-                else:
-                    titlen *= (s / sympy.symbols("\\omega_z%d" % z) + 1)
-                z += 1
-            # title = sympy.symbols("G_DC") * (titlen / titled)
+            if config['roots'] == 'symbolic':
+                p = 0
+                titled = 1
+                for pole, degree in poles_r.iteritems():
+                    if pole == 0:
+                        titled *= s ** degree
+                    else:
+                        titled *= (s / sympy.symbols("\\omega_p%d" % p) + 1)
+                    p += 1
+                z = 0
+                titlen = 1
+                for zero, degree in zeros_r.iteritems():
+                    if zero == 0:
+                        titlen *= s ** degree
+                    else:
+                        titlen *= (s / sympy.symbols("\\omega_z%d" % z) + 1)
+                    z += 1
+                # title = sympy.symbols("G_DC") * (titlen / titled)
             value = value0.subs(subst)
             f = sympy.symbols('f', real=True)
             value = value.subs(s, sympy.sympify('2*pi*I').evalf() * f)
@@ -330,10 +509,9 @@ def ac_analysis(param_d, param_l, instance, file_sufix):
             for pole in poles:
 
                 try:
-                    pole_value = pole.subs(subst)
+                    pole_value = pole.subs(subst) if config['roots'] == 'symbolic' else pole
                     pole_value_f = abs(np.float64(-abs(pole_value) / sympy.sympify('2*pi').evalf()))
-                    pole_s = (-pole).simplify()
-                    polestr = str(pole_s)
+                    polestr = str((-pole).simplify()) if config['roots'] == 'symbolic' else format_root(-pole)
                     fil.write('wp_%d = %s\n\n' % (p, polestr))
 
                     p += 1
@@ -352,10 +530,9 @@ def ac_analysis(param_d, param_l, instance, file_sufix):
             z = 0
             for zero in zeros:
                 try:
-                    zero_value = zero.subs(subst)
+                    zero_value = zero.subs(subst) if config['roots'] == 'symbolic' else zero
                     zero_value_f = abs(np.float64(-abs(zero_value) / sympy.sympify('2*pi').evalf()))
-                    zero_s = (-zero).simplify()
-                    zerostr = str(zero_s)
+                    zerostr = str((-zero).simplify()) if config['roots'] == 'symbolic' else format_root(-zero)
                     fil.write('wz_%d = %s\n\n' % (z, zerostr))
                     z += 1
                     if zero_value_f > float(config['fstop']) \
@@ -376,7 +553,38 @@ def ac_analysis(param_d, param_l, instance, file_sufix):
                 plt.savefig('%s_%d.png' % (file_sufix, PlotNumber.plot_num))
                 plt.clf()
                 PlotNumber.plot_num += 1
+
+
+def numeric_roots(polynomial, s):
+    """ Finds roots of polynomial numerically
+
+        polynomial: polynomial of s with numeric coefficients
+
+        s: symbol of the polynomial
+
+        Roots are eigenvalues of companion matrix of the polynomial (numpy.roots), so no symbolic equations are solved.
+        Returns list of complex roots sorted by their magnitude.
+    """
+    try:
+        coefficients = [complex(coefficient) for coefficient in sympy.Poly(polynomial, s).all_coeffs()]
+    except (TypeError, sympy.PolynomialError):
+        raise scs_errors.ScsAnalysisError(
+            "Can't find numeric roots of: %s. Not all values where subsituted?" % polynomial)
+    return sorted(np.roots(coefficients), key=abs)
+
+
+def format_root(root):
+    """ Formats complex root found numerically, imaginary part is omitted if it's zero
+    """
+    real, imag = root.real + 0.0, root.imag + 0.0   # no negative zeros
+    if imag == 0:
+        return '%g' % real
+    return '%g%+gj' % (real, imag)
+
+
 # Dictionary of analysis name with appropriate functions
 analysis_dict = {'measure': measure_analysis,
+                 'print': print_analysis,
                  'ac': ac_analysis,
-                 'dc': dc_analysis}
+                 'dc': dc_analysis,
+                 'tf': tf_analysis}
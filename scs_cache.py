@@ -0,0 +1,167 @@
+"""
+Persistent cache of solved instances
+
+Solutions of instances (V0 and Ap) are kept in files in cache directory, so next run with the same circuit (or with
+circuits sharing some subcircuits) doesn't need to solve them again. Each solution is stored under hash of its template
+key (see Instance.template_key), which is made of nets, evaluated element values and keys of subinstances, so it
+changes whenever anything which solution depends on changes. When size of the directory gets above the limit, least
+recently used files are removed.
+
+Files are read with pickle and their expressions with sympify, both of which can run any code, so cache directory has
+to be trusted: it's created readable only by its owner, and cache is used only when directory is given. Each file
+starts with text header with format version and tag, which is checked before anything is unpickled.
+"""
+
+import os
+import hashlib
+import pickle
+import logging
+import sympy
+
+__author__ = "Tomasz Kniola"
+__credits__ = ["Tomasz Kniola"]
+
+__license__ = "LGPL"
+__version__ = "0.0.1"
+__email__ = "kniola.tomasz@gmail.com"
+__status__ = "development"
+
+# Version of files format, files with different version are ignored
+cache_format = 3
+
+
+class SolutionCache(object):
+    """ Dictionary of template_key:solution which is backed by files in cache directory.
+
+        Can be passed to Instance.solve() as templates dictionary. Solutions are tuples of:
+        (V0_s, Ap_s, V0_m, Ap_m, V0, Ap)
+        Only full solutions (with V0_m and Ap_m) are stored, lazy ones stay just in memory. Solutions read from files
+        don't have lazy solutions V0_s and Ap_s, as all of the entries are already known.
+    """
+
+    def __init__(self, directory, max_size=100 * 2 ** 20, tag=''):
+        """ Initialize SolutionCache
+
+            directory: path to cache directory, will be created if it doesn't exist
+
+            max_size: maximal size of all files in directory in bytes
+
+            tag: string added to the hash of each key, solutions made in different way (like by different engine)
+            should have different tags
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.tag = tag
+        self.solutions = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+
+    def _path(self, key):
+        """ Provides path of file for template key
+        """
+        digest = hashlib.sha1(repr((cache_format, __version__, self.tag, key))).hexdigest()
+        return os.path.join(self.directory, '%s.scs' % digest)
+
+    def _header(self):
+        """ Provides first line of files, which is checked before file is unpickled
+        """
+        return 'scs-cache %d %s %s\n' % (cache_format, __version__, hashlib.sha1(self.tag).hexdigest())
+
+    def _load(self, key):
+        """ Loads solution from file into memory
+
+            key: template key of solution
+
+            Returns True if solution was found. Broken or incompatible files (with other header) are ignored.
+        """
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return False
+        try:
+            with open(path, 'rb') as fil:
+                if fil.readline() != self._header():
+                    logging.warning("Ignoring cache file %s of other format" % path)
+                    return False
+                version, stored_key, V0, Ap = pickle.load(fil)
+            if version != cache_format or stored_key != key:
+                return False
+            unknowns, port_nets = key[0], key[1]
+            V0 = dict((net, sympy.sympify(value)) for net, value in V0.iteritems())
+            Ap = dict((port, dict((net, sympy.sympify(value)) for net, value in column.iteritems()))
+                      for port, column in Ap.iteritems())
+        except Exception, e:
+            logging.warning("Ignoring broken cache file %s: %s" % (path, e))
+            return False
+        V0_m = sympy.Matrix(len(unknowns), 1, [V0[net] for net in unknowns])
+        Ap_m = sympy.Matrix(len(unknowns), len(port_nets), [Ap[port][net] for net in unknowns for port in port_nets])
+        self.solutions.update({key: (None, None, V0_m, Ap_m, V0, Ap)})
+        os.utime(path, None)  # mark as recently used
+        return True
+
+    def _store(self, key, solution):
+        """ Writes solution into file
+
+            key: template key of solution
+
+            solution: solution tuple, if it's lazy one (without V0_m) it's not stored
+        """
+        V0_s, Ap_s, V0_m, Ap_m, V0, Ap = solution
+        if V0_m is None:
+            return
+        path = self._path(key)
+        V0 = dict((net, sympy.srepr(value)) for net, value in V0.iteritems())
+        Ap = dict((port, dict((net, sympy.srepr(value)) for net, value in column.iteritems()))
+                  for port, column in Ap.iteritems())
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as fil:
+                fil.write(self._header())
+                pickle.dump((cache_format, key, V0, Ap), fil, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError), e:
+            logging.warning("Can't write cache file %s: %s" % (path, e))
+            return
+        self.evict()
+
+    def evict(self):
+        """ Removes least recently used files until size of cache directory is below the limit.
+        """
+        files = []
+        size = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.scs'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            size += stat.st_size
+        for mtime, file_size, path in sorted(files):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                size -= file_size
+            except OSError:
+                pass
+
+    def __contains__(self, key):
+        return key in self.solutions or self._load(key)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.solutions[key]
+
+    def update(self, solutions):
+        """ Adds solutions to the cache and stores them into files
+
+            solutions: dictionary or list of template_key,solution pairs
+        """
+        for key, solution in dict(solutions).iteritems():
+            self.solutions.update({key: solution})
+            self._store(key, solution)
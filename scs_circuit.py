@@ -40,6 +40,7 @@ class Circuit(object):
         self.elementsd = {}  # Dictionary of element names with elements objects of circuit
         self.parametersd = {}  # Dictionary parameter names with expresion for them
         self.subcircuitsd = {}  # Dictionary of subcircuit names with circuit object
+        self.symmetryl = []  # List of pairs of net or element names which are mirror images of each other
         self.parent = parent
         self.ports = ports
         if params:
@@ -86,6 +87,8 @@ class TopCircuit(Circuit):
         """
         Circuit.__init__(self, 'top', None, None, None)
         self.analysisl = []
+        self.nominald = {}  # Dictionary of symbol names with expresions of their nominal values
+        self.symbolicl = []  # List of names of symbols which stay symbolic, others get their nominal values
 
     def perform_analysis(self, instance, file_prefix):
         """ Performs all analysis for self circuit.
@@ -14,6 +14,7 @@ Element
   +-Reistance
   +-Capacitance
   +-Inductance
+  +-Admittance
 
 Those elements are part of instance not circuit.
 """
@@ -76,7 +77,7 @@ class VoltageSource(Element):
         vvalue = scs_parser.evaluate_param('_v', {'_v': vvalue_expresion}, evaluated_paramsd, parent)
         self.names = [name]
         self.nets = element.paramsl[:-1]
-        self.values = [sympy.sympify(vvalue,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(vvalue)]
 
 
 class VoltageControlledVoltageSource(VoltageSource):
@@ -101,11 +102,14 @@ class VoltageControlledVoltageSource(VoltageSource):
         gain_value = scs_parser.evaluate_param('_gain', {'_gain': gain_expresion}, evaluated_paramsd, parent)
         self.names = [name]
         self.nets = element.paramsl[:-1]
-        self.values = [sympy.sympify(gain_value,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(gain_value)]
 
 
 class CurrentControlledVoltageSource(VoltageSource):
     """Object with instance of current controlled voltage source of a circtuit
+
+       Its voltage V(n+)-V(n-) = r*Iref, where Iref is current of referenced element flowing out of its first net
+       (same convention as of CurrentControlledCurrentSource and spice H source).
     """
 
     def __init__(self, name, element, evaluated_paramsd, parent):
@@ -126,7 +130,7 @@ class CurrentControlledVoltageSource(VoltageSource):
         r_value = scs_parser.evaluate_param('_r', {'_r': r_expresion}, evaluated_paramsd, parent)
         self.names = [name, element.paramsl[-2]]
         self.nets = element.paramsl[:-2]
-        self.values = [sympy.sympify(r_value,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(r_value)]
 
 
 class CurrentSource(Element):
@@ -155,7 +159,7 @@ class CurrentSource(Element):
         ivalue = scs_parser.evaluate_param('_i', {'_i': ivalue_expresion}, evaluated_paramsd, parent)
         self.names = [name]
         self.nets = element.paramsl[:-1]
-        self.values = [sympy.sympify(ivalue,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(ivalue)]
 
 
 class VoltageControlledCurrentSource(CurrentSource):
@@ -180,11 +184,14 @@ class VoltageControlledCurrentSource(CurrentSource):
         gm_value = scs_parser.evaluate_param('_gm', {'_gm': gm_expresion}, evaluated_paramsd, parent)
         self.names = [name]
         self.nets = element.paramsl[:-1]
-        self.values = [sympy.sympify(gm_value,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(gm_value)]
 
 
 class CurrentControlledCurrentSource(CurrentSource):
     """Object with instance of current controlled current source of a circtuit
+
+       Current a*Iref flows out of its first net and into its second net, where Iref is current of referenced element
+       flowing out of its first net (as for spice F source).
     """
 
     def __init__(self, name, element, evaluated_paramsd, parent):
@@ -205,7 +212,7 @@ class CurrentControlledCurrentSource(CurrentSource):
         ai_value = scs_parser.evaluate_param('_ai', {'_ai': ai_expresion}, evaluated_paramsd, parent)
         self.names = [name, element.paramsl[-2]]
         self.nets = element.paramsl[:-2]
-        self.values = [sympy.sympify(ai_value,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(ai_value)]
 
 
 class PassiveElement(Element):
@@ -242,12 +249,12 @@ class Resistance(PassiveElement):
         rvalue = scs_parser.evaluate_param('_r', {'_r': rvalue_expresion}, evaluated_paramsd, parent)
         self.names = [name]
         self.nets = element.paramsl[:-1]
-        self.values = [sympy.sympify(rvalue,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(rvalue)]
 
     def conductance(self):
-        """ Calculate the conductance of self
+        """ Calculate the conductance of self, it's exact in exact mode (see scs_parser.exact)
         """
-        return 1.0 / self.values[0]
+        return (sympy.S.One if scs_parser.exact else 1.0) / self.values[0]
 
 
 class Capacitance(PassiveElement):
@@ -278,7 +285,7 @@ class Capacitance(PassiveElement):
         cvalue = scs_parser.evaluate_param('_c', {'_c': cvalue_expresion}, evaluated_paramsd, parent)
         self.names = [name]
         self.nets = element.paramsl[:-1]
-        self.values = [sympy.sympify(cvalue,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(cvalue)]
 
     def conductance(self):
         """ Calculate the conductance of self
@@ -314,12 +321,36 @@ class Inductance(PassiveElement):
         lvalue = scs_parser.evaluate_param('_l', {'_l': lvalue_expresion}, evaluated_paramsd, parent)
         self.names = [name]
         self.nets = element.paramsl[:-1]
-        self.values = [sympy.sympify(lvalue,sympy.abc._clash)]
+        self.values = [scs_parser.sympify(lvalue)]
+
+    def conductance(self):
+        """ Calculate the conductance of self, it's exact in exact mode (see scs_parser.exact)
+        """
+        return (sympy.S.One if scs_parser.exact else 1.0) / (sympy.symbols('s') * self.values[0])
+
+
+class Admittance(PassiveElement):
+    """Object with instance of an admittance, which replaces passive elements merged by topological reduction of
+       instance (see Instance.reduce). It's never written in netlist.
+    """
+
+    def __init__(self, name, nets, value):
+        """ Initialize Admittance
+
+            name: element name, made of names of merged elements
+
+            nets: list of 2 nets the admittance is connected to
+
+            value: value of admittance, expression of s and circuit symbols
+        """
+        self.names = [name]
+        self.nets = nets
+        self.values = [value]
 
     def conductance(self):
         """ Calculate the conductance of self
         """
-        return 1.0 / (sympy.symbols('s') * self.values[0])
+        return self.values[0]
 
 
 # Dictionary of 1st letter of a name with appriopriate element object
@@ -15,11 +15,19 @@ __status__ = "development"
 
 import sympy
 import copy
+import hashlib
 import logging
+import pickle
+import random
+import multiprocessing
 
 import scs_errors
 import scs_parser
 import scs_elements
+import scs_solver
+
+# Expressions with at least that many characters in sympy.srepr form are cancelled in pool of processes
+pool_length = 1000
 
 class Instance(object):
     """ Instance class
@@ -32,11 +40,11 @@ class Instance(object):
 
         V - node voltage vector
         V = [Vi ; Vp]
-        Vi - inner nodes voltage
+        Vi - unknowns: inner nodes voltage and currents of voltage sources
         Vp - port nodes vector
         Vi = Ap*Vp + V0
         Ap - linear function matrix (Attenuation matrix)
-        V0 - inner nodes voltage vector for Vp = 0
+        V0 - unknowns vector for Vp = 0
     
         By solving instance we provide thus Ap matrix and V0.
     """
@@ -62,8 +70,21 @@ class Instance(object):
         self.Ap = {}                    #dictionary form of attenuation matrix
         self.Ap_m = None                #Attenutation matrix
         self.V0_m = None                #vector of voltages on inner nets with zero port voltage vector
+        self.Ap_s = None                #lazy solution of attenuation matrix, entries calculated when needed
+        self.V0_s = None                #lazy solution of V0 vector, entries calculated when needed
         self.chained_ports = {}         #dictionary of port nets which are connected by voltage sources 
-        self.used_voltage_sources = []  #list of used voltage sources durring  check_voltage_loops procedure
+        self.sources = []               #list of (name,element,nets) of voltage sources which currents are unknowns of self
+        self.promoted = []              #list of (name,element,nets) of voltage sources which equations are written by parent
+        self.symmetry = []              #list of pairs of names of nets or elements (also subinstances) which are mirror images
+        self.reduced_nets = {}          #dictionary of nets removed by reduce() with their voltages: {net:{net:coefficient}}
+        self.reduced_elements = {}      #dictionary of elements removed (merged) by reduce() by their names
+        self.moved_nets = {}            #dictionary of name of subinstance made by partition() by names of nets moved into it
+        self.moved_elements = {}        #dictionary of name of subinstance made by partition() by names of elements moved into it
+        self.synthetic = False          #True for subinstances made by partition(), which aren't in netlist
+        self.lifted_nets = {}           #dictionary of name of subinstance by names of nets made for its chained nets
+        self.nested = False             #True if v0() and ap() give symbols standing for entries, see sequence()
+        self._template_key = None       #key identifying solution of instance, same for instances of same template
+        self._base = None               #factorized system: (engine, G_i, G_p, I_v, V0 and Ap lazy solutions)
 
     def add_element(self,element):
         """ Adds element to instance
@@ -259,17 +280,147 @@ class Instance(object):
                 logging.error("Voltage loop on nets: %s" % loop)
             return False
 
+    def check_singularity(self):
+        """ Checks that equations of self and subinstances can be solved, before they are solved symbolically
+
+            Equations are written for a copy of the hierarchy with random numbers in place of circuit symbols (and s).
+            Equations of each instance are first checked for structural singularity with maximum matching of their
+            non-zero pattern, which holds whatever values symbols have, then solved numerically, which finds (with high
+            probability) singularity for all values of symbols. Numeric solutions of subinstances are used to write
+            equations of their parents. Unknowns (nets and currents of voltage sources) which have no unique solution
+            are logged. Returns True if all instances can be solved.
+        """
+        parent,self.parent = self.parent,None
+        try:
+            instance = copy.deepcopy(self)
+        finally:
+            self.parent = parent
+        symbols = set([sympy.symbols('s')])
+        instances = [instance]
+        for subinstance in instances:
+            instances.extend(subinstance.subinstances.itervalues())
+            for element in subinstance.elements.itervalues():
+                element.values = [sympy.sympify(value) for value in element.values]
+                for value in element.values: symbols |= value.free_symbols
+        rnd = random.Random(0)
+        values = dict((symbol,rnd.uniform(0.5,2.0)) for symbol in sorted(symbols,key=str))
+        for subinstance in instances:
+            for element in subinstance.elements.itervalues():
+                element.values = [value.subs(values) for value in element.values]
+        return instance._check_singularity(values)
+
+    def _check_singularity(self,values):
+        """ Checks equations of self and subinstances, which elements have numeric values, and solves them
+
+            values: dictionary symbol:number, used to replace s which is brought into equations by elements
+
+            Returns True if all of them are non singular.
+        """
+        solved = True
+        for subname,subinstance in sorted(self.subinstances.iteritems()):
+            solved = subinstance._check_singularity(values) and solved
+        if not solved: return False
+        G_i,G_p,I_v = [dict((key,complex(sympy.sympify(value).subs(values))) for key,value in matrix.iteritems())
+                       for matrix in self._assemble()]
+        Ni = len(self.unknowns)
+        Np = len(self.port_nets)
+        rows,columns = scs_solver.unmatched(G_i,Ni)
+        if rows:
+            logging.error("Equations of %s are structurally singular, no independent equations for: %s" %
+                          (self.name if self.name else "TOP INSTANCE",', '.join(self.unknowns[j] for j in columns)))
+            return False
+        B = [[-G_p.get((i,j),0) for i in range(Ni)] for j in range(Np)] + [[I_v.get((i,0),0) for i in range(Ni)]]
+        X,null = scs_solver.numeric_solve(G_i,B,Ni)
+        if X is None:
+            logging.error("Equations of %s are singular, no unique solution for: %s" %
+                          (self.name if self.name else "TOP INSTANCE",', '.join(self.unknowns[j] for j in null)))
+            return False
+        self._set_solution(sympy.Matrix(Ni,1,X[-1]),sympy.Matrix(Ni,Np,lambda i,j: X[j][i]))
+        return True
+
+    def estimate(self,limit=1.0):
+        """ Predicts cost of solving self and subinstances with each of engines, without solving them
+
+            limit: instances predicted to be solved in less than limit seconds are solved, so that their parents are
+            predicted with real size of their entries
+
+            Equations are written for a copy of the hierarchy, from the bottom. Subinstances predicted to be cheap are
+            solved with predicted engine, as size of expressions of their solutions (nested in equations of their
+            parents, like parts made by partition) drives cost of their parents. For each other subinstance every entry
+            of its V0 (if it has sources) and Ap is set to product of symbols of its equations, which keeps symbols and
+            non-zero pattern of equations of its parent, but not size of expressions of subinstance solution, so
+            prediction for parents of expensive subinstances is lower than it would be. Instances are estimated without
+            splitting them into symmetric halves. Returns list of (name in dot notation, scs_solver.CostEstimate, shared)
+            for instances in order they are solved, shared is True for instance which would share solution of one
+            listed before it.
+        """
+        parent,self.parent = self.parent,None
+        try:
+            instance = copy.deepcopy(self)
+        finally:
+            self.parent = parent
+        estimates = []
+        instance._estimate('',estimates,{},limit)
+        return estimates
+
+    def _estimate(self,name,estimates,solutions,limit):
+        """ Predicts cost of solving self, after subinstances, and sets solution or placeholder solution of self
+
+            name: name of self in dot notation
+
+            estimates, solutions: list of estimates and dictionary of template_key:(V0_m,Ap_m) of already estimated
+            instances, both updated
+
+            limit: as in estimate
+        """
+        for subname,subinstance in sorted(self.subinstances.iteritems()):
+            subinstance._estimate('%s.%s' % (name,subname) if name else subname,estimates,solutions,limit)
+        key = self.template_key()
+        Ni = len(self.unknowns)
+        Np = len(self.port_nets)
+        G_i,G_p,I_v = self._assemble(exact=True)
+        G_i_m = sympy.SparseMatrix(Ni,Ni,G_i)
+        G_p_m = sympy.SparseMatrix(Ni,Np,G_p)
+        I_v_m = sympy.SparseMatrix(Ni,1,I_v)
+        estimate = scs_solver.CostEstimate(G_i_m,G_p_m.free_symbols | I_v_m.free_symbols,Np+1)
+        estimates.append((name,estimate,key in solutions))
+        if key not in solutions:
+            if self.parent and estimate.costs[estimate.engine] < limit:
+                self._factorize(G_i,G_p,I_v,estimate.engine,False,False)
+            else:
+                placeholder = sympy.Mul(*sorted(G_i_m.free_symbols | G_p_m.free_symbols | I_v_m.free_symbols,key=str))
+                self._set_solution(sympy.Matrix(Ni,1,lambda i,j: placeholder if I_v else 0),
+                                   sympy.Matrix(Ni,Np,lambda i,j: placeholder))
+            solutions.update({key:(self.V0_m,self.Ap_m)})
+        self._set_solution(*solutions[key])
+
     def _prepare_nets(self):
         """
-            Makes inner nets and port_nets list from elements_on_net dictionay
+            Makes inner nets and port_nets list from elements_on_net dictionay, and list of unknowns of equations
 
-            It also updates a net_name_index dictionary which holds a number for each net
+            It also updates a net_name_index dictionary which holds a number for each unknown and port net
             It makes easy to keep track of what position on vector is the value refering to.
+            Nets are sorted by name, so order of equations (and template key) doesn't depend on dictionary order.
+
+            Unknowns are inner nets voltages followed by currents of voltage sources (named i(source)) which equations
+            are written in self, ports get numbers after unknowns. Voltage source connected between ports (also one
+            promoted from subinstance) is promoted to parent, its current and equation are written there, unless it's
+            referenced by current controlled source of self. Inner nets joining ports through voltage sources are made
+            ports first (see _lift_chained_nets). Subinstances need to be prepared first.
         """
+        sources = []
+        for name,element in sorted(self.elements.iteritems()):
+            if isinstance(element,scs_elements.VoltageSource):
+                sources.append((name,element,tuple(element.nets[:2])))
+        for subname,subinstance in sorted(self.subinstances.iteritems()):
+            for name,element,nets in subinstance.promoted:
+                sources.append(('%s.%s' % (subname,name),element,tuple(subinstance.port_map[net] for net in nets)))
+        if self.parent: self._lift_chained_nets(sources)
+
         self.inner_nets = []
         self.port_nets = []        
         self.net_name_index = {}
-        for net in self.elements_on_net:            
+        for net in sorted(self.elements_on_net):            
             if net in self.port_map: 
                 self.port_nets.append(net)                
             elif (not net == '0') or (self.parent):
@@ -277,83 +428,226 @@ class Instance(object):
         
         self.nets = self.inner_nets + self.port_nets
 
-        for i in range(len(self.nets)):
-            self.net_name_index.update({self.nets[i]:i})
-  
-    def update_eq_with_vs(self,net,G_v,I,ignore_element = None):
-        """ Tries to update system of equations for finding solution with voltage source equation.
-                
-            net: net for which we try to make a equation for, from theory number of equations needed to solve a
-                circuit is same as number of nets
-            G_v: conductance vector forming a equation, to be updated by this function
-            I: current side of equation to be updated by this function
-            ignore_element: element which will be ignore while looking for equation
-
-            This procedure looks for unused voltage source to form another equation to system, on that net or if its a supernet
-            (few nets connected by voltage source) walk on through of any nets of that super ne, and see if any voltage
-            source wasn't used yet to form a equation. If no any such voltage source was found return false.
-            If voltage source is found update the equation and return true.
-        """
-        updated = False
-        for element in self.elements_on_net[net]:  
-            if element is ignore_element: continue             
-            if isinstance(element,scs_elements.VoltageSource) and (net in element.nets[:2]):
-                if (not element in self.used_voltage_sources):
-                    if element.nets[0] in self.net_name_index:G_v[self.net_name_index[element.nets[0]]] += 1
-                    if element.nets[1] in self.net_name_index: G_v[self.net_name_index[element.nets[1]]] += -1  
-                    if isinstance(element,scs_elements.VoltageControlledVoltageSource):
-                        if element.nets[2] in self.net_name_index: G_v[self.net_name_index[element.nets[2]]] += -element.values[0]
-                        if element.nets[3] in self.net_name_index: G_v[self.net_name_index[element.nets[3]]] += +element.values[0]
-                    elif isinstance(element,scs_elements.CurrentControlledVoltageSource): 
-                        if element.names[1] not in self.elements:
-                            raise "No such element %s referenced by %s" % (element.names[1],element.names[0])           
-                        ref_element = self.elements[element.names[1]]
-                        ref_net =ref_element.nets[0]            
-                        r = element.values[0]
-                        G_vx = [0 for i in range(len(self.nets))]
-                        Ix = [0]
-                        self.update_current_v(ref_element,ref_net,G_vx,Ix)
-                        I[0] += Ix[0]*r
-                        for i in range(len(G_v)): G_v[i] += r*G_vx[i]
-                    else: I[0] += element.values[0]
-                    self.used_voltage_sources.append(element)
-                    updated = True
-                    break
+        referenced = set(element.names[1] for element in self.elements.itervalues() if len(element.names) > 1)
+        self.sources = []
+        self.promoted = []
+        for name,element,nets in sources:
+            if self.parent and name not in referenced and all(net in self.port_map for net in nets):
+                self.promoted.append((name,element,nets))
+            else:
+                self.sources.append((name,element,nets))
+
+        self.unknowns = self.inner_nets + ['i(%s)' % name for name,element,nets in self.sources]
+        for i,unknown in enumerate(self.unknowns + self.port_nets):
+            self.net_name_index.update({unknown:i})
+
+    def _lift_chained_nets(self,sources):
+        """ Makes ports of inner nets which join two or more ports through voltage sources, done by _prepare_nets
+
+            sources: list of (name,element,nets) of voltage sources of self and of ones promoted from subinstances
+
+            Voltage of such net (like x of V1 a x and V2 x b between ports a and b) is fixed by port voltages and
+            currents of the sources only by the parent, so equations of self would be singular. Each of them is
+            connected as a port to new net of parent, named <name of self>:<net> and kept in lifted_nets of parent,
+            so the sources become sources between ports, which are promoted to the parent.
+        """
+        group = {}
+        def find(net):
+            while group.setdefault(net,net) != net: net = group[net]
+            return net
+        for name,element,nets in sources:
+            group[find(nets[0])] = find(nets[1])
+        ports = {}
+        for net in self.port_map:
+            if net in group: ports[find(net)] = ports.get(find(net),0) + 1
+        for net in sorted(group):
+            if net in self.port_map or ports.get(find(net),0) < 2: continue
+            parent_net = '%s:%s' % (self.name,net)
+            self.port_map.update({net:parent_net})
+            self.parent.lifted_nets.update({parent_net:self.name})
+            if self.parent.subinstances.get(self.name) is self:
+                self.parent.elements_on_net.setdefault(parent_net,[]).append(self)
+            self._template_key = None
+            self.parent._template_key = None
+            logging.info("Net %s of %s joins ports through voltage sources, connected to %s of parent" %
+                         (net,self.name,parent_net))
+
+    def reduce(self,keep=()):
+        """ Topological reduction of self and subinstances, done before solving
+
+            keep: names (in dot notation) of elements and nets which are left as they are, like ones to be altered
+
+            Passive elements connected in parallel are merged into one admittance, and inner nets which have only
+            passive elements on them are removed: when all of them go to one net (dangling net) they are dropped, as no
+            current flows through them, when they go to two nets (series connection) they are replaced with one
+            admittance y1*y2/(y1+y2). It's repeated until nothing changes, so ladders of series and parallel elements
+            collapse into single admittances and there are fewer unknowns to be solved for. Ports, nets of subinstances,
+            control nets and elements referenced by current controlled sources are never removed.
+            Removed nets and elements are kept in reduced_nets and reduced_elements, so v() and i() still work for
+            them: voltage of removed net is the mean of voltages of its neighbours weighted by their admittances.
+            Returns number of removed nets.
+        """
+        removed = 0
+        for subname,subinstance in sorted(self.subinstances.iteritems()):
+            removed += subinstance.reduce([name.split('.',1)[1] for name in keep if name.startswith(subname+'.')])
+        referenced = set(element.names[1] for element in self.elements.itervalues() if len(element.names) > 1)
+        referenced.update(keep)
+
+        def mergeable(element):
+            return (isinstance(element,scs_elements.PassiveElement) and element.names[0] not in referenced and
+                    element.nets[0] != element.nets[1])
+
+        changed = True
+        while changed:
+            changed = False
+            branches = {}
+            for name,element in sorted(self.elements.iteritems()):
+                if mergeable(element):
+                    branches.setdefault(tuple(sorted(element.nets[:2])),[]).append(element)
+            for nets,elements in sorted(branches.iteritems()):
+                if len(elements) > 1:
+                    self._merge(elements,'(%s)' % '|'.join(element.names[0] for element in elements),nets,
+                                sum(element.conductance() for element in elements))
+                    changed = True
+            for net in sorted(self.elements_on_net):
+                elements = list(self.elements_on_net[net])
+                if (net in self.port_map or net in referenced or (net == '0' and not self.parent) or not
+                    all(isinstance(element,scs_elements.Element) and mergeable(element) and net in element.nets[:2]
+                        for element in elements)):
+                    continue
+                neighbours = [element.nets[1] if element.nets[0] == net else element.nets[0] for element in elements]
+                if len(elements) == 1:
+                    self._merge(elements)
+                    self.reduced_nets.update({net:{neighbours[0]:1}})
+                elif len(elements) == 2:
+                    y1,y2 = [element.conductance() for element in elements]
+                    self._merge(elements,'(%s)' % '+'.join(element.names[0] for element in elements),neighbours,
+                                y1*y2/(y1+y2))
+                    self.reduced_nets.update({net:{neighbours[0]:y1/(y1+y2),neighbours[1]:y2/(y1+y2)}})
                 else:
-                    other_net = element.nets[0] if element.nets[1] == net else element.nets[1]
-                    updated = self.update_eq_with_vs(other_net,G_v,I,element)                    
-            elif isinstance(element,Instance):
-                ports = inv_map(element.port_map)[net]
-                for port in ports:
-                    for subelement in element.elements_on_net[port]:
-                        if isinstance(subelement,scs_elements.VoltageSource) and (port in subelement.nets[:2]):
-                            if (not subelement in element.used_voltage_sources):
-                                G_d,I_port = element.port_voltage(port,subelement)
-                                for port,g in G_d.iteritems():
-                                    if element.port_map[port] in self.net_name_index: G_v[self.net_name_index[element.port_map[port]]] += g
-                                I[0] += I_port
-                                element.used_voltage_sources.append(subelement)
-                                updated = True
-                                break
-                            else:
-                                G_i = [0 for i in range(len(element.nets))]
-                                G_pd = {}                                
-                                other_subnet = subelement.nets[0] if subelement.nets[1] == port else subelement.nets[1]
-                                if element.update_eq_with_vs(other_subnet,G_i,I,subelement):                                    
-                                    i = 0
-                                    for port_net in self.port_nets:
-                                        G_pd.update({port_net:G_pv[i]})
-                                        i = i + 1
-                                    for port,g in G_d.iteritems():
-                                        if element.port_map[port] in self.net_name_index: G_v[self.net_name_index[element.port_map[port]]] += g
-                                    updated = True
-                    if updated: break
-                if updated: break
-        if not updated and net in self.port_map: 
-            updadated = self.parent.update_eq_with_vs(self.port_map[net],G_v,I,self)
-        return updated
-    
-    def solve(self):
+                    continue
+                del self.elements_on_net[net]
+                removed += 1
+                changed = True
+                break
+        self._template_key = None
+        self._prepare_nets()
+        return removed
+
+    def _merge(self,elements,name=None,nets=None,value=None):
+        """ Replaces elements of self with one admittance
+
+            elements: list of elements which are removed
+
+            name, nets, value: name, nets and value of admittance which replaces them, if name is None elements are
+            just removed
+
+            Removed elements (other than admittances made by earlier merges) are kept in reduced_elements.
+        """
+        for element in elements:
+            for net in element.nets:
+                if net in self.elements_on_net and element in self.elements_on_net[net]:
+                    self.elements_on_net[net].remove(element)
+            del self.elements[element.names[0]]
+            if not isinstance(element,scs_elements.Admittance):
+                self.reduced_elements.update({element.names[0]:element})
+        if name is not None:
+            self.add_element(scs_elements.Admittance(name,list(nets),value))
+
+    def partition(self,max_nets=10,keep=()):
+        """ Tears self and subinstances with too many inner nets into synthetic subinstances, done before solving
+
+            max_nets: instances with more inner nets (not counting nets of subinstances) are partitioned
+
+            keep: names (in dot notation) of nets which are left in instance they are, like nets of elements to be
+            added by alter
+
+            Elements which are connected to each other by inner nets are split into parts: connected components if
+            there are more than one, otherwise nets are ordered by breadth first search from a peripheral net and the
+            level of search with the smallest number of nets splitting the rest into two halves is taken as separator.
+            Each part is moved into new subinstance (named _p<n>), whose ports are separator nets, ports of self and
+            nets of other subinstances, and which is partitioned further if it's still too large. So flat netlists
+            are solved by hierarchical path as well. Current controlled sources are kept with elements they refer to, and
+            nets joined by voltage sources are never split.
+            Moved nets and elements are kept in moved_nets and moved_elements, so v(), i() and alter_element() still
+            work with their old names. Returns number of made subinstances.
+        """
+        parts = 0
+        for subname,subinstance in sorted(self.subinstances.iteritems()):
+            parts += subinstance.partition(max_nets,[name.split('.',1)[1] for name in keep if name.startswith(subname+'.')])
+        fixed = set(self.port_map) | set(keep)
+        for subinstance in self.subinstances.itervalues():
+            fixed.update(subinstance.port_map.itervalues())
+        if not self.parent: fixed.add('0')
+
+        # Elements referenced by current controlled sources go together with them
+        blocks = dict((name,set([name])) for name in self.elements)
+        for name,element in self.elements.iteritems():
+            if len(element.names) > 1 and element.names[1] in blocks:
+                block = blocks[name] | blocks[element.names[1]]
+                for member in block: blocks.update({member:block})
+
+        # Nets joined by voltage sources, and nets of current controlled sources with nets of voltage sources they
+        # refer to, are kept together (so their root net stands for all of them), otherwise a part could have voltage
+        # source between its ports which current it couldn't find
+        root = dict((net,net) for net in self.elements_on_net)
+        def find(net):
+            while root[net] != net: net = root[net]
+            return net
+        def join(nets):
+            roots = [find(net) for net in nets]
+            for net in roots: root.update({net:min(roots)})
+        for name,element in sorted(self.elements.iteritems()):
+            if isinstance(element,scs_elements.VoltageSource): join(element.nets[:2])
+            if len(element.names) > 1 and isinstance(self.elements.get(element.names[1]),scs_elements.VoltageSource):
+                join(element.nets + self.elements[element.names[1]].nets[:2])
+        members = {}
+        for net in self.elements_on_net:
+            members.setdefault(find(net),set()).add(net)
+        fixed = set(find(net) for net in fixed if net in root)
+
+        adjacent = {}
+        block_nets = []
+        for block in set(frozenset(block) for block in blocks.itervalues()):
+            nets = set(find(net) for name in block for net in self.elements[name].nets) - fixed
+            block_nets.append((sorted(block),nets))
+            for net in nets:
+                adjacent.setdefault(net,set()).update(nets - set([net]))
+        if sum(len(members[net]) for net in adjacent) <= max_nets: return parts
+
+        groups = _tear(adjacent)
+        if not groups: return parts
+        for group in groups:
+            n = len(self.subinstances)
+            while '_p%d' % n in self.subinstances: n += 1
+            name = '_p%d' % n
+            elements = [self.elements[ename] for block,nets in block_nets if nets & group for ename in block]
+            group = set(net for net in group for net in members[net])
+            nets = set(net for element in elements for net in element.nets)
+            subinstance = Instance(self,name,dict((net,net) for net in sorted(nets - group)))
+            subinstance.paramsd = self.paramsd
+            subinstance.synthetic = True
+            for element in elements:
+                for net in element.nets:
+                    if element in self.elements_on_net.get(net,[]):
+                        self.elements_on_net[net].remove(element)
+                del self.elements[element.names[0]]
+                subinstance.add_element(element)
+                self.moved_elements.update({element.names[0]:name})
+            for net in group:
+                del self.elements_on_net[net]
+                self.moved_nets.update({net:name})
+            self.add_sub_instance(subinstance)
+            subinstance._prepare_nets()
+            parts += 1 + subinstance.partition(max_nets)
+        logging.info("Instance %s partitioned into %s" % (self.name if self.name else "TOP INSTANCE",
+                     ', '.join('%d nets' % sum(len(members[net]) for net in group) for group in groups)))
+        self._template_key = None
+        self._prepare_nets()
+        return parts
+
+    def solve(self,engine='auto',lazy=False,templates=None,jobs=1,exact=False,approximation=None,symmetry=True,
+              workers=None,nested=False):
         """ Solves the instance that is:
 
             V - node voltage vector
@@ -373,224 +667,861 @@ class Instance(object):
             Vi = Ap*Vp + V0
             
             Thus we update G matrix (write the equations), and by doing linear algebra we calculate the results.
+
+            engine: name of elimination engine from scs_solver.engined used to solve the system, same engine is used
+            for all subinstances, or 'auto' to pick for each instance the engine with the lowest cost predicted by
+            scs_solver.CostEstimate (choice and prediction are logged)
+
+            lazy: if True only factorization is done, and entries of V0 and Ap are calculated when they are needed
+            by v(), i(), isub() or by parent instance, same for all subinstances
+
+            templates: dictionary of template_key:solution of already solved instances, if instance with the same
+            template key was already solved its solution is shared (read-only) instead of solving it again.
+            On default new dictionary is made and passed to all subinstances.
+
+            jobs: number of worker processes, if more than 1 subinstances of self are solved in parallel in a pool of
+            processes (always fully, not lazy), and their solutions are put into templates dictionary, and large entries
+            of equations (and of V0 and Ap, if engine doesn't give them in canonical form) are cancelled in a pool too
+
+            exact: if True equations are written over exact domain: floats are replaced with rationals and matrices are
+            kept as rational functions of circuit symbols (scs_solver.ExactMatrix) through the elimination, solution
+            is converted into sympy expressions only at the end, same for all subinstances
+
+            approximation: tuple of dictionary of nominal values of symbols (symbol:number) and tolerance, if given
+            instances are solved with scs_solver.DDDEngine (whatever engine is given) dropping terms which are
+            insignificant at nominal values, which keeps expressions small for circuits too large for exact analysis.
+            Achieved error of each instance is logged.
+
+            symmetry: if True equations of instance which are symmetric for swapping pairs of unknowns (mirror image
+            nets of differential circuit, as declared by .symmetry or found in equations) are solved as differential
+            and common mode halves with scs_solver.SymmetricEngine, same for all subinstances
+
+            workers: pool of workers on other hosts (scs_worker.WorkerPool), if given subinstances of self are solved
+            by workers instead of a pool of local processes (jobs is then used only for cancelling), same for all
+            subinstances
+
+            nested: if True solution is kept as a sequence of expressions: entries of V0 and Ap of each instance are
+            used by its parent (and by v(), i() and isub()) as symbols standing for them, so equations of parent are
+            written with these symbols instead of expanded expressions, and values are expressions of symbols which
+            definitions are given by sequence(), same for all subinstances
             
         """
+        if templates is None: templates = {}
+        self.nested = nested
+        if jobs > 1 or workers is not None:
+            self._solve_subinstances_in_pool(engine,jobs,templates,exact,approximation,symmetry,workers,nested)
         for subname,subinstance in self.subinstances.iteritems():
-            subinstance.solve()       
-        
-        N = len(self.nets)
+            subinstance.solve(engine,lazy,templates,jobs,exact,approximation,symmetry,workers,nested)
+
+        key = self.template_key()
+        if key in templates:
+            self.V0_s,self.Ap_s,self.V0_m,self.Ap_m,self.V0,self.Ap = templates[key]
+            self._base = None
+            return
+    
+        G_i,G_p,I_v = self._assemble(exact,jobs=jobs)
+        self._factorize(G_i,G_p,I_v,engine,lazy,exact,approximation,symmetry,jobs)
+        templates.update({key:(self.V0_s,self.Ap_s,self.V0_m,self.Ap_m,self.V0,self.Ap)})
+
+    def _assemble(self,exact=False,rhs=False,jobs=1):
+        """ Writes equations of unknowns: G_i*Vi + G_p*Vp = I_v
+
+            exact: if True entries are left as they were written, as they will be converted into exact domain,
+            otherwise they are cancelled
+
+            rhs: if True only right hand side I_v is written, G_i and G_p are left empty
+
+            jobs: number of processes cancelling entries, see _cancel_entries
+
+            Equations are written in modified nodal analysis form, in one pass over elements and subinstances: each
+            of them stamps its current into Kirchhoff's current law equations of inner nets it's connected to (subinstance
+            with currents of its ports), and each voltage source of self.sources adds its own equation.
+            Returns sparse matrices G_i, G_p and I_v as dictionaries (row,column):value of non-zero entries.
+        """
         Ni = len(self.inner_nets)
+        Nu = len(self.unknowns)
+        G_v = [{} for row in range(Nu)]
+        I = [0]*Nu
+
+        def add_current(net,G_c,I_c,sign):
+            # Current G_c*V + I_c flowing out of net
+            if net not in self.net_name_index or self.net_name_index[net] >= Ni: return
+            row = self.net_name_index[net]
+            for i,g in G_c.iteritems(): G_v[row][i] = G_v[row].get(i,0) + sign*g
+            I[row] -= sign*I_c
+
+        promoted = set(name for name,element,nets in self.promoted)
+        for name,element in sorted(self.elements.iteritems()):
+            if name in promoted: continue
+            G_c,I_c = self.element_current(element)
+            add_current(element.nets[0],G_c,I_c,1)
+            add_current(element.nets[1],G_c,I_c,-1)
+        for subname,subinstance in sorted(self.subinstances.iteritems()):
+            for port,net in sorted(subinstance.port_map.iteritems()):
+                if port in subinstance.net_name_index:
+                    G_c,I_c,B = self._subinstance_current(subinstance,port)
+                    add_current(net,G_c,I_c,1)
+        for k,(name,element,nets) in enumerate(self.sources):
+            G_v[Ni+k],I[Ni+k] = self.source_equation(name)
+
+        # Entries are cancelled all at once, so that they can be shared between worker processes
+        keys = []
+        values = []
+        for row in range(Nu):
+            for column,g in ([] if rhs else sorted(G_v[row].iteritems())):
+                if g != 0:
+                    keys.append((row,column))
+                    values.append(g)
+            if I[row] != 0:
+                keys.append((row,None))
+                values.append(I[row])
+        if not exact: values = _cancel_entries(values,jobs)
+
+        G_i = {}
+        G_p = {}
+        I_v = {}
+        for (row,column),g in zip(keys,values):
+            if g == 0: continue
+            elif column is None: I_v.update({(row,0):g})
+            elif column < Nu: G_i.update({(row,column):g})
+            else: G_p.update({(row,column-Nu):g})
+        return G_i,G_p,I_v
+
+    def _factorize(self,G_i,G_p,I_v,engine,lazy,exact,approximation=None,symmetry=False,jobs=1):
+        """ Factorizes G_i with engine and provides V0 and Ap
+
+            G_i, G_p, I_v: sparse matrices of equations as provided by _assemble
+
+            engine, lazy, exact, approximation, symmetry, jobs: as in solve
+
+            Factorized system is kept as a base for low-rank updates made by alter_element.
+        """
+        Ni = len(self.unknowns)
         Np = len(self.port_nets)
-        for i in range(N):
-            self.net_name_index.update({self.nets[i]:i})
-    
-        G_m = []
-        I_v = []
-        self.used_voltage_sources = []        
-
-        for net in self.inner_nets:
-            G_v = [0 for i in range(len(self.nets))]
-            I = [0]
-            if not self.update_eq_with_vs(net,G_v,I):
-                for element in self.elements_on_net[net]:
-                    self.update_current_v(element,net,G_v,I)
-            #G_m.append(G_v)
-            G_m.append([sympy.cancel(tmp) for tmp in G_v])
-            I_v.append([sympy.cancel(tmp) for tmp in I])
-            
-        #Make and slice the Matrix G_M = [G_i | G_p]
-        G_m = sympy.Matrix(G_m)
-        I_v = sympy.Matrix(I_v)
-        G_i = G_m[:,:Ni]
-        G_p = G_m[:,Ni:]
+        base = (G_i,G_p,I_v)
+        #Make the matrices G_i, G_p and I_v
+        if exact:
+            G_i,G_p,I_v = scs_solver.ExactMatrix.from_dok([(G_i,Ni,Ni),(G_p,Ni,Np),(I_v,Ni,1)])
+        else:
+            G_i = sympy.SparseMatrix(Ni,Ni,G_i)
+            G_p = sympy.SparseMatrix(Ni,Np,G_p)
+            I_v = sympy.SparseMatrix(Ni,1,I_v)
                 
         # G_i*V_i + G_p*V_p  = I_v
         # V_i = G_i^-1 I_v - G_i^-1 * G_p * V_p
         # V_i = Vo +Ap * vp
+        if approximation is not None:
+            engine_class = lambda G,symbols: scs_solver.DDDEngine(G,symbols,approximation)
+        elif engine == 'auto':
+            engine_class = lambda G,symbols: scs_solver.engined[self._choose_engine(G,symbols,Np+1)](G,symbols)
+        else:
+            engine_class = scs_solver.engined[engine]
+        pairs = self._symmetry_pairs(G_i) if symmetry else None
         try:
-            G_i_inv = G_i.inv() 
+            if pairs:
+                logging.info("Solving %s: split into %d differential and %d common mode unknowns, pairs %s" %
+                             (self.name if self.name else "TOP INSTANCE",len(pairs),Ni-len(pairs),
+                              [(self.unknowns[a],self.unknowns[a2]) for a,a2 in pairs]))
+                G_i_fact = scs_solver.SymmetricEngine(G_i,pairs,engine_class,I_v.free_symbols | G_p.free_symbols)
+            else:
+                G_i_fact = engine_class(G_i,I_v.free_symbols | G_p.free_symbols)
         except ValueError, e:
             raise scs_errors.ScsElementError("%s is ill conditioned, and has no unique solution." % self.name if self.name else "TOP INSTANCE")
-        self.V0_m = G_i_inv*I_v
-        self.Ap_m = -G_i_inv*G_p
+        if getattr(G_i_fact,'fill',None) is not None:
+            logging.info("Solving %s: %d unknowns eliminated in order %s, predicted fill-in %d" %
+                         (self.name if self.name else "TOP INSTANCE",Ni,[self.unknowns[k] for k in G_i_fact.order],G_i_fact.fill))
+        self.V0_s = scs_solver.LazySolution(G_i_fact,I_v)
+        self.Ap_s = scs_solver.LazySolution(G_i_fact,-G_p)
+        self._base = (G_i_fact,) + base + (self.V0_s,self.Ap_s)
+        self.V0 = {}
+        self.Ap = {}
+        self.V0_m = None
+        self.Ap_m = None
+        if not lazy:
+            V0_m,Ap_m = self.V0_s.matrix(),self.Ap_s.matrix()
+            if not getattr(G_i_fact,'canonical',True):
+                values = _cancel_entries(list(V0_m) + list(Ap_m),jobs)
+                V0_m,Ap_m = sympy.Matrix(Ni,1,values[:Ni]),sympy.Matrix(Ni,Np,values[Ni:])
+            self._set_solution(V0_m,Ap_m)
+        if approximation is not None:
+            log = logging.warning if G_i_fact.error > approximation[1] else logging.info
+            log("Approximated %s: largest relative error of coefficients %g, tolerance %g" %
+                (self.name if self.name else "TOP INSTANCE",G_i_fact.error,approximation[1]))
+
+    def _choose_engine(self,G,symbols,columns):
+        """ Picks engine which is predicted to solve the system in the shortest time, and logs the prediction
+
+            G: sympy Matrix or ExactMatrix of the system
+
+            symbols: symbols which can appear in right hand sides
+
+            columns: number of right hand sides
+        """
+        estimate = scs_solver.CostEstimate(G,symbols,columns)
+        logging.info("Solving %s: %s engine chosen for %d unknowns, %d ports and %d symbols%s, predicted time: %s" %
+                     (self.name if self.name else "TOP INSTANCE",estimate.engine,estimate.n,columns-1,estimate.symbols,
+                      " with s" if estimate.s else "",
+                      ', '.join("%s %.3g s" % (engine,estimate.costs[engine]) for engine in sorted(estimate.costs))))
+        return estimate.engine
+
+    def _symmetry_pairs(self,G_i):
+        """ Provides pairs of indexes of unknowns for which G_i is symmetric
+
+            G_i: matrix of equations
+
+            Unknowns are paired as declared by .symmetry (nets, and currents of voltage sources of paired elements or
+            subinstances), if that doesn't hold or there is no declaration, pairs are looked for in G_i.
+            Returns list of pairs or None.
+        """
+        if self.symmetry:
+            mirror = {}
+            for a,b in self.symmetry:
+                mirror.update({a:b,b:a})
+            pairs = []
+            for i,unknown in enumerate(self.unknowns):
+                if unknown.startswith('i('):
+                    names = unknown[2:-1].split('.',1)
+                    names[0] = mirror.get(names[0],names[0])
+                    image = 'i(%s)' % '.'.join(names)
+                else: image = mirror.get(unknown,unknown)
+                j = self.net_name_index.get(image)
+                if j is not None and i < j < len(self.unknowns): pairs.append((i,j))
+            pairs = scs_solver.symmetry_pairs(G_i,pairs)
+            if pairs: return pairs
+            logging.warning("Declared symmetry of %s doesn't hold for its equations" % (self.name if self.name else "TOP INSTANCE"))
+        return scs_solver.symmetry_pairs(G_i)
+
+    def _set_solution(self,V0_m,Ap_m):
+        """ Sets V0 and Ap matrices and their dictionary forms
+
+            V0_m: vector of unknowns (voltages on inner nets and currents of voltage sources) with zero port voltages
+
+            Ap_m: attenuation matrix
+        """
+        self.V0_m = V0_m
+        self.Ap_m = Ap_m
 
         #Translate those into dictionaries
-        for i in range(Ni):
-            self.V0.update({self.inner_nets[i]:self.V0_m[i]})
+        self.V0 = {}
+        self.Ap = {}
+        for i in range(len(self.unknowns)):
+            self.V0.update({self.unknowns[i]:self.V0_m[i]})
         
-        for j in range(Np):
+        for j in range(len(self.port_nets)):
             tmp_dict = {}
-            for i in range(Ni):
-                tmp_dict.update({self.inner_nets[i]:self.Ap_m[i,j]})
+            for i in range(len(self.unknowns)):
+                tmp_dict.update({self.unknowns[i]:self.Ap_m[i,j]})
             self.Ap.update({self.port_nets[j]:tmp_dict})
-             
-    def adjoint_elements(self,refelement,net):
-        """ Provides list of pairs of element,net that are adjoint to reference element on provided net
-            
-            refelement: reference element
-            net: name of the net where we search for adjoint element
 
-            If net is part of supernet all nets in supernet will be search and be put on output. Returns list of pair [(element,net) ... ].
-        """
-        elements_nets = []
-        for element in self.elements_on_net[net]:
-            if not element is refelement:
-                if isinstance(element,scs_elements.VoltageSource):
-                    elements_nets = self.adjoint_elements(element,element.nets[0] if element.nets[1] == net else element.nets[1])
-                else: elements_nets.append((element,element.nets[1] if element.nets[0] == net else element.nets[0]))
-        return elements_nets
-           
-    def update_current_v(self,element,net,G_v,I):
-        """ Updates conductance vector and current part of equation for net.
+    def alter_element(self,name,element,engine='auto',exact=False,low_rank=False,approximation=None,symmetry=True):
+        """ Replaces (or adds) element of solved instance and updates solution without solving whole hierarchy again
 
-            element: element whos current will be added to eqution
-            net: net for which we write the equation
-            G_v: conductance vector to be updated by the element
-            I: current to be updated by the element
+            name: name of the element, can be in dot notation to alter element of subinstance
 
-            For passive elements it will be as current flowing out of the net. For current source,
-            the other side of equation will be udateded so it will be current flowing into the net.
-            
+            element: element template (scs_circuit.Element) of new element, which is evaluated with parameters of
+            instance owning it, its nets need to be nets which already are in that instance
+
+            engine: name of engine used to factorize changed instances, or 'auto', as in solve
+
+            exact: if True equations are written over exact domain, as in solve
+
+            approximation: nominal values and tolerance, as in solve, changed instances are approximated with them
+
+            symmetry: if True changed instances are split into differential and common mode halves, as in solve
+
+            low_rank: if True (and engine supports it), instead of factorizing changed equations again, solution of already factorized system
+            G*X = B is updated with Sherman-Morrison-Woodbury formula:
+            (G + E*dG)^-1 = G^-1 - G^-1*E*(I + dG*G^-1*E)^-1*dG*G^-1
+            where E selects k changed rows, so only k new right hand sides are solved with existing factorization
+            (used when no more than half of equations changed). Symbolic entries of update grow as large as those of
+            back substitution, so it pays off only when factorization is expensive compared to it.
+
+            Changing an element changes only equations of instance owning it and of its parents (as port currents of
+            subinstance change), so only those instances are solved again, other instances (also ones sharing the
+            solution with changed one) are left as they are. Changed instances are left fully (not lazy) solved.
         """
-        
-        if isinstance(element,scs_elements.Element) and (net in element.nets[:2]):
-            other_net  = element.nets[1] if (net == element.nets[0]) else element.nets[0]
-            
-            if isinstance(element,scs_elements.VoltageSource):                
-                for other_net_element in self.elements_on_net[other_net]:
-                    if not other_net_element is element: self.update_current_v(other_net_element,other_net,G_v,I)
-            elif isinstance(element,scs_elements.PassiveElement):
-                g = element.conductance()
-                if net in self.net_name_index: G_v[self.net_name_index[net]] += g
-                if other_net in self.net_name_index: G_v[self.net_name_index[other_net]] -= g
-            elif isinstance(element,scs_elements.VoltageControlledCurrentSource):
-                gm = (element.values[0] if element.nets[0] == net else -element.values[0])
-                if element.nets[3] in self.net_name_index: G_v[self.net_name_index[element.nets[3]]] += gm
-                if element.nets[2] in self.net_name_index: G_v[self.net_name_index[element.nets[2]]] -= gm   
-            elif isinstance(element,scs_elements.CurrentControlledCurrentSource):         
-                ref_element = self.elements[element.names[1]]
-                ref_net =ref_element.nets[0]
-                refelements_nets = [(ref_element,1)]
-                if isinstance(ref_element,scs_elements.VoltageSource):
-                    refelements_nets = self.adjoint_elements(ref_element,ref_net)                
-                a = 0
-                G_vx = [0 for i in range(len(self.nets))]
-                Ix = [0]
-                for ref_element,ref_net in refelements_nets:
-                    if ref_element is element: a += (1 if ref_net == element.nets[0] else -1)
-                    else: self.update_current_v(ref_element,ref_net,G_vx,Ix)
-                a = 1 - a*element.values[0]
-                if a: a = element.values[0]/a
-                else: raise scs_errors.ScsInstanceError("Error: ill conditioned current controlled source")
-               
-                for i in range(len(G_vx)): G_v[i] += a*G_vx[i]
-                I[0] += a*Ix[0]
-            elif isinstance(element,scs_elements.CurrentSource):
-                I[0] += (element.values[0] if element.nets[0] == net else -element.values[0])
-        elif isinstance(element,Instance):
-                port_nets = inv_map(element.port_map)[net]
-                #Check if it is connected, if it is we need to take into account the chain voltage, not current
-                for port_net in port_nets:
-                    G_d,I_port,other_ports = element.port_current(port_net)
-                    for port,g in G_d.iteritems():
-                        if element.port_map[port] in self.net_name_index: G_v[self.net_name_index[element.port_map[port]]] += g
-                    I[0] += I_port
-                    for other_port in other_ports:
-                        for other_port_element in self.elements_on_net[element.port_map[other_port]]:
-                            if not other_port_element is element: self.update_current_v(other_port_element,element.port_map[other_port],G_v,I)
-
-    def current_v(self,element,net):
-        """ Provide current thruogh element flowing out of the net.
-    
-            element: element for which we calculate the current
-            net: net out of which current flows through a element.
+        hier_name = name.split('.')
+        instance = self
+        for subname in hier_name[:-1]:
+            if subname not in instance.subinstances:
+                raise scs_errors.ScsInstanceError("No %s subinstance in %s" % (subname,instance.name if instance.name else "TOP INSTANCE"))
+            instance = instance.subinstances[subname]
+        ename = hier_name[-1]
+        while ename in instance.moved_elements:
+            instance = instance.subinstances[instance.moved_elements[ename]]
+        if ename in instance.reduced_elements:
+            raise scs_errors.ScsInstanceError("Can't alter %s, it was merged by topological reduction" % name)
+        levels = [instance]
+        while levels[-1].parent:
+            levels.append(levels[-1].parent)
+        if ename[0] not in scs_elements.elementd:
+            raise scs_errors.ScsInstanceError("No element of that type: %s" % ename)
+        try:
+            new_element = scs_elements.elementd[ename[0]](ename,element,instance.paramsd,instance.parent)
+        except (scs_errors.ScsParameterError,scs_errors.ScsElementError),e:
+            raise scs_errors.ScsInstanceError("Error evaluating parametrs for element: %s. %s" % (name,e))
+        for net in new_element.nets[:2] if isinstance(new_element,scs_elements.PassiveElement) else new_element.nets:
+            if net not in instance.elements_on_net:
+                raise scs_errors.ScsInstanceError("Can't alter %s, net %s is not in instance %s." % (name,net,instance.name if instance.name else "TOP INSTANCE"))
+
+        # Equations each instance was factorized with, if instance shares solution of other instance, they are the same
+        # as its current equations
+        for level in levels:
+            if low_rank and level._base is None and level.V0_s is not None:
+                level._base = (level.V0_s.engine,) + level._assemble(exact) + (level.V0_s,level.Ap_s)
+
+        unknowns = [level.unknowns for level in levels]
+        if ename in instance.elements:
+            old_element = instance.elements[ename]
+            for net in old_element.nets:
+                if net in instance.elements_on_net and old_element in instance.elements_on_net[net]:
+                    instance.elements_on_net[net].remove(old_element)
+        instance.add_element(new_element)
+
+        # Adding or removing voltage source changes unknowns, then equations are factorized again
+        for level,level_unknowns in zip(levels,unknowns):
+            level._template_key = None
+            level._prepare_nets()
+            level._update_solution(level._assemble(exact),engine,exact,low_rank and level.unknowns == level_unknowns,approximation,symmetry)
+        levels[-1]._clear_voltages()
+
+    def transfer(self,sources,outputs):
+        """ Provides transfer functions from independent sources to outputs, reusing factorization of solved instances
+
+            sources: names (in dot notation) of independent voltage and current sources
+
+            outputs: function which takes self and returns list of output values, which need to be linear in sources
+            (like voltages and currents)
+
+            For each source, all independent sources are set to 0 and that one to 1, right hand sides of equations of
+            instance having the source and of its parents are written again and solved with factorization they
+            already have, as one more column next to V0, so outputs give transfer functions from that source. That
+            way N outputs by M sources cost M right hand sides instead of M solves. Instances solved from the cache
+            (which keeps no factorization) are factorized again. Returns list of rows of transfer functions, one row
+            for each output with one entry for each source.
+        """
+        selected = [self._independent_source(name) for name in sources]
+        instances = [self]
+        independent = []
+        for instance in instances:
+            instances.extend(subinstance for name,subinstance in sorted(instance.subinstances.iteritems()))
+            for name,element in sorted(instance.elements.iteritems()):
+                if type(element) in (scs_elements.VoltageSource,scs_elements.CurrentSource):
+                    independent.append(element)
+        for instance in instances:
+            if instance.V0_s is None:
+                instance._factorize(*instance._assemble(),engine='bareiss',lazy=True,exact=False)
+        values = [element.values[0] for element in independent]
+        states = [(instance,instance.V0_s,instance.V0_m,instance.V0,instance.nested) for instance in instances]
+        columns = []
+        try:
+            for owner,source in selected:
+                for element in independent:
+                    element.values[0] = 1 if element is source else 0
+                parents = [owner]
+                while parents[-1].parent: parents.append(parents[-1].parent)
+                # Subinstances go before their parents, which use their solutions. Symbols of nested mode stand for
+                # V0 of solved instances, so entries are used as they are (ones of Ap still use symbols of subinstances)
+                for instance,V0_s,V0_m,V0,nested in reversed(states):
+                    instance.V0_m = None
+                    instance.nested = False
+                    if instance in parents:
+                        instance.V0 = {}
+                        exact = isinstance(V0_s.B,scs_solver.ExactMatrix)
+                        instance.V0_s = instance._source_solution(V0_s,instance._assemble(exact,True)[2])
+                    else:
+                        instance.V0 = dict((unknown,0) for unknown in instance.unknowns)
+                self._clear_voltages()
+                columns.append(outputs(self))
+        finally:
+            for element,value in zip(independent,values):
+                element.values[0] = value
+            for instance,V0_s,V0_m,V0,nested in states:
+                instance.V0_s,instance.V0_m,instance.V0,instance.nested = V0_s,V0_m,V0,nested
+            self._clear_voltages()
+        return [list(row) for row in zip(*columns)]
+
+    def _independent_source(self,name):
+        """ Finds independent voltage or current source
+
+            name: name of the source, can be in dot notation
+
+            Returns instance owning the source and the source.
+        """
+        hier_name = name.split('.')
+        instance = self
+        for subname in hier_name[:-1]:
+            if subname not in instance.subinstances:
+                raise scs_errors.ScsInstanceError("No %s subinstance in %s" % (subname,instance.name if instance.name else "TOP INSTANCE"))
+            instance = instance.subinstances[subname]
+        while hier_name[-1] in instance.moved_elements:
+            instance = instance.subinstances[instance.moved_elements[hier_name[-1]]]
+        element = instance.elements.get(hier_name[-1])
+        if type(element) not in (scs_elements.VoltageSource,scs_elements.CurrentSource):
+            raise scs_errors.ScsInstanceError("%s is not an independent voltage or current source" % name)
+        return instance,element
+
+    def _source_solution(self,V0_s,I_v):
+        """ Provides lazy solution for new right hand side with factorization of V0 solution
+
+            V0_s: lazy solution of V0, which engine is used
+
+            I_v: sparse right hand side as provided by _assemble
+        """
+        Ni = len(self.unknowns)
+        if isinstance(V0_s.B,scs_solver.ExactMatrix):
+            field = V0_s.B.field
+            B = scs_solver.ExactMatrix(field,[dict(((0,scs_solver.to_field(field,I_v[(i,0)])),)) if (i,0) in I_v else {}
+                                              for i in range(Ni)],1)
+        else:
+            B = sympy.SparseMatrix(Ni,1,I_v)
+        return scs_solver.LazySolution(V0_s.engine,B)
 
-            Return conductance vector and current scalar. So final current is Iout = G_v*V - I
+    def _clear_voltages(self):
+        """ Forgets net voltages calculated by v() in self and subinstances, as they are no longer valid.
         """
-        G_v = [0 for i in range(len(self.nets))]
-        I = [0]
-        self.update_current_v(element,net,G_v,I)
-        return G_v,I
-                
-    def port_voltage(self,port,element):
-        """ Translate subinstance voltage sources equation as equation using port volages.
-            
-            port: net for which we write equation (name as in subinstance)
-            element: voltage source for which we write equation
+        self.V = {}
+        self.Vp = {}
+        for subname,subinstance in self.subinstances.iteritems():
+            subinstance._clear_voltages()
+
+    def _update_solution(self,system,engine,exact,low_rank,approximation=None,symmetry=False):
+        """ Updates solution of self for new equations
+
+            system: tuple of sparse matrices G_i, G_p, I_v of new equations as provided by _assemble
 
-            While writing equations if net is a port of some subinstance (self), on which there is an unused voltage source
-            (one which was unused while solving subinstance) we must use it to write it next equation. This function
-            provides this equation in form of port voltages (uknown because parent instance is being solved), while we can
-            use inner voltages which are in linear funciton of port voltages as well. This equation will be used to 
-            write an equation using parent circuit net names. Returns conductance dictionary (not to confuse numbers with port nets).                
+            engine, exact, low_rank, approximation, symmetry: as in alter_element
+
+            With low_rank solution is updated from factorized base system, if there is no factorized base system or too
+            many equations changed, or without low_rank, system is factorized again.
         """
-        N = len(self.nets)
-        Ni = len(self.inner_nets)
+        Ni = len(self.unknowns)
         Np = len(self.port_nets)
-        
-        G_v = [0 for i in range(N)]
-        I = [0]
-        G_v[self.net_name_index[element.nets[0]]] = 1
-        G_v[self.net_name_index[element.nets[1]]] = -1  
+        if self._base is None or not low_rank or not hasattr(self._base[0],'low_rank_update'):
+            self._factorize(system[0],system[1],system[2],engine,False,exact,approximation,symmetry)
+            return
+        G_i_fact = self._base[0]
+        V0_s,Ap_s = self._base[4:]
+
+        # Differences of G_i, G_p and I_v
+        deltas = []
+        for new,old in zip(system,self._base[1:4]):
+            delta = {}
+            for key in set(new) | set(old):
+                value = new.get(key,0) - old.get(key,0)
+                if exact: value = scs_solver.rationalize(value)
+                value = sympy.cancel(value)
+                if value != 0: delta.update({key:value})
+            deltas.append(delta)
+        rows = sorted(set(row for delta in deltas for row,column in delta))
+        if 2*len(rows) > Ni:
+            self._factorize(system[0],system[1],system[2],engine,False,exact,approximation,symmetry)
+            return
+        logging.info("Updating %s: %d of %d equations changed" % (self.name if self.name else "TOP INSTANCE",len(rows),Ni))
+
+        # V0 is solution for I_v, and Ap for -G_p, all columns are updated at once
+        columns = [(list(V0_s.B.col(0)),V0_s.caches.setdefault(0,{}))]
+        columns += [(list(Ap_s.B.col(c)),Ap_s.caches.setdefault(c,{})) for c in range(Np)]
+        dG = {}
+        for (row,column),value in deltas[0].iteritems():
+            dG.setdefault(row,{}).update({column:value})
+        dB = [{} for c in range(1+Np)]
+        for (row,column),value in deltas[1].iteritems(): dB[1+column].update({row:-value})
+        for (row,column),value in deltas[2].iteritems(): dB[0].update({row:value})
+        X = sympy.zeros(Ni,1+Np)
+        if rows:
+            try:
+                solutions = G_i_fact.low_rank_update(columns,dG,dB)
+            except ValueError, e:
+                raise scs_errors.ScsElementError("%s is ill conditioned, and has no unique solution." % self.name if self.name else "TOP INSTANCE")
+        else:
+            solutions = [[V0_s.get(i,0) for i in range(Ni)]] + [[Ap_s.get(i,c) for i in range(Ni)] for c in range(Np)]
+        for c in range(1+Np):
+            for i in range(Ni):
+                X[i,c] = solutions[c][i]
+        self.V0_s = None
+        self.Ap_s = None
+        self._set_solution(X[:,0],X[:,1:])
+
+    def _solve_subinstances_in_pool(self,engine,jobs,templates,exact=False,approximation=None,symmetry=False,
+                                    workers=None,nested=False):
+        """ Solves subinstances in a pool of worker processes
+
+            engine: name of elimination engine
+
+            jobs: maximal number of worker processes
+
+            templates: dictionary of template_key:solution, updated with solutions of subinstances and their subinstances
+
+            exact: if True subinstances are solved over exact domain
+
+            approximation: nominal values and tolerance, as in solve
+
+            symmetry: if True symmetric subinstances are split into halves, as in solve
+
+            workers: pool of workers on other hosts (scs_worker.WorkerPool) used instead of local processes
+
+            nested: if True subinstances are solved as sequence of expressions, as in solve
+
+            Sibling subinstances are independent until equations of self are written, so each of them (only one for
+            instances with the same template key) is pickled without its parent and solved in separate process.
+            Afterwards solve of subinstances finds their solutions in templates dictionary.
+        """
+        payloads = {}
+        for name,subinstance in sorted(self.subinstances.iteritems()):
+            key = subinstance.template_key()
+            if key in templates or key in payloads: continue
+            parent,subinstance.parent = subinstance.parent,None
+            try:
+                payloads.update({key:pickle.dumps(subinstance,pickle.HIGHEST_PROTOCOL)})
+            finally:
+                subinstance.parent = parent
+        if len(payloads) < 2: return
+
+        arguments = [(payload,engine,exact,approximation,symmetry,nested) for payload in payloads.itervalues()]
+        if workers is not None:
+            results = workers.map(_solve_template,arguments)
+        else:
+            pool = multiprocessing.Pool(min(jobs,len(payloads)))
+            try:
+                results = pool.map(_solve_template,arguments)
+            finally:
+                pool.terminate()
+                pool.join()
+        for result in results:
+            if isinstance(result,BaseException): raise result
+            templates.update(result)
+
+    def template_key(self):
+        """ Provides key which identifies solution of the instance
+
+            Two instances with the same key have the same V0 and Ap, so one can be solved and the solution shared.
+            Key is made of the unknowns and port nets (in order they are in equations), elements with their evaluated values,
+            keys of subinstances with their port maps and declared symmetry. It doesn't depend on instance name nor its parent.
+        """
+        if self._template_key is None:
+            elements = []
+            for name,element in sorted(self.elements.iteritems()):
+                elements.append((element.__class__.__name__,tuple(element.names),tuple(element.nets),
+                                 tuple(sympy.srepr(value) for value in element.values)))
+            subinstances = []
+            for name,subinstance in sorted(self.subinstances.iteritems()):
+                subinstances.append((name,tuple(sorted(subinstance.port_map.iteritems())),subinstance.template_key()))
+            self._template_key = (tuple(self.unknowns),tuple(self.port_nets),tuple(elements),tuple(subinstances),tuple(self.symmetry))
+        return self._template_key
+
+    def v0(self,net):
+        """ Provides value of V0 vector for unknown
+
+            net: name of inner net or unknown current of voltage source
+
+            If instance was solved in lazy mode value is calculated on the first call. If instance was solved in nested
+            mode symbol standing for the value is given, see sequence().
+        """
+        if net not in self.V0:
+            self.V0.update({net:self.V0_s.get(self.net_name_index[net],0)})
+        return self._entry(self.V0[net],self.net_name_index[net],0)
+
+    def ap(self,net,port):
+        """ Provides value of Ap matrix for unknown and port net
+
+            net: name of inner net or unknown current of voltage source
+
+            port: name of port net
+
+            If instance was solved in lazy mode value is calculated on the first call. If instance was solved in nested
+            mode symbol standing for the value is given, see sequence().
+        """
+        if port not in self.Ap:
+            self.Ap.update({port:{}})
+        if net not in self.Ap[port]:
+            self.Ap[port].update({net:self.Ap_s.get(self.net_name_index[net],self.net_name_index[port]-len(self.unknowns))})
+        return self._entry(self.Ap[port][net],self.net_name_index[net],self.net_name_index[port]-len(self.unknowns)+1)
+
+    def _entry(self,value,row,column):
+        """ Provides entry of solution as it is used outside of self
+
+            value: value of entry of V0 (column 0) or of Ap (column of port + 1)
+
+            row, column: position of entry in matrix [V0, Ap]
+
+            In nested mode entry which isn't a number nor a single symbol is replaced by symbol named after hash of
+            template key of self and position of entry, so instances sharing solution share symbols too.
+        """
+        if not self.nested or not isinstance(value,sympy.Basic) or value.is_Atom:
+            return value
+        digest = hashlib.sha1(repr(self.template_key())).hexdigest()[:10]
+        return sympy.Symbol('_%s_%d_%d' % (digest,row,column))
+
+    def sequence(self,values):
+        """ Provides definitions of symbols standing for entries of V0 and Ap, which values depend on
+
+            values: list of expressions given by v(), i() and isub() of self solved in nested mode (or of expressions
+            made of them)
+
+            Returns list of symbol,definition pairs of symbols which values use (directly or through definitions of
+            other symbols), ordered so that definition of each symbol uses only symbols defined before it (sequence of
+            expressions). Expanding values is avoided, as they can be exponentially larger than the sequence. Empty list
+            if self wasn't solved in nested mode.
+        """
+        entries = {}
+        instances = [self]
+        for instance in instances:
+            instances.extend(subinstance for name,subinstance in sorted(instance.subinstances.iteritems()))
+            if instance.nested and instance.unknowns:
+                digest = hashlib.sha1(repr(instance.template_key())).hexdigest()[:10]
+                entries.setdefault(digest,instance)
+
+        sequence = []
+        defined = set()
+        def define(symbol):
+            if symbol in defined: return
+            defined.add(symbol)
+            name = symbol.name.split('_')
+            if len(name) != 4 or name[0] or name[1] not in entries: return
+            instance,row,column = entries[name[1]],int(name[2]),int(name[3])
+            unknown = instance.unknowns[row]
+            if column:
+                instance.ap(unknown,instance.port_nets[column-1])
+                definition = instance.Ap[instance.port_nets[column-1]][unknown]
+            else:
+                instance.v0(unknown)
+                definition = instance.V0[unknown]
+            for other in sorted(definition.free_symbols,key=str): define(other)
+            sequence.append((symbol,definition))
+
+        for value in values:
+            for symbol in sorted(sympy.sympify(value).free_symbols,key=str): define(symbol)
+        return sequence
+
+    def all_voltages(self):
+        """ Calculates voltages on all nets of self and its subinstances in one pass
+
+            Going from self down the hierarchy, voltages on inner nets of each instance are calculated at once as
+            Vi = V0 + Ap*Vp, with port voltages Vp already known from the parent, instead of resolving each net by
+            recursive calls of v(). Calculated voltages are kept, so v() uses them later.
+            Returns dictionary of net names in dot notation (relative to self) and their voltages.
+        """
+        voltages = {}
+        self._all_voltages('',voltages)
+        return voltages
+
+    def _all_voltages(self,prefix,voltages):
+        """ Calculates voltages on nets of self and subinstances and adds them to dictionary
+
+            prefix: dot notation prefix of names of nets of self
+
+            voltages: dictionary of net name:voltage which is updated
+        """
+        for port in self.port_nets:
+            if port not in self.Vp:
+                self.Vp.update({port:self.parent.v(self.port_map[port])})
+            self.V.update({port:self.Vp[port]})
+        if self.inner_nets and self.nested:
+            for net in self.inner_nets:
+                self.V.update({net:self._unknown(net)})
+        elif self.inner_nets:
+            if self.V0_m is None: self._set_solution(self.V0_s.matrix(),self.Ap_s.matrix())
+            Vi_m = self.V0_m
+            if self.port_nets:
+                Vi_m = Vi_m + self.Ap_m*sympy.Matrix([self.Vp[port] for port in self.port_nets])
+            for i in range(len(self.inner_nets)):
+                self.V.update({self.inner_nets[i]:Vi_m[i]})
+        for net in sorted(self.reduced_nets):
+            self.v(net)
+        if not self.parent and '0' in self.elements_on_net:
+            self.V.update({'0':0})
+        for net in self.V:
+            if net not in self.lifted_nets: voltages.update({prefix+net:self.V[net]})
+        for name,subinstance in sorted(self.subinstances.iteritems()):
+            subinstance._all_voltages(prefix if subinstance.synthetic else prefix+name+'.',voltages)
+
+    def stamp(self,G_v,net,g):
+        """ Adds conductance to sparse conductance vector
+
+            G_v: sparse conductance vector, dictionary index:conductance with only entries which were stamped
+            net: net name (or name of unknown), if it's not a net of self (like ground of top instance) nothing is added
+            g: conductance to be added
+        """
+        if net in self.net_name_index:
+            i = self.net_name_index[net]
+            G_v[i] = G_v.get(i,0) + g
+
+    def source_equation(self,name):
+        """ Provides equation of voltage source G_v*V = I
+
+            name: name of voltage source of self, or of one promoted from subinstance in dot notation
+
+            Equation of source promoted from subinstance is written by subinstance using its port voltages, as its
+            nets (also controlling ones) can be inner nets of subinstance. Returns sparse conductance vector
+            (dictionary index:conductance) and current scalar.
+        """
+        hier_name = name.split('.',1)
+        if len(hier_name) > 1:
+            subinstance = self.subinstances[hier_name[0]]
+            G_v,I = subinstance.source_equation(hier_name[1])
+            G_pd,I = subinstance._eliminate_unknowns(G_v,I,-1)
+            G_v = {}
+            for port,g in G_pd.iteritems(): self.stamp(G_v,subinstance.port_map[port],g)
+            return G_v,I
+        element = self.elements[name]
+        G_v = {}
+        I = 0
+        self.stamp(G_v,element.nets[0],1)
+        self.stamp(G_v,element.nets[1],-1)
         if isinstance(element,scs_elements.VoltageControlledVoltageSource):
-            G_v[self.net_name_index[element.nets[2]]] = element.values[0]
-            G_v[self.net_name_index[element.nets[3]]] = -element.values[0]                                   
-        else: I = [element.values[0]]
-        
-        G_v1,G_v2 = G_v[:Ni],G_v[Ni:]
-        G_v1m,G_v2m = sympy.Matrix(G_v1),sympy.Matrix(G_v2)
-        
-        if G_v1: 
-            G_pv = list(self.Ap_m.transpose()*G_v1m+G_v2m)
-            I[0] += list(G_v1m.transpose()*self.V0_m)[0]
-        else: G_pv = list(G_v2m)
-        
+            self.stamp(G_v,element.nets[2],-element.values[0])
+            self.stamp(G_v,element.nets[3],element.values[0])
+        elif isinstance(element,scs_elements.CurrentControlledVoltageSource):
+            G_c,I_c = self.element_current(self._referenced_element(element))
+            for i,g in G_c.iteritems(): G_v[i] = G_v.get(i,0) - element.values[0]*g
+            I += element.values[0]*I_c
+        else: I += element.values[0]
+        return G_v,I
+
+    def _referenced_element(self,element):
+        """ Provides element which current controls current controlled source
+
+            element: current controlled source of self
+        """
+        if element.names[1] not in self.elements:
+            raise scs_errors.ScsInstanceError("No such element %s referenced by %s" % (element.names[1],element.names[0]))
+        return self.elements[element.names[1]]
+
+    def element_current(self,element,visited=()):
+        """ Provide current through element flowing out of its first net.
+    
+            element: element of self, which isn't promoted to parent
+            visited: current controlled current sources which references lead to element
+
+            Current of voltage source is its own unknown, so it's just taken from solution. Return sparse conductance
+            vector (dictionary index of unknown or port:conductance) and current scalar. So final current is
+            Iout = G_v*V + I
+        """
+        G_v = {}
+        if isinstance(element,scs_elements.VoltageSource):
+            self.stamp(G_v,'i(%s)' % element.names[0],1)
+            return G_v,0
+        elif isinstance(element,scs_elements.PassiveElement):
+            g = element.conductance()
+            self.stamp(G_v,element.nets[0],g)
+            self.stamp(G_v,element.nets[1],-g)
+            return G_v,0
+        elif isinstance(element,scs_elements.VoltageControlledCurrentSource):
+            self.stamp(G_v,element.nets[2],-element.values[0])
+            self.stamp(G_v,element.nets[3],element.values[0])
+            return G_v,0
+        elif isinstance(element,scs_elements.CurrentControlledCurrentSource):
+            if element in visited:
+                raise scs_errors.ScsInstanceError("Error: ill conditioned current controlled source %s" % element.names[0])
+            G_vx,Ix = self.element_current(self._referenced_element(element),visited + (element,))
+            for i,g in G_vx.iteritems(): G_v[i] = element.values[0]*g
+            return G_v,element.values[0]*Ix
+        else:
+            return G_v,-element.values[0]
 
-        #Translate vector into dictionary
-        G_pd = {}
-        i = 0
-        for port_net in self.port_nets:
-            G_pd.update({port_net:G_pv[i]})
-            i = i + 1
-        
-        return G_pd,I[0]
-                
     def port_current(self,port):
         """ Translate subinstance port current equation as equation using port voltages.
             
             port: net for which we write equation (name as in subinstance)
 
-            Provides current from a port in form of:
-            port_current I = G*Vp + I_other_ports
+            Provides current flowing from a port into elements of self, with unknowns replaced by Vi = Ap*Vp + V0:
+            port_current I = G*Vp + I + B*I_promoted
                             
             Returns:
-            G_pd: conductance dictionary
-            other_ports: list of other ports current through which we needs to add
+            G_pd: conductance dictionary port:conductance
+            I: current scalar
+            B: dictionary name:coefficient of currents of voltage sources promoted to parent
         """
-        N = len(self.nets)
-        Ni = len(self.inner_nets)
-        Np = len(self.port_nets)
-        G_v = [0 for i in range(N)]
-        I = [0]
+        G_v = {}
+        I = 0
+        B = {}
+        promoted = set(name for name,element,nets in self.promoted)
         for element in self.elements_on_net[port]:
-            self.update_current_v(element,port,G_v,I)
-        
-        G_v1,G_v2 = G_v[:Ni],G_v[Ni:]
-        G_v1m,G_v2m = sympy.Matrix(G_v1),sympy.Matrix(G_v2)
-        
-        if G_v1: 
-            G_pv = list(self.Ap_m.transpose()*G_v1m+G_v2m)
-            I[0] += list(G_v1m.transpose()*self.V0_m)[0]
-        else: G_pv = list(G_v2m)
-        
-        #Translate vector into dictionary
+            if isinstance(element,Instance):
+                for subport in inv_map(element.port_map)[port]:
+                    if subport not in element.net_name_index: continue
+                    G_c,I_c,B_c = self._subinstance_current(element,subport)
+                    for i,g in G_c.iteritems(): G_v[i] = G_v.get(i,0) + g
+                    I += I_c
+                    for name,b in B_c.iteritems(): B[name] = B.get(name,0) + b
+            elif port in element.nets[:2]:
+                sign = (1 if element.nets[0] == port else 0) - (1 if element.nets[1] == port else 0)
+                if not sign: continue
+                if element.names[0] in promoted:
+                    B[element.names[0]] = B.get(element.names[0],0) + sign
+                    continue
+                G_c,I_c = self.element_current(element)
+                for i,g in G_c.iteritems(): G_v[i] = G_v.get(i,0) + sign*g
+                I += sign*I_c
+
+        G_pd,I = self._eliminate_unknowns(G_v,I)
+        return G_pd,I,B
+
+    def _eliminate_unknowns(self,G_v,I,sign=1):
+        """ Rewrites expression G_v*V + I using unknowns as expression using only port voltages.
+
+            G_v: sparse conductance vector (dictionary index:conductance) of expression
+            I: scalar part of expression
+            sign: sign with which scalar part is updated, -1 for equations G_v*V = I
+
+            Unknowns are replaced with Vi = Ap*Vp + V0. Returns conductance dictionary port:conductance and updated scalar.
+        """
+        Nu = len(self.unknowns)
         G_pd = {}
-        i = 0
-        for port_net in self.port_nets:
-            G_pd.update({port_net:G_pv[i]})
-            i = i + 1
-        
-        return G_pd,I[0],self.chained_ports[port]
+        for i,g in sorted(G_v.iteritems()):
+            if i >= Nu: G_pd[self.port_nets[i-Nu]] = G_pd.get(self.port_nets[i-Nu],0) + g
+        for i,g in sorted(G_v.iteritems()):
+            if i < Nu and g:
+                unknown = self.unknowns[i]
+                I += sign*g*self.v0(unknown)
+                for port_net in self.port_nets:
+                    G_pd[port_net] = G_pd.get(port_net,0) + g*self.ap(unknown,port_net)
+        return G_pd,I
+
+    def _subinstance_current(self,subinstance,port):
+        """ Provides current flowing from net of self into port of subinstance
+
+            subinstance: subinstance of self
+
+            port: port of subinstance (name as in subinstance)
+
+            Returns sparse conductance vector (dictionary index:conductance) over unknowns and ports of self, current
+            scalar and dictionary name:coefficient of currents of voltage sources promoted further to parent of self.
+        """
+        G_pd,I,B_sub = subinstance.port_current(port)
+        G_v = {}
+        for p,g in G_pd.iteritems():
+            self.stamp(G_v,subinstance.port_map[p],g)
+        B = {}
+        for name,b in B_sub.iteritems():
+            name = '%s.%s' % (subinstance.name,name)
+            if 'i(%s)' % name in self.net_name_index: self.stamp(G_v,'i(%s)' % name,b)
+            else: B[name] = B.get(name,0) + b
+        return G_v,I,B
+
+    def _evaluate(self,G_v,I,B={}):
+        """ Calculates value of current G_v*V + I + B*I_promoted from solution of self
+
+            G_v, I, B: as provided by element_current or _subinstance_current
+        """
+        variables = self.unknowns + self.port_nets
+        for i,g in sorted(G_v.iteritems()):
+            if g:
+                if len(self.inner_nets) <= i < len(self.unknowns): I += g*self._unknown(variables[i])
+                else: I += g*self.v(variables[i])
+        for name,b in sorted(B.iteritems()):
+            I += b*self.parent._branch_current('%s.%s' % (self.name,name))
+        return I
+
+    def _branch_current(self,name):
+        """ Provides current of voltage source, from unknowns of self or parent if it was promoted
+
+            name: name of voltage source relative to self, in dot notation
+        """
+        if 'i(%s)' % name in self.net_name_index:
+            return self._unknown('i(%s)' % name)
+        return self.parent._branch_current('%s.%s' % (self.name,name))
 
     def isub(self,port):
         """ Calculate current flowing into port
@@ -610,35 +1541,20 @@ class Instance(object):
             subinstance = self.subinstances[subinstance_name]
             if port_net not in subinstance.port_nets: 
                 raise scs_errors.ScsInstanceError("No port %s in subinstance %s of %s" %(port_net,subinstance.name,self.name if self.name else "TOP INSTANCE"))
-            G_v =[0 for i in range(len(self.nets))]
-            I = [0]
-            G_d,I[0],other_ports = subinstance.port_current(port_net)
-            for p,g in G_d.iteritems():
-                if subinstance.port_map[p] in self.net_name_index: G_v[self.net_name_index[subinstance.port_map[p]]] += g 
-            for other_port in other_ports:
-                for other_port_element in self.elements_on_net[element.port_map[other_port]]:
-                    if not other_port_element is element: self.update_current_v(other_port_element,element.port_map[other_port],G_v,I)
-            i = 0
-            for g in G_v:
-                if g:
-                    I[0] += g*self.v(self.nets[i])
-                i += 1
-            return I[0]
-            #return sympy.factor(I[0],sympy.symbols('s'))
-            #return I[0].simplify()
-            #return sympy.powsimp(I[0])
+            G_v,I,B = self._subinstance_current(subinstance,port_net)
+            return self._evaluate(G_v,I,B)
         else:        
             subinstance = self
             for subname in hier_port[:-2]:
                 if subname in subinstance.subinstances:
                     subinstance = subinstance.subinstances[subname]
                 else:
-                    raise scs_errors.ScsInstanceError("No %s subinstance in %s" %(hier_name,self.name if self.name else "TOP INSTANCE"))
-            return subinstance.isub('%s.%s' % (hier_inst[-2],hier_inst[-1]))
+                    raise scs_errors.ScsInstanceError("No %s subinstance in %s" %(subname,self.name if self.name else "TOP INSTANCE"))
+            return subinstance.isub('%s.%s' % (hier_port[-2],hier_port[-1]))
 
     def i(self,instance):
         """ Current flowing through instance
-
+        
             instance: instance for which we calculate current for, can be written in dot notation
             
             Returns value of a current. Instance need to be solved first to use it.
@@ -647,15 +1563,15 @@ class Instance(object):
         
         if len(hier_inst) == 1:
             if hier_inst[0] in self.elements:
-                G_v,I = self.current_v(self.elements[hier_inst[0]],self.elements[hier_inst[0]].nets[0])
-                i = 0
-                for g in G_v:
-                    if g:
-                        I[0] -= g*self.v(self.nets[i])
-                    i += 1
-                #return sympy.factor(I[0],sympy.symbols('s'))
-                #return I[0].simplify()
-                return -I[0]
+                if hier_inst[0] in [name for name,element,nets in self.promoted]:
+                    return self.parent._branch_current('%s.%s' % (self.name,hier_inst[0]))
+                G_v,I = self.element_current(self.elements[hier_inst[0]])
+                return self._evaluate(G_v,I)
+            elif hier_inst[0] in self.moved_elements:
+                return self.subinstances[self.moved_elements[hier_inst[0]]].i(hier_inst[0])
+            elif hier_inst[0] in self.reduced_elements:
+                element = self.reduced_elements[hier_inst[0]]
+                return element.conductance()*self.v(element.nets[0],element.nets[1])
             else: 
                 raise scs_errors.ScsInstanceError("Can't find element %s in %s" % (hier_inst[0],self.name if self.name else "TOP INSTANCE"))
         else:
@@ -664,9 +1580,23 @@ class Instance(object):
                 if subname in subinstance.subinstances:
                     subinstance = subinstance.subinstances[subname]
                 else: 
-                    raise scs_errors.ScsInstanceError("No %s subinstance in %s" %(hier_name,self.name if self.name else "TOP INSTANCE"))
+                    raise scs_errors.ScsInstanceError("No %s subinstance in %s" %(subname,self.name if self.name else "TOP INSTANCE"))
             return subinstance.i(hier_inst[-1])
 
+    def _unknown(self,unknown):
+        """ Calculates value of unknown (inner net voltage or voltage source current) as V0 + Ap*Vp
+
+            unknown: name of unknown of self
+        """
+        value = self.v0(unknown)
+        for port in self.port_nets:
+            ap = self.ap(unknown,port)
+            if ap:
+                if port not in self.Vp:
+                    self.Vp.update({port:self.parent.v(self.port_map[port])})                                        
+                value += ap*self.Vp[port]
+        return value
+
     def v(self,net1,net2=None):
         """ Calculate voltage differnce between nets 1 and 2 V(net1)-V(net2)
             
@@ -685,19 +1615,15 @@ class Instance(object):
                 net = hier_net[0]
                 if not net in self.V:
                     if net in self.inner_nets:
-                        vx = self.V0[net]
-                       # Ap = self.Ap[net] if net in self.Ap else {}
-                        for port,Ap in self.Ap.iteritems():
-                            ap = Ap[net]
-                            if ap:
-                                if port not in self.Vp:
-                                    self.Vp.update({port:self.parent.v(self.port_map[port])})                                        
-                                vx += ap*self.Vp[port]
-                        self.V.update({net:vx})
+                        self.V.update({net:self._unknown(net)})
                     elif net in self.port_nets:
                         if net not in self.Vp:
                             self.Vp.update({net:self.parent.v(self.port_map[net])})
                         self.V.update({net:self.Vp[net]})
+                    elif net in self.moved_nets:
+                        self.V.update({net:self.subinstances[self.moved_nets[net]].v(net)})
+                    elif net in self.reduced_nets:
+                        self.V.update({net:sum(k*self.v(n) for n,k in sorted(self.reduced_nets[net].iteritems()))})
                     else:
                         if net == '0' and not self.parent:
                             self.V.update({'0':0})
@@ -718,6 +1644,107 @@ class Instance(object):
         #return (v[0]-v[1]).simplify()                                      
         return v[0]-v[1]
         #return sympy.cancel(v[0]-v[1])
+def _cancel_entries(values,jobs=1):
+    """ Cancels expressions (brings each of them into canonical form p/q)
+
+        values: list of sympy expressions
+
+        jobs: maximal number of worker processes, if more than 1 expressions are cancelled in a pool of processes
+
+        Expressions are shipped to workers as strings made by sympy.srepr, and only those which are at least
+        pool_length characters long, as cancelling shorter ones costs less than shipping them. Returns list of
+        cancelled expressions in the same order.
+    """
+    if jobs < 2: return [sympy.cancel(value) for value in values]
+    texts = [sympy.srepr(value) for value in values]
+    shipped = [k for k,text in enumerate(texts) if len(text) >= pool_length]
+    if len(shipped) < 2: return [sympy.cancel(value) for value in values]
+
+    pool = multiprocessing.Pool(min(jobs,len(shipped)))
+    try:
+        results = pool.map_async(_cancel_text,[texts[k] for k in shipped])
+        values = [sympy.cancel(value) if len(text) < pool_length else None for value,text in zip(values,texts)]
+        results = results.get()
+    finally:
+        pool.terminate()
+        pool.join()
+    for k,text in zip(shipped,results):
+        values[k] = sympy.sympify(text)
+    return values
+
+def _cancel_text(text):
+    """ Cancels expression in a worker process
+
+        text: expression as made by sympy.srepr
+
+        Returns cancelled expression made into string by sympy.srepr.
+    """
+    return sympy.srepr(sympy.cancel(sympy.sympify(text)))
+
+def _solve_template(args):
+    """ Solves pickled instance in a worker process (local or scs_worker on other host)
+
+        args: tuple of pickled instance (detached from its parent), engine name, exact flag, approximation, symmetry flag
+        and nested flag
+
+        Returns list of template_key,solution pairs for the instance and all its subinstances. Solutions are full
+        (V0_m, Ap_m matrices and V0, Ap dictionaries) without lazy solutions, which can't be pickled.
+        Errors of solving are returned instead of raised, as pool passes back only errors derived from Exception.
+    """
+    payload,engine,exact,approximation,symmetry,nested = args
+    scs_parser.exact = exact    # workers on other hosts don't share exact mode set by scs.py
+    instance = pickle.loads(payload)
+    templates = {}
+    try:
+        instance.solve(engine,False,templates,1,exact,approximation,symmetry,None,nested)
+    except (scs_errors.ScsInstanceError,scs_errors.ScsElementError), e:
+        return e
+    return [(key,(None,None)+solution[2:]) for key,solution in templates.iteritems()]
+
+def _tear(adjacent):
+    """ Splits graph of nets into parts which are connected only through separator nets
+
+        adjacent: dictionary of sets of adjacent nets by net
+
+        Returns list of sets of nets of parts, connected components if there are more than one (single nets are left
+        out), else two halves separated by one level of breadth first search from peripheral net. Empty list if there
+        is no separator smaller than the halves.
+    """
+    def levels(start):
+        visited = set([start])
+        result = [[start]]
+        while True:
+            level = sorted(set(net for net in result[-1] for net in adjacent[net]) - visited)
+            if not level: return result
+            visited.update(level)
+            result.append(level)
+
+    components = []
+    left = set(adjacent)
+    while left:
+        component = set(net for level in levels(min(left)) for net in level)
+        components.append(component)
+        left -= component
+    if len(components) > 1:
+        return [component for component in components if len(component) > 1]
+
+    # Peripheral net is found by going to the farthest net until depth of search doesn't grow
+    result = levels(min(adjacent))
+    while True:
+        farthest = levels(min(result[-1],key=lambda net:(len(adjacent[net]),net)))
+        if len(farthest) <= len(result): break
+        result = farthest
+    best = None
+    for i in range(1,len(result)-1):
+        a = sum(len(level) for level in result[:i])
+        b = sum(len(level) for level in result[i+1:])
+        if len(result[i]) <= min(a,b) and (best is None or (len(result[i]),abs(a-b)) < best[0]):
+            best = ((len(result[i]),abs(a-b)),i)
+    if best is None: return []
+    i = best[1]
+    return [set(net for level in result[:i] for net in level),set(net for level in result[i+1:] for net in level)]
+
+
 def _contract_chains(chains):
     """ Contracts chains in list into larger chains if are connected
 
@@ -798,21 +1825,24 @@ def getSubcircuit(name,circuit):
     else: 
         return None
 
-def make_top_instance(circuit):
+def make_top_instance(circuit,numericd=None):
     """ Makes top instance from circuit
         
         circuit: a circuit which will be instantiated
 
+        numericd: dictionary of symbol:number pairs, if given these symbols are replaced with numbers in parameters of
+        all instances, so elements are evaluated and equations written with only the other symbols
+
         Top circuit won't have a name or parent.
         Returns instance of a circuit or None if some error does appear.
     """
     try:
-        return make_instance(None,None,circuit)
+        return make_instance(None,None,circuit,numericd=numericd)
     except scs_errors.ScsInstanceError, e:
         logging.error(e)
         return None
 
-def make_instance(parent,name,circuit,port_map={},passed_paramsd={}):
+def make_instance(parent,name,circuit,port_map={},passed_paramsd={},numericd=None):
     """ Makes an instance of a circuit
 
         parent: parent of an instance (instance will be a subinstance of that parent
@@ -825,6 +1855,8 @@ def make_instance(parent,name,circuit,port_map={},passed_paramsd={}):
 
         passed_paramsd: parameters that are being passed to subinstance while instantiating it
 
+        numericd: dictionary of symbol:number pairs replaced in parameters of instance and its subinstances
+
         Makes a subinstance of a parent. Passed paramsd will be evaluated first, and then overwrite the default ones.
         Returns instance of a circuit or None if some error does apper.
     """
@@ -834,6 +1866,9 @@ def make_instance(parent,name,circuit,port_map={},passed_paramsd={}):
     except scs_errors.ScsParameterError, e:
         raise scs_errors.ScsInstanceError("Error evaluating parametrs in %s subcircuit. %s" % (circuit.name,e))
     inst.paramsd.update(passed_paramsd)
+    if numericd:
+        inst.paramsd = dict((param,value.subs(numericd)) for param,value in inst.paramsd.iteritems())
+    inst.symmetry = list(circuit.symmetryl)
     for ename,element in circuit.elementsd.iteritems():
         if ename[0] in ['x','X']:   
             subcir_name = element.paramsl[-1]        
@@ -853,7 +1888,7 @@ def make_instance(parent,name,circuit,port_map={},passed_paramsd={}):
                 except scs_errors.ScsParameterError, e:
                     raise scs_errors.ScsInstanceError("Error evaluating parametrs for instance: %s in %s subcircuit. %s" % (subcir_name,circuit.name,e))                    
                 
-                sub_inst = make_instance(inst,ename,subcircuit,portmap,eps)
+                sub_inst = make_instance(inst,ename,subcircuit,portmap,eps,numericd)
                 inst.add_sub_instance(sub_inst)
             else:
                 raise scs_errors.ScsInstanceError("Error: no subcircuit definition of: %s found for instance %s in %s subcircuit"
@@ -6,6 +6,7 @@ the most importing one being parseFile which reads the file and makes top circui
 There are also function which deals with convering expresions for paramters and so on.
  
 """
+import os
 import re
 import sympy
 import sympy.abc
@@ -56,13 +57,26 @@ reg_function = re.compile('(?P<token>^[a-zA-z]?[\w_\{\}]*?\(.*?\))(.*)')
 # Matches just function expresion: foo(bar)
 reg_only_function = re.compile('(?P<function>^[a-zA-z]?[\w_\{\}]*?)\((?P<argument>.*?)\)$')
 
-# Engineer sufixes for numbers
-suffixd = {'meg': 1e6, 'Meg': 1e6, 'MEg': 1e6, 'MEG': 1e6,
-           'a': 1e-18, 'A': 1e-18, 'f': 1e-15, 'F': 1e-15,
-           'p': 1e-12, 'P': 1e-12, 'n': 1e-9, 'N': 1e-9,
-           'u': 1e-6, 'U': 1e-6, 'm': 1e-3, 'M': 1e-3,
-           'k': 1e6, 'K': 1e3, 'x': 1e6, 'X': 1e6,
-           'g': 1e9, 'G': 1e9, 't': 1e12, 'T': 1e12}
+# Engineer sufixes for numbers, as decimal strings, so they can be read as rationals in exact mode
+suffixd = {'meg': '1e6', 'Meg': '1e6', 'MEg': '1e6', 'MEG': '1e6',
+           'a': '1e-18', 'A': '1e-18', 'f': '1e-15', 'F': '1e-15',
+           'p': '1e-12', 'P': '1e-12', 'n': '1e-9', 'N': '1e-9',
+           'u': '1e-6', 'U': '1e-6', 'm': '1e-3', 'M': '1e-3',
+           'k': '1e6', 'K': '1e3', 'x': '1e6', 'X': '1e6',
+           'g': '1e9', 'G': '1e9', 't': '1e12', 'T': '1e12'}
+
+# If True numbers in expressions are read as rationals instead of floats (exact mode, set by scs.py --exact)
+exact = False
+
+
+def sympify(expresion):
+    """ Converts expresion into sympy expression
+
+        expresion: string or sympy expression
+
+        Numbers are read as rationals in exact mode (see exact), otherwise as floats.
+    """
+    return sympy.sympify(expresion, sympy.abc._clash, rational=exact)
 
 
 def evaluate_param(param, paramsd, evaluated_paramsd, parent=None, params_called_list=None):
@@ -110,7 +124,7 @@ def evaluate_param(param, paramsd, evaluated_paramsd, parent=None, params_called
                                 tmp = evaluate_param(token, paramsd, evaluated_paramsd, parent,
                                                      params_called_list + [token])
                                 if tmp:
-                                    evaluated_paramsd.update({token: sympy.sympify(tmp,sympy.abc._clash)})
+                                    evaluated_paramsd.update({token: sympify(tmp)})
                             else:
                                 raise scs_errors.ScsParameterError("Circulary refence for %s" % token)
                         else:
@@ -118,15 +132,15 @@ def evaluate_param(param, paramsd, evaluated_paramsd, parent=None, params_called
                             if not tmp:
                                 raise scs_errors.ScsParameterError("Can't find definition for parameter: %s" % token)
 
-                            expr += tmp
+                            expr += '(%s)' % tmp
                             continue
                     if token in evaluated_paramsd:
-                        expr += str(evaluated_paramsd[token])
+                        expr += '(%s)' % evaluated_paramsd[token]
                     else:
                         raise scs_errors.ScsParameterError("Can't find definition for parameter: %s" % token)
                 elif reg_only_numeric_eng.match(token):
                     m = reg_only_numeric_eng.search(token)
-                    expr += m.group('number') + "*" + str(suffixd[m.group('suffix')])
+                    expr += m.group('number') + "*" + suffixd[m.group('suffix')]
                 else:
                     expr += token
         return expr
@@ -157,7 +171,7 @@ def evaluate_params(paramsd, parent=None):
         if param not in evaluated_paramsd:
             tmp = evaluate_param(param, paramsd, evaluated_paramsd, parent, [param])
             if tmp:
-                evaluated_paramsd.update({param: sympy.sympify(tmp,sympy.abc._clash)})
+                evaluated_paramsd.update({param: sympify(tmp)})
     return evaluated_paramsd
 
 
@@ -181,7 +195,7 @@ def evaluate_passed_params(paramsd, inst, evaluated_paramsd=None):
         if param not in evaluated_paramsd:
             tmp = evaluate_expresion(param_str, inst.paramsd)
             if tmp:
-                evaluated_paramsd.update({param: sympy.sympify(tmp,sympy.abc._clash)})
+                evaluated_paramsd.update({param: sympify(tmp)})
             elif inst.parent:
                 evaluate_passed_params({param: paramsd}, inst.parent, evaluated_paramsd)
     return evaluated_paramsd
@@ -303,12 +317,12 @@ def results2values(tokens, instance):
                     raise scs_errors.ScsInstanceError("Can't find function: %s" % token)
             elif reg_only_symbol.match(token):  # symbol token
                 if token in instance.paramsd:
-                    ret_str += str(instance.paramsd[token])
+                    ret_str += '(%s)' % instance.paramsd[token]
                 else:
                     raise scs_errors.ScsInstanceError("Can't find definition for parameter: %s" % token)
             elif reg_only_numeric_eng.match(token):
                 m = reg_only_numeric_eng.search(token)
-                ret_str += m.group('number') + "*" + str(suffixd[m.group('suffix')])
+                ret_str += m.group('number') + "*" + suffixd[m.group('suffix')]
             else:
                 ret_str += token
     return ret_str
@@ -331,12 +345,12 @@ def params2values(tokens, valuesd):
         else:
             if reg_only_symbol.match(token):  # symbol token
                 if token in valuesd:
-                    ret_str += str(valuesd[token])
+                    ret_str += '(%s)' % valuesd[token]
                 else:
                     raise scs_errors.ScsInstanceError("Can't find definition for parameter: %s" % token)
             elif reg_only_numeric_eng.match(token):
                 m = reg_only_numeric_eng.search(token)
-                ret_str += m.group('number') + "*" + str(suffixd[m.group('suffix')])
+                ret_str += m.group('number') + "*" + suffixd[m.group('suffix')]
             else:
                 ret_str += token
     return ret_str
@@ -352,7 +366,28 @@ def evaluate_expresion(expresion, valuesd):
         Evaluate expresion into tokens and than change it to a single value or symbolic expresion
     """
     tokens = parse_param_expresion(expresion)
-    return sympy.sympify(params2values(tokens, valuesd),sympy.abc._clash)
+    return sympify(params2values(tokens, valuesd))
+
+
+def evaluate_nominal(nominald, paramsd):
+    """ Evaluates nominal values of symbols
+
+        nominald: dictionary of symbol names and expresions of their nominal values (as declared by .nominal)
+
+        paramsd: dictionary of evaluated parameters (name value pairs) which can be used in expresions
+
+        Returns dictionary of symbol:number pairs. Raises ScsParameterError if some of the values is not a number.
+    """
+    nominal = {}
+    for name, value in nominald.iteritems():
+        tokens = parse_param_expresion(value)
+        try:
+            value = sympify(params2values(tokens, paramsd))
+            float(value)
+        except (ValueError, TypeError, sympy.SympifyError, scs_errors.ScsInstanceError):
+            raise scs_errors.ScsParameterError("Nominal value of %s is not a number." % name)
+        nominal.update({sympy.symbols(name): value})
+    return nominal
 
 
 def strip_comment(in_str):
@@ -476,8 +511,9 @@ def include_file(param_d, param_l, name, circuit):
 
         Function is on the list of function for getNameFunctionFromHead. It includes contents of another file into
         parsing process. It just start parsing this file. Returns circuit (could be modified while parsing include file)
+        Path can be written with \\ separators (as in examples) on any system.
     """
-    parse_file(param_l[0], circuit)
+    parse_file(param_l[0].replace('\\', os.sep), circuit)
     return circuit
 
 
@@ -502,6 +538,66 @@ def add_param(param_d, param_l, name, circuit):
     return circuit
 
 
+def add_nominal(param_d, param_l, name, circuit):
+    """ Adds nominal values of symbols to top circuit
+
+        param_d: dictionary of symbol names and expresions of their nominal values
+
+        param_l: dummy - ignored
+
+        name: dummy - ignored
+
+        circuit: circuit where we are adding nominal values
+
+        Function is on the list of function for getNameFunctionFromHead. Nominal values are used by approximate solve
+        to find out which terms are insignificant. Returns the circuit.
+    """
+    if not circuit.parent:  # Check if top circuit
+        circuit.nominald.update(param_d)
+    return circuit
+
+
+def add_symbolic(param_d, param_l, name, circuit):
+    """ Adds names of symbols which stay symbolic to top circuit
+
+        param_d: dummy - ignored
+
+        param_l: list of names of symbols, like: .symbolic gm CL
+
+        name: dummy - ignored
+
+        circuit: circuit where we are adding names
+
+        Function is on the list of function for getNameFunctionFromHead. If any symbol is declared to stay symbolic, all
+        other symbols which have nominal values are replaced with them while instantiating, before equations are
+        written. Returns the circuit.
+    """
+    if not circuit.parent:  # Check if top circuit
+        circuit.symbolicl += param_l
+    return circuit
+
+
+def add_symmetry(param_d, param_l, name, circuit):
+    """ Adds declaration of mirror symmetry to circuit
+
+        param_d: dummy - ignored
+
+        param_l: list of names of nets or elements (also subcircuit instances), each two consecutive of them being
+        mirror images of each other, like: .symmetry outp outm xmp xmm
+
+        name: dummy - ignored
+
+        circuit: circuit where we are adding declaration
+
+        Function is on the list of function for getNameFunctionFromHead. Symmetric circuit is solved as differential and
+        common mode halves. Returns the circuit.
+    """
+    if len(param_l) % 2:
+        raise scs_errors.ScsParserError("Odd number of names in symmetry declaration: %s" % ' '.join(param_l))
+    circuit.symmetryl += [(param_l[i], param_l[i + 1]) for i in range(0, len(param_l), 2)]
+    return circuit
+
+
 def add_analysis(param_d, param_l, name, circuit):
     """ Adds element to top circuit
         
@@ -539,6 +635,22 @@ def change_to_parent_circuit(param_d, param_l, name, circuit):
     return circuit.parent
 
 
+def parse_element(line):
+    """ Parses element definition written as in netlist
+
+        line: string with element definition, like: R1 n1 n2 10k
+
+        Name of the element can be in dot notation (like xamp.R1). Returns name of the element and element template
+        (scs_circuit.Element) which can be instantiated later.
+    """
+    param_d, line = get_params(strip_comment(line))
+    param_l = get_unnamed_params(line)
+    if not param_l:
+        raise scs_errors.ScsParserError("Empty element definition.")
+    name = param_l.pop(0)
+    return name, scs_circuit.Element(param_l, param_d)
+
+
 def get_name_function_from_head(head):
     """ Return appropriate function depending on head string
 
@@ -553,8 +665,13 @@ def get_name_function_from_head(head):
                      'include': include_file,
                      'subckt': add_subcircuit,
                      'measure': add_analysis,
+                     'print': add_analysis,
                      'ac': add_analysis,
                      'dc': add_analysis,
+                     'tf': add_analysis,
+                     'nominal': add_nominal,
+                     'symbolic': add_symbolic,
+                     'symmetry': add_symmetry,
                      'ends': change_to_parent_circuit}
     if head[0] == '.':
         if name in function_dict:
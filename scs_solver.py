@@ -0,0 +1,1537 @@
+"""
+Elimination engines for nodal systems of instances
+
+While solving an instance we write equations for inner nets in form of:
+G_i*Vi + G_p*Vp = I
+and we need Vi = G_i^-1*I - G_i^-1*G_p*Vp. Engines in this module factorize G_i matrix once
+and then provide solution X of G_i*X = B for any right hand side matrix B, so V0 and Ap can be
+calculated without forming explicit inverse (unless engine is doing just that). Engines can also provide only chosen
+entries of X, which is used by LazySolution to calculate only those entries of V0 and Ap which are really needed.
+
+InverseEngine - symbolic inversion of dense G_i matrix, then product of inverse with right hand side
+BareissEngine - fraction-free (Bareiss) sparse LU factorization, then forward and back substitution, unknowns are
+                eliminated in fill-reducing order found by minimum_degree_order
+DDDEngine - determinant decision diagram of minors of G_i, solution from cofactors (Cramer's rule)
+InterpolationEngine - determinant and numerators of solution are interpolated from rational solutions of G_i evaluated
+                      at sample points
+SymmetricEngine - system symmetric for swapping pairs of unknowns (like fully differential circuit) is split into
+                  differential and common mode halves, each solved by another engine, pairs are found by symmetry_pairs
+
+CostEstimate predicts from structure of the system how long each of engines would take to solve it, which is used to
+pick the engine automatically.
+
+Engines are picked by their name from engined dictionary.
+
+System can be also given as ExactMatrix, in which entries are already elements of a field of rational functions of
+circuit symbols over rationals, so no conversion (nor floats) are involved until solution is given back as expressions.
+"""
+
+import math
+import random
+import sympy
+from sympy.polys.domains import QQ
+from sympy.polys.fields import FracField, FracElement
+from sympy.polys.rings import PolyRing
+
+import scs_errors
+
+__author__ = "Tomasz Kniola"
+__credits__ = ["Tomasz Kniola"]
+
+__license__ = "LGPL"
+__version__ = "0.0.1"
+__email__ = "kniola.tomasz@gmail.com"
+__status__ = "development"
+
+
+class InverseEngine(object):
+    """ Engine which inverts whole G_i matrix symbolically.
+
+        It's the simplest way to do it, but cost of it grows very quickly with size of matrix. Entries of solution are
+        products of inverse with right hand side, which aren't cancelled (canonical is False).
+    """
+
+    canonical = False
+
+    def __init__(self, G, symbols=()):
+        """ Initialize InverseEngine
+
+            G: square sympy Matrix of a system to be solved
+
+            symbols: symbols which can appear in right hand sides, not needed by this engine
+
+            Raises ValueError if matrix is singular.
+        """
+        if isinstance(G, ExactMatrix):
+            G = G.to_sympy()
+        G = sympy.Matrix(G)
+        self.n = G.rows
+        self.G_inv = G.inv() if self.n else G
+
+    def solve_entries(self, b, rows, cache):
+        """ Solves chosen entries of x for system G*x = b
+
+            b: list of right hand side values
+
+            rows: list of indexes of entries of x which are needed
+
+            cache: dictionary kept by caller for that right hand side, not needed by this engine
+
+            Returns dictionary of row index and solution value.
+        """
+        b = sympy.Matrix([as_expr(value) for value in b])
+        return dict((i, (self.G_inv[i, :] * b)[0]) for i in rows)
+
+    def solve(self, B):
+        """ Solves system G*X = B
+
+            B: sympy Matrix with right hand sides in its columns
+
+            Returns sympy Matrix X.
+        """
+        if not self.n:
+            return sympy.zeros(0, B.cols)
+        if isinstance(B, ExactMatrix):
+            B = B.to_sympy()
+        return self.G_inv * sympy.Matrix(B)
+
+    def low_rank_update(self, columns, dG, dB):
+        """ Solves system which differs from the factorized one in few rows, using Sherman-Morrison-Woodbury formula
+
+            columns: list of (b, cache) pairs, b being list of right hand side values and cache dictionary kept for it
+
+            dG: dictionary row:{column:value} of changes in rows of G
+
+            dB: list of dictionaries row:value of changes in right hand sides, one for each of columns
+
+            With E selecting k changed rows, W = G^-1*E, Y = G^-1*B + W*dB:
+            X = Y - W*(I + dG*W)^-1*dG*Y
+            Returns list of solutions, one list of values for each of columns. Raises ValueError if new system is
+            singular.
+        """
+        rows = sorted(set(dG) | set(row for db in dB for row in db))
+        k = len(rows)
+        W = sympy.Matrix(self.n, k, lambda i, t: self.G_inv[i, rows[t]])
+        dG_m = sympy.Matrix(k, self.n, lambda t, j: dG.get(rows[t], {}).get(j, 0))
+        dB_m = sympy.Matrix(k, len(columns), lambda t, c: dB[c].get(rows[t], 0))
+        B = sympy.Matrix(self.n, len(columns), lambda i, c: as_expr(columns[c][0][i]))
+        Y = self.G_inv * B + W * dB_m
+        X = Y - W * ((sympy.eye(k) + dG_m * W).inv() * (dG_m * Y))
+        return [[sympy.cancel(X[i, c]) for i in range(self.n)] for c in range(len(columns))]
+
+
+class PolynomialEngine(object):
+    """ Base of engines which work on polynomials over rationals with circuit symbols as generators.
+
+        Rows of matrix are multiplied by least common multiple of their denominators, so all entries are polynomials,
+        and right hand sides are multiplied by the same and by common denominator D.
+    """
+
+    def _polynomial_rows(self, G, symbols):
+        """ Sets field of rational functions and provides rows of G as polynomials
+
+            G: square sympy Matrix (dense or sparse) or ExactMatrix
+
+            symbols: symbols which can appear in right hand sides, apart of those in G
+
+            Returns list of rows, each being dictionary column:polynomial of non-zero entries. Sets n, field, ring and
+            scales (multiplier of each row which makes it free of denominators).
+        """
+        self.n = G.rows
+        if isinstance(G, ExactMatrix):
+            self.field = G.field
+            matrix_rows = G.entries
+        else:
+            self.field = FracField(sorted(set(symbols) | G.free_symbols, key=str), QQ)
+            if isinstance(G, sympy.SparseMatrix):
+                matrix_rows = [{} for i in range(self.n)]
+                for i, j, value in G.row_list():
+                    matrix_rows[i].update({j: value})
+            else:
+                matrix_rows = [dict((j, G[i, j]) for j in range(self.n) if G[i, j] != 0) for i in range(self.n)]
+        self.ring = self.field.ring
+
+        self.scales = []
+        rows = []
+        for i in range(self.n):
+            row = {}
+            scale = self.ring.one
+            for j, value in matrix_rows[i].iteritems():
+                value = self._to_field(value)
+                if value:
+                    row.update({j: value})
+                    scale = scale.lcm(value.denom)
+            for j, value in row.iteritems():
+                row[j] = value.numer * scale.exquo(value.denom)
+            self.scales.append(scale)
+            rows.append(row)
+        return rows
+
+    def _polynomial_rhs(self, b):
+        """ Provides right hand side as polynomials
+
+            b: list of right hand side values
+
+            Returns list of polynomials, b multiplied by scales of rows and by D, and D.
+        """
+        b = [self._to_field(b[i]) * self.scales[i] for i in range(self.n)]
+        D = self.ring.one
+        for value in b:
+            D = D.lcm(value.denom)
+        return [value.numer * D.exquo(value.denom) for value in b], D
+
+    def _to_field(self, value):
+        """ Converts sympy expression into rational function of circuit symbols.
+
+            value: sympy expression, floats in it are replaced with rationals of same decimal representation, or
+            element of the field already
+        """
+        if isinstance(value, FracElement) and value.field == self.field:
+            return value
+        return to_field(self.field, value)
+
+
+class BareissEngine(PolynomialEngine):
+    """ Engine performing fraction-free sparse LU factorization of G_i matrix.
+
+        Entries are converted into polynomials over rationals with circuit symbols as generators. Rows are kept as
+        dictionaries column:value with only non-zero entries, each row is first multiplied by least common multiple of
+        its denominators, and then Bareiss elimination is performed:
+
+        a_ij(k) = (a_kk(k-1)*a_ij(k-1) - a_ik(k-1)*a_kj(k-1)) / a_k-1k-1(k-2)
+
+        where division is exact, so entries stay polynomials (minors of the matrix) and never grow into nested
+        fractions. Columns (unknowns) are eliminated in minimum degree order of adjacency graph of the matrix, and pivot
+        for each column is chosen from rows with non-zero entry as the one with fewest entries, which both limit
+        fill-in. Steps of elimination are recorded, so any right hand side can be transformed the same way, and solution
+        is found by fraction-free back substitution, dividing by determinant only at the end.
+    """
+
+    def __init__(self, G, symbols=()):
+        """ Initialize BareissEngine and factorize matrix
+
+            G: square sympy Matrix (dense or sparse) or ExactMatrix of a system to be solved
+
+            symbols: symbols which can appear in right hand sides, apart of those in G
+
+            Raises ValueError if matrix is singular.
+        """
+        self.steps = []     # list of elimination steps (pivot_row, pivot, previous_pivot, {row: multiplier})
+        self.U = {}         # rows of upper triangular matrix, U[k] is the row which was pivot for column k
+        rows = self._polynomial_rows(G, symbols)
+
+        self.order, self.fill = minimum_degree_order(rows)
+        self.position = dict((self.order[k], k) for k in range(self.n))    # step in which column is eliminated
+        remaining = range(self.n)
+        prev = self.ring.one
+        for k in self.order:
+            candidates = [i for i in remaining if k in rows[i]]
+            if not candidates:
+                raise ValueError("Matrix is singular.")
+            r = min(candidates, key=lambda i: len(rows[i]))
+            remaining.remove(r)
+            pivot_row = rows[r]
+            p = pivot_row[k]
+            multipliers = {}
+            for i in remaining:
+                row = rows[i]
+                a_ik = row.pop(k, None)
+                if a_ik:
+                    multipliers.update({i: a_ik})
+                    for j in set(row) | set(pivot_row):
+                        if j == k:
+                            continue
+                        value = (p * row.get(j, self.ring.zero) - a_ik * pivot_row.get(j, self.ring.zero)).exquo(prev)
+                        if value:
+                            row[j] = value
+                        elif j in row:
+                            row.pop(j)
+                elif p != prev:
+                    for j in row:
+                        row[j] = (p * row[j]).exquo(prev)
+            self.steps.append((r, p, prev, multipliers))
+            self.U.update({k: pivot_row})
+            prev = p
+
+    def transform(self, b):
+        """ Performs on right hand side vector same operations as were performed on matrix during elimination.
+
+            b: list of right hand side values
+
+            Returns dictionary of polynomials y, where y[k] is value for row which was pivot for column k, and
+            polynomial D, so U*X = y/D.
+        """
+        b, D = self._polynomial_rhs(b)
+        remaining = range(self.n)
+        y = {}
+        for k in range(self.n):
+            r, p, prev, multipliers = self.steps[k]
+            remaining.remove(r)
+            b_r = b[r]
+            for i in remaining:
+                if i in multipliers:
+                    b[i] = (p * b[i] - multipliers[i] * b_r).exquo(prev)
+                elif b[i] and p != prev:
+                    b[i] = (p * b[i]).exquo(prev)
+            y.update({self.order[k]: b_r})
+        return y, D
+
+    def back_substitute(self, y, D, rows, z):
+        """ Solves chosen entries of upper triangular system U*X = y/D
+
+            y: dictionary of transformed right hand side polynomials
+
+            D: common denominator of right hand side
+
+            rows: list of indexes of entries of X which are needed
+
+            z: dictionary of already calculated entries of Z, updated by this function
+
+            Solution is X = Z/det, where det is last pivot. Z is calculated with exact divisions:
+            Z_k = (det*y_k - sum(U_kj*Z_j)) / U_kk
+            Only entries which are needed for the rows asked for are calculated (those which have non-zero U_kj).
+            Returns dictionary of row index and solution value as sympy expressions.
+        """
+        det = self.U[self.order[-1]][self.order[-1]]
+        self._back_substitute_numerators(y, rows, z)
+        denominator = self.field(det * D)
+        return dict((k, (self.field(z[k]) / denominator).as_expr() if z[k] else sympy.Integer(0)) for k in rows)
+
+    def _back_substitute_numerators(self, y, rows, z):
+        """ Calculates entries of Z (see back_substitute) needed for rows, as polynomials
+
+            y: dictionary of transformed right hand side polynomials
+
+            rows: list of indexes of entries of Z which are needed
+
+            z: dictionary of already calculated entries of Z, updated by this function
+        """
+        det = self.U[self.order[-1]][self.order[-1]]
+        needed = set()
+        stack = [k for k in rows if k not in z]
+        while stack:
+            k = stack.pop()
+            if k in needed:
+                continue
+            needed.add(k)
+            stack += [j for j in self.U[k] if j != k and j not in z and j not in needed]
+        for k in sorted(needed, key=self.position.get, reverse=True):
+            value = det * y[k]
+            for j, u in self.U[k].iteritems():
+                if j != k and z[j]:
+                    value -= u * z[j]
+            z[k] = value.exquo(self.U[k][k])
+
+    def solve_entries(self, b, rows, cache):
+        """ Solves chosen entries of x for system G*x = b
+
+            b: list of right hand side values
+
+            rows: list of indexes of entries of x which are needed
+
+            cache: dictionary kept by caller for that right hand side, holds transformed b and partial solution
+
+            Returns dictionary of row index and solution value.
+        """
+        if 'y' not in cache:
+            cache.update({'z': {}})
+            cache['y'], cache['D'] = self.transform(b)
+        return self.back_substitute(cache['y'], cache['D'], rows, cache['z'])
+
+    def _numerators(self, b, cache):
+        """ Provides all entries of Z and D for right hand side, so x = Z/(det*D), without converting them.
+
+            b: list of right hand side values
+
+            cache: dictionary kept for that right hand side, as in solve_entries
+        """
+        if 'y' not in cache:
+            cache.update({'z': {}})
+            cache['y'], cache['D'] = self.transform(b)
+        self._back_substitute_numerators(cache['y'], range(self.n), cache['z'])
+        return [cache['z'][i] for i in range(self.n)], cache['D']
+
+    def solve(self, B):
+        """ Solves system G*X = B
+
+            B: sympy Matrix with right hand sides in its columns
+
+            Returns sympy Matrix X.
+        """
+        return LazySolution(self, B).matrix()
+
+    def low_rank_update(self, columns, dG, dB):
+        """ Solves system which differs from the factorized one in few rows, using Sherman-Morrison formula row by row
+
+            columns: list of (b, cache) pairs, b being list of right hand side values and cache dictionary kept for it
+            (as by LazySolution), so already calculated parts of solution are reused
+
+            dG: dictionary row:{column:value} of changes in rows of G
+
+            dB: list of dictionaries row:value of changes in right hand sides, one for each of columns
+
+            Solutions are kept fraction-free as X_c = x_c/(det*D_c), where x_c are polynomials. Column w_r = G^-1*e_r
+            is solved for each changed row r. Change of right hand side in row r, p/q, gives:
+            x_c = q*x_c + D_c*p*w_r, D_c = D_c*q
+            and change of row r of G, g/d (g being polynomials), with det' = d*det + g*w_r (determinant of new matrix
+            with rows scaled), gives:
+            x_c = (det'*x_c - (g*x_c)*w_r) / det
+            where division is exact. Columns w of rows which are updated later are updated the same way.
+            Returns list of solutions, one list of sympy expressions for each of columns. Raises ValueError if new
+            system is singular.
+        """
+        rows = sorted(set(dG) | set(row for db in dB for row in db))
+        x = []
+        D = []
+        for b, cache in columns:
+            z, D_c = self._numerators(b, cache)
+            x.append(z)
+            D.append(D_c)
+        w = {}
+        for r in rows:
+            w.update({r: self._numerators([1 if i == r else 0 for i in range(self.n)], {})[0]})
+        det = self.U[self.order[-1]][self.order[-1]]
+
+        # Changes can bring in new symbols, then polynomials are moved into larger ring
+        gens = set(self.field.symbols)
+        for values in dG.values() + dB:
+            for value in values.itervalues():
+                gens |= sympy.sympify(value).free_symbols
+        field = FracField(sorted(gens, key=str), QQ) if len(gens) > len(self.field.symbols) else self.field
+        if field != self.field:
+            x = [[value.set_ring(field.ring) for value in vector] for vector in x]
+            D = [value.set_ring(field.ring) for value in D]
+            w = dict((r, [value.set_ring(field.ring) for value in vector]) for r, vector in w.iteritems())
+            det = det.set_ring(field.ring)
+
+        for t in range(len(rows)):
+            r = rows[t]
+            w_r = w.pop(r)
+            for c in range(len(columns)):
+                if r in dB[c]:
+                    value = to_field(field, dB[c][r])
+                    p, q = value.numer, value.denom
+                    x[c] = [q * x[c][i] + D[c] * p * w_r[i] for i in range(self.n)]
+                    D[c] = D[c] * q
+            if r not in dG:
+                continue
+            g = dict((j, to_field(field, value)) for j, value in dG[r].iteritems())
+            d = field.ring.one
+            for value in g.itervalues():
+                d = d.lcm(value.denom)
+            g = dict((j, value.numer * d.exquo(value.denom)) for j, value in g.iteritems())
+            new_det = d * det + sum((value * w_r[j] for j, value in g.iteritems()), field.ring.zero)
+            if not new_det:
+                raise ValueError("Matrix is singular.")
+            for vector in x + w.values():
+                gx = sum((value * vector[j] for j, value in g.iteritems()), field.ring.zero)
+                for i in range(self.n):
+                    vector[i] = (new_det * vector[i] - gx * w_r[i]).exquo(det)
+            det = new_det
+
+        solutions = []
+        for c in range(len(columns)):
+            denominator = field(det * D[c])
+            solutions.append([(field(value) / denominator).as_expr() if value else sympy.Integer(0)
+                              for value in x[c]])
+        return solutions
+
+
+class DDDEngine(PolynomialEngine):
+    """ Engine representing determinant and cofactors of G_i matrix as determinant decision diagram.
+
+        Determinant of submatrix with rows R and columns C is expanded along one of its rows r (first one in minimum
+        degree order):
+
+        det(R,C) = sum((-1)^(pos(r)+pos(c)) * a_rc * det(R-r,C-c)) for c in C with non-zero a_rc
+
+        where pos is position in R or C. Each minor (R,C) is a node of the diagram with terms of the expansion as its
+        edges, and minors reached by different paths are shared, so the diagram stays much smaller than expanded
+        determinant. Solution is found with Cramer's rule from cofactors of the matrix, which are nodes as well:
+
+        x_i = sum(b_k * (-1)^(k+i) * det(all-k,all-i)) / det(all,all)
+
+        Polynomial values of nodes are calculated only when entries of solution are asked for, and kept for reuse.
+
+        With approximation, terms are dropped from values of nodes while they are calculated (simplification during
+        generation). Terms of each coefficient of powers of s are evaluated with nominal values of symbols, and the
+        smallest ones are dropped as long as sum of their magnitudes stays below tolerance times value of the
+        coefficient. Achieved error is found by comparing determinant and numerators of solution, with nominal values
+        substituted, to the same calculated without dropping any terms (which is cheap, as these are polynomials of s
+        only). It's kept in error attribute as the largest relative error of coefficients of powers of s.
+    """
+
+    def __init__(self, G, symbols=(), approximation=None):
+        """ Initialize DDDEngine and build diagram of determinant
+
+            G: square sympy Matrix (dense or sparse) or ExactMatrix of a system to be solved
+
+            symbols: symbols which can appear in right hand sides, apart of those in G
+
+            approximation: tuple of dictionary of nominal values of symbols (symbol:number) and tolerance, if given
+            small terms are dropped from solution
+
+            Raises ValueError if matrix is singular, or ScsInstanceError if nominal value of a symbol is missing.
+        """
+        self.rows = self._polynomial_rows(G, symbols)
+        self.approximation = approximation
+        if approximation is not None:
+            self._set_nominal(*approximation)
+        self.order = minimum_degree_order(self.rows)[0]
+        self.position = dict((self.order[k], k) for k in range(self.n))
+        self.nodes = {}     # dictionary of (R,C): list of edges (sign, r, c, child node), or None if minor is zero
+        self.values = {}    # dictionary of (R,C): polynomial value of minor
+        self.all = frozenset(range(self.n))
+        self.root = self.node(self.all, self.all)
+        if self.root is None or not self.value(self.root):
+            raise ValueError("Matrix is singular.")
+        if self.approximation is not None:
+            self._check(self.value(self.root), self._reference_value(self.root))
+
+    def node(self, R, C):
+        """ Provides node of minor, building it (and nodes below it) if it isn't in diagram yet
+
+            R: frozenset of rows of minor
+
+            C: frozenset of columns of minor
+
+            Returns key of node, or None if minor is structurally zero.
+        """
+        key = (R, C)
+        if key not in self.nodes:
+            edges = []
+            if R:
+                r = min(R, key=self.position.get)
+                R_rest = R - frozenset([r])
+                p_r = len([i for i in R if i < r])
+                p_c = 0
+                for c in sorted(C):
+                    if c in self.rows[r]:
+                        child = self.node(R_rest, C - frozenset([c]))
+                        if child is not None:
+                            edges.append((-1 if (p_r + p_c) % 2 else 1, r, c, child))
+                    p_c += 1
+            self.nodes.update({key: edges if edges or not R else None})
+        return key if self.nodes[key] is not None else None
+
+    def value(self, key):
+        """ Provides polynomial value of minor
+
+            key: key of node of the minor
+        """
+        if key not in self.values:
+            value = self.ring.one if not key[0] else self.ring.zero
+            for sign, r, c, child in self.nodes[key]:
+                value += sign * self.rows[r][c] * self.value(child)
+            if self.approximation is not None:
+                value = self._prune(value)
+            self.values.update({key: value})
+        return self.values[key]
+
+    def _set_nominal(self, nominal, tolerance):
+        """ Prepares nominal values of symbols for approximation
+
+            nominal: dictionary of symbol:number
+
+            tolerance: allowed relative error of each coefficient of powers of s
+        """
+        s = sympy.symbols('s')
+        missing = [str(symbol) for symbol in self.ring.symbols if symbol != s and symbol not in nominal]
+        if missing:
+            raise scs_errors.ScsInstanceError("No nominal values for approximation of: %s" % ', '.join(missing))
+        self.tolerance = tolerance
+        self.s_index = self.ring.symbols.index(s) if s in self.ring.symbols else None
+        self.nominal = [QQ.from_sympy(rationalize(nominal[symbol])) if symbol != s else QQ.one
+                        for symbol in self.ring.symbols]
+        self.reference_ring = PolyRing([s], QQ)
+        self.reference_rows = [dict((j, self._reference(value)) for j, value in row.iteritems()) for row in self.rows]
+        self.references = {}
+        self.error = 0.0
+
+    def _coefficients(self, poly):
+        """ Provides terms of polynomial evaluated at nominal values, grouped by powers of s
+
+            Returns dictionary of power of s: list of (value, monomial).
+        """
+        coefficients = {}
+        for monom, coeff in poly.iterterms():
+            for v, e in enumerate(monom):
+                if e:
+                    coeff *= self.nominal[v] ** e
+            coefficients.setdefault(monom[self.s_index] if self.s_index is not None else 0, []).append((coeff, monom))
+        return coefficients
+
+    def _prune(self, poly):
+        """ Drops terms of polynomial which are too small to matter at nominal values
+        """
+        dropped = []
+        for terms in self._coefficients(poly).itervalues():
+            allowed = self.tolerance * abs(float(sum(value for value, monom in terms)))
+            for value, monom in sorted(terms, key=lambda term: abs(term[0])):
+                allowed -= abs(float(value))
+                if allowed < 0:
+                    break
+                dropped.append(monom)
+        if not dropped:
+            return poly
+        poly = poly.copy()
+        for monom in dropped:
+            del poly[monom]
+        return poly
+
+    def _reference(self, poly):
+        """ Provides polynomial of s, with nominal values substituted for other symbols
+        """
+        return self.reference_ring.from_dict(dict(((power,), sum(value for value, monom in terms))
+                                                  for power, terms in self._coefficients(poly).iteritems()))
+
+    def _reference_value(self, key):
+        """ Provides value of minor calculated at nominal values without dropping any terms
+
+            key: key of node of the minor
+        """
+        if key not in self.references:
+            value = self.reference_ring.one if not key[0] else self.reference_ring.zero
+            for sign, r, c, child in self.nodes[key]:
+                value += sign * self.reference_rows[r][c] * self._reference_value(child)
+            self.references.update({key: value})
+        return self.references[key]
+
+    def _check(self, poly, reference):
+        """ Updates achieved error with error of polynomial
+
+            poly: approximated polynomial
+
+            reference: same polynomial calculated at nominal values without dropping any terms
+        """
+        approximated = self._reference(poly)
+        scale = max([abs(float(coeff)) for coeff in reference.itercoeffs()] + [0.0])
+        for monom in set(approximated.itermonoms()) | set(reference.itermonoms()):
+            difference = approximated.get(monom, QQ.zero) - reference.get(monom, QQ.zero)
+            exact = abs(float(reference.get(monom, QQ.zero))) or scale
+            if exact:
+                self.error = max(self.error, abs(float(difference)) / exact)
+
+    def solve_entries(self, b, rows, cache):
+        """ Solves chosen entries of x for system G*x = b
+
+            b: list of right hand side values
+
+            rows: list of indexes of entries of x which are needed
+
+            cache: dictionary kept by caller for that right hand side, holds b converted into polynomials
+
+            Returns dictionary of row index and solution value.
+        """
+        if 'b' not in cache:
+            cache['b'], cache['D'] = self._polynomial_rhs(b)
+        b, D = cache['b'], cache['D']
+        denominator = self.field(self.value(self.root) * D)
+        solution = {}
+        for i in rows:
+            numerator = self.ring.zero
+            reference = self.reference_ring.zero if self.approximation is not None else None
+            for k in range(self.n):
+                if b[k]:
+                    cofactor = self.node(self.all - frozenset([k]), self.all - frozenset([i]))
+                    if cofactor is not None:
+                        sign = -1 if (k + i) % 2 else 1
+                        numerator += sign * b[k] * self.value(cofactor)
+                        if reference is not None:
+                            reference += sign * self._reference(b[k]) * self._reference_value(cofactor)
+            if reference is not None:
+                numerator = self._prune(numerator)
+                self._check(numerator, reference)
+            solution.update({i: (self.field(numerator) / denominator).as_expr() if numerator else sympy.Integer(0)})
+        return solution
+
+    def solve(self, B):
+        """ Solves system G*X = B
+
+            B: sympy Matrix with right hand sides in its columns
+
+            Returns sympy Matrix X.
+        """
+        return LazySolution(self, B).matrix()
+
+
+class InterpolationEngine(PolynomialEngine):
+    """ Engine which rebuilds determinant and numerators of solution from their values at sample points.
+
+        Instead of pushing symbols through elimination, matrix is evaluated at points with rational values of all
+        symbols and solved there with plain rational Gaussian elimination, so there is no expression swell. Numerator
+        and denominator polynomials of each entry:
+
+        x_i = N_i / (det(G) * D)
+
+        are then recovered with sparse interpolation (see sparse_interpolate), with degree in each symbol bounded by
+        degrees of matrix entries. Solution is exact, the same as given by other engines.
+    """
+
+    def __init__(self, G, symbols=(), seed=0):
+        """ Initialize InterpolationEngine and interpolate determinant of G
+
+            G: square sympy Matrix (dense or sparse) or ExactMatrix of a system to be solved
+
+            symbols: symbols which can appear in right hand sides, apart of those in G
+
+            seed: seed of random choice of sample points
+
+            Raises ValueError if matrix is singular.
+        """
+        rows = self._polynomial_rows(G, symbols)
+        self.domain = self.ring.domain
+        self.random = random.Random(seed)
+        self.terms = [dict((j, value.terms()) for j, value in row.iteritems()) for row in rows]
+        self.degrees = [dict((j, self._degrees(terms)) for j, terms in row.iteritems()) for row in self.terms]
+        self.det = self._interpolate(lambda point: [self._determinant(self._matrix(point))], 1, [])[0]
+        if not self.det:
+            raise ValueError("Matrix is singular.")
+
+    def _degrees(self, terms):
+        """ Provides list of degrees of polynomial in each symbol
+
+            terms: list of (monomial, coefficient) of polynomial
+        """
+        return [max([0] + [monom[v] for monom, coeff in terms]) for v in range(self.ring.ngens)]
+
+    def _interpolate(self, evaluate, count, rhs_degrees):
+        """ Interpolates polynomials of determinant or of numerators of solution
+
+            evaluate: function giving list of count values of polynomials at a point
+
+            count: number of polynomials
+
+            rhs_degrees: list of degrees of right hand side polynomials (each being list of degrees in symbols), empty
+            for determinant
+
+            Returns list of polynomials.
+        """
+        # Degree of determinant is bounded by sum of highest degrees in each row, or in each column. Numerators are
+        # determinants with a column replaced by right hand side, so the same bounds are taken with it added.
+        bounds = []
+        for v in range(self.ring.ngens):
+            row_bound = 0
+            for i, row in enumerate(self.degrees):
+                degrees = [d[v] for d in row.itervalues()]
+                if rhs_degrees:
+                    degrees.append(rhs_degrees[i][v])
+                row_bound += max([0] + degrees)
+            column_bound = sum(max([0] + [row[j][v] for row in self.degrees if j in row]) for j in range(self.n))
+            column_bound += max([0] + [d[v] for d in rhs_degrees])
+            bounds.append(min(row_bound, column_bound))
+        return [self.ring.from_dict(poly) for poly in
+                sparse_interpolate(evaluate, count, bounds, self.domain, self.random)]
+
+    def _evaluate(self, terms, point):
+        """ Evaluates polynomial at a point
+
+            terms: list of (monomial, coefficient) of polynomial
+
+            point: list of values of symbols
+        """
+        value = self.domain.zero
+        for monom, coeff in terms:
+            for v, e in enumerate(monom):
+                if e:
+                    coeff *= point[v] ** e
+            value += coeff
+        return value
+
+    def _matrix(self, point):
+        """ Provides G evaluated at a point, as list of rows being dictionaries of column:non-zero value
+        """
+        matrix = []
+        for row in self.terms:
+            values = dict((j, self._evaluate(terms, point)) for j, terms in row.iteritems())
+            matrix.append(dict((j, value) for j, value in values.iteritems() if value))
+        return matrix
+
+    def _determinant(self, matrix):
+        """ Calculates determinant of matrix of rationals with Gaussian elimination
+
+            matrix: list of rows being dictionaries of column:value, it's changed in place
+        """
+        return self._eliminate(matrix, None)[0]
+
+    def _eliminate(self, matrix, b):
+        """ Gaussian elimination of matrix of rationals
+
+            matrix: list of rows being dictionaries of column:value, it's changed in place
+
+            b: list of right hand side values, changed in place, or None
+
+            Returns determinant and list of pivot rows (row used to eliminate each column), or determinant zero and
+            None if matrix is singular.
+        """
+        det = self.domain.one
+        pivots = []
+        free = range(self.n)
+        for k in range(self.n):
+            candidates = [i for i in free if matrix[i].get(k)]
+            if not candidates:
+                return self.domain.zero, None
+            p = min(candidates, key=lambda i: len(matrix[i]))
+            free.remove(p)
+            pivot = matrix[p][k]
+            det *= pivot
+            for i in candidates:
+                if i != p:
+                    factor = matrix[i].pop(k) / pivot
+                    for j, value in matrix[p].iteritems():
+                        if j != k:
+                            value = matrix[i].get(j, self.domain.zero) - factor * value
+                            if value:
+                                matrix[i][j] = value
+                            else:
+                                matrix[i].pop(j, None)
+                    if b is not None:
+                        b[i] -= factor * b[p]
+            pivots.append(p)
+        # sign of permutation of pivot rows
+        sign, seen = 1, set()
+        for k in range(self.n):
+            length, i = 0, k
+            while i not in seen:
+                seen.add(i)
+                i = pivots[i]
+                length += 1
+            if length and length % 2 == 0:
+                sign = -sign
+        return sign * det, pivots
+
+    def _numerators(self, b, rows, point):
+        """ Provides numerators N_i of solution at a point
+
+            b: list of right hand side polynomials terms
+
+            rows: list of indexes of entries which are needed
+
+            point: list of values of symbols
+        """
+        matrix = self._matrix(point)
+        rhs = [self._evaluate(terms, point) for terms in b]
+        reduced = list(rhs)
+        det, pivots = self._eliminate(matrix, reduced)
+        if pivots is None:
+            # singular at this point, numerators are determinants with column replaced by right hand side
+            numerators = []
+            for i in rows:
+                matrix = self._matrix(point)
+                for k in range(self.n):
+                    matrix[k].pop(i, None)
+                    if rhs[k]:
+                        matrix[k][i] = rhs[k]
+                numerators.append(self._determinant(matrix))
+            return numerators
+        x = {}
+        for k in reversed(range(self.n)):
+            row = matrix[pivots[k]]
+            x[k] = (reduced[pivots[k]] - sum(value * x[j] for j, value in row.iteritems() if j != k)) / row[k]
+        return [x[i] * det for i in rows]
+
+    def solve_entries(self, b, rows, cache):
+        """ Solves chosen entries of x for system G*x = b
+
+            b: list of right hand side values
+
+            rows: list of indexes of entries of x which are needed
+
+            cache: dictionary kept by caller for that right hand side, holds b converted into polynomials and already
+            interpolated numerators
+
+            Returns dictionary of row index and solution value.
+        """
+        if 'b' not in cache:
+            b, cache['D'] = self._polynomial_rhs(b)
+            cache['b'] = [value.terms() for value in b]
+            cache['N'] = {}
+        b, D, numerators = cache['b'], cache['D'], cache['N']
+        missing = [i for i in rows if i not in numerators]
+        if missing:
+            rhs_degrees = [self._degrees(terms) for terms in b]
+            values = self._interpolate(lambda point: self._numerators(b, missing, point), len(missing), rhs_degrees)
+            numerators.update(zip(missing, values))
+        denominator = self.field(self.det * D)
+        return dict((i, (self.field(numerators[i]) / denominator).as_expr() if numerators[i] else sympy.Integer(0))
+                    for i in rows)
+
+    def solve(self, B):
+        """ Solves system G*X = B
+
+            B: sympy Matrix with right hand sides in its columns
+
+            Returns sympy Matrix X.
+        """
+        return LazySolution(self, B).matrix()
+
+
+class SymmetricEngine(object):
+    """ Engine for system which doesn't change when pairs of unknowns (and their equations) are swapped, like fully
+        differential circuits.
+
+        For pairs (a,a') and unpaired unknowns f such system has G[p(i),p(j)] = G[i,j], where p swaps each pair. With
+        differential mode d_a = (x_a - x_a')/2 and common mode c_a = (x_a + x_a')/2, c_f = x_f unknowns, differences of
+        paired equations contain only d, and their sums (with unpaired equations) only c, so system splits into two
+        halves which are factorized separately:
+
+        (G[a,b] - G[a,b'])*d_b = (b_a - b_a')/2
+        (G[a,b] + G[a,b'])*c_b + G[a,f]*c_f = (b_a + b_a')/2
+        (G[f,b] + G[f,b'])*c_b + G[f,g]*c_g = b_f
+
+        and x_a = c_a + d_a, x_a' = c_a - d_a. As cost of symbolic elimination grows faster than size of the system,
+        two halves are much cheaper to solve than the whole system.
+    """
+
+    def __init__(self, G, pairs, engine, symbols=()):
+        """ Initialize SymmetricEngine and factorize both halves
+
+            G: square sympy Matrix or ExactMatrix of a system to be solved, symmetric for pairs (see symmetry_pairs)
+
+            pairs: list of (a,a') pairs of indexes of unknowns
+
+            engine: function making engine of a half from its matrix and symbols, like engine class from engined
+
+            symbols: symbols which can appear in right hand sides, apart of those in G
+
+            Raises ValueError if matrix is singular.
+        """
+        self.n = G.rows
+        self.pairs = pairs
+        paired = set(i for pair in pairs for i in pair)
+        self.fixed = [i for i in range(self.n) if i not in paired]
+        P = len(pairs)
+        self.index = {}     # dictionary of unknown: (index in common mode half, sign of differential mode part)
+        for k, (a, a2) in enumerate(pairs):
+            self.index.update({a: (k, 1), a2: (k, -1)})
+        for m, f in enumerate(self.fixed):
+            self.index.update({f: (P + m, 0)})
+        dm = {}
+        cm = {}
+        for (i, j), value in _entries(G).iteritems():
+            row, row_sign = self.index[i]
+            if row_sign < 0:
+                continue    # equation of a' is the mirror image of equation of a
+            column, sign = self.index[j]
+            cm[row, column] = cm.get((row, column), 0) + value
+            if row_sign and sign:
+                dm[row, column] = dm.get((row, column), 0) + sign * value
+        self.dm = engine(_matrix_like(G, dm, P), symbols) if P else None
+        self.cm = engine(_matrix_like(G, cm, self.n - P), symbols)
+        errors = [getattr(half, 'error', None) for half in (self.dm, self.cm)]
+        if None not in errors:
+            self.error = max(errors)
+
+    def solve_entries(self, b, rows, cache):
+        """ Solves chosen entries of x for system G*x = b
+
+            b: list of right hand side values
+
+            rows: list of indexes of entries of x which are needed
+
+            cache: dictionary kept by caller for that right hand side, holds caches of both halves
+
+            Returns dictionary of row index and solution value.
+        """
+        b_dm = [(b[a] - b[a2]) / 2 for a, a2 in self.pairs]
+        b_cm = [(b[a] + b[a2]) / 2 for a, a2 in self.pairs] + [b[f] for f in self.fixed]
+        cm = self.cm.solve_entries(b_cm, sorted(set(self.index[i][0] for i in rows)), cache.setdefault('cm', {}))
+        dm_rows = sorted(set(self.index[i][0] for i in rows if self.index[i][1]))
+        dm = self.dm.solve_entries(b_dm, dm_rows, cache.setdefault('dm', {})) if dm_rows else {}
+        solution = {}
+        for i in rows:
+            k, sign = self.index[i]
+            solution.update({i: sympy.cancel(cm[k] + sign * dm[k]) if sign else cm[k]})
+        return solution
+
+    def solve(self, B):
+        """ Solves system G*X = B
+
+            B: sympy Matrix with right hand sides in its columns
+
+            Returns sympy Matrix X.
+        """
+        return LazySolution(self, B).matrix()
+
+
+class CostEstimate(PolynomialEngine):
+    """ Predicts time of solving a system with each of engines, without solving it.
+
+        Cost of symbolic elimination is driven by number of terms of minors of the matrix, which isn't known until they
+        are calculated, so it's predicted from structure of the matrix. Size of the problem is taken as:
+
+        S = e * t^(w+1)
+
+        where e is number of edges of determinant decision diagram of the matrix (terms of expansion of all minors
+        along rows in minimum degree order, see DDDEngine), t is average number of terms of entries (rows freed from
+        denominators) and w is width of elimination, the largest number of neighbours of an unknown when it's
+        eliminated in minimum degree order. Predicted time in seconds of each engine is then:
+
+        log(time) = a + b*log(S) + c*log(columns) + d*symbols + f*(1 if s is one of symbols else 0)
+
+        with coefficients from cost_model dictionary, fitted to times of solving example circuits. Engine with the
+        lowest prediction is in engine attribute, predictions for all engines are in costs dictionary.
+    """
+
+    def __init__(self, G, symbols=(), columns=1, limit=10000):
+        """ Initialize CostEstimate and predict costs of engines
+
+            G: square sympy Matrix (dense or sparse) or ExactMatrix of a system to be solved
+
+            symbols: symbols which can appear in right hand sides, apart of those in G
+
+            columns: number of right hand sides which will be solved
+
+            limit: largest number of minors of one size which are enumerated, if there are more of them number of
+            edges of the diagram is extrapolated
+        """
+        rows = self._polynomial_rows(G, symbols)
+        self.columns = columns
+        self.symbols = len(self.ring.symbols)
+        self.s = sympy.symbols('s') in self.ring.symbols
+        self.entries = sum(len(row) for row in rows)
+        self.terms = float(sum(len(value) for row in rows for value in row.itervalues())) / max(self.entries, 1)
+        self.order, self.fill = minimum_degree_order(rows)
+        self.width = self._width(rows)
+        self.edges = self._edges(rows, limit)
+        self.size = max(self.edges, 1) * max(self.terms, 1) ** (self.width + 1)
+        self.costs = {}
+        for engine, (a, b, c, d, f) in cost_model.iteritems():
+            self.costs.update({engine: math.exp(a + b * math.log(self.size) + c * math.log(columns) +
+                                                d * self.symbols + f * self.s)})
+        self.engine = min(sorted(self.costs), key=self.costs.get)
+
+    def _width(self, rows):
+        """ Finds the largest number of neighbours of unknown eliminated in self.order in adjacency graph of rows
+        """
+        graph = dict((i, set()) for i in range(self.n))
+        for i in range(self.n):
+            for j in rows[i]:
+                if j != i:
+                    graph[i].add(j)
+                    graph[j].add(i)
+        width = 0
+        for k in self.order:
+            neighbours = graph.pop(k)
+            width = max(width, len(neighbours))
+            for i in neighbours:
+                graph[i].discard(k)
+                graph[i] |= neighbours - set([i])
+        return width
+
+    def _edges(self, rows, limit):
+        """ Counts edges of determinant decision diagram which DDDEngine would build for rows
+
+            Minors of each size are enumerated as sets of their columns (rows are given by self.order). When there are
+            more than limit of them, number of minors of following sizes is extrapolated with average number of edges
+            of each minor, bounded by number of all subsets of columns.
+        """
+        minors = set([frozenset(range(self.n))])
+        count = 1.0     # number of minors of current size, when they are no longer enumerated
+        edges = 0.0
+        for k, r in enumerate(self.order):
+            if minors is not None:
+                next_minors = set()
+                for C in minors:
+                    for c in C:
+                        if c in rows[r]:
+                            edges += 1
+                            next_minors.add(C - frozenset([c]))
+                if len(next_minors) > limit:
+                    count = float(len(next_minors))
+                    next_minors = None
+                minors = next_minors
+            else:
+                branching = len(rows[r]) * float(self.n - k) / self.n
+                edges += count * branching
+                count = min(count * max(branching, 1), _binomial(self.n, self.n - k - 1))
+        return edges
+
+
+def _binomial(n, k):
+    """ Number of k element subsets of n element set, as float
+    """
+    value = 1.0
+    for i in range(min(k, n - k)):
+        value = value * (n - i) / (i + 1)
+    return value
+
+
+def symmetry_pairs(G, pairs=None):
+    """ Finds pairs of unknowns which can be swapped (together with their equations) leaving system unchanged
+
+        G: square sympy Matrix or ExactMatrix
+
+        pairs: list of (a,a') pairs of indexes of unknowns to be checked, if not given they are looked for
+
+        Candidates are found by color refinement: unknowns are colored by their diagonal entries, then each unknown
+        gets new color from its color and from entries and colors of unknowns in its row and column, until number of
+        colors stops growing. Unknowns of colors which have exactly two of them are paired. Returns list of pairs if
+        G is symmetric for them, otherwise None.
+    """
+    entries = _entries(G)
+    if pairs is None:
+        neighbours = dict((i, ([], [])) for i in range(G.rows))
+        for (i, j), value in entries.iteritems():
+            neighbours[i][0].append((hash(value), j))
+            neighbours[j][1].append((hash(value), i))
+        colors = [hash(entries.get((i, i), 0)) for i in range(G.rows)]
+        count = len(set(colors))
+        while True:
+            signatures = [(colors[i], tuple(sorted((h, colors[j]) for h, j in neighbours[i][0])),
+                           tuple(sorted((h, colors[j]) for h, j in neighbours[i][1]))) for i in range(G.rows)]
+            numbers = dict((signature, k) for k, signature in enumerate(sorted(set(signatures))))
+            colors = [numbers[signature] for signature in signatures]
+            if len(numbers) == count:
+                break
+            count = len(numbers)
+        groups = {}
+        for i in range(G.rows):
+            groups.setdefault(colors[i], []).append(i)
+        pairs = [tuple(group) for color, group in sorted(groups.iteritems()) if len(group) == 2]
+    if not pairs:
+        return None
+    swap = dict((i, i) for i in range(G.rows))
+    for a, a2 in pairs:
+        swap.update({a: a2, a2: a})
+    for (i, j), value in entries.iteritems():
+        mirror = entries.get((swap[i], swap[j]), 0)
+        if mirror != value and (isinstance(value, FracElement) or sympy.cancel(value - mirror) != 0):
+            return None
+    return pairs
+
+
+def _entries(G):
+    """ Provides dictionary (row,column):value of non-zero entries of sympy Matrix or ExactMatrix
+    """
+    if isinstance(G, ExactMatrix):
+        return dict(((i, j), value) for i in range(G.rows) for j, value in G.entries[i].iteritems())
+    return dict(((i, j), value) for i, j, value in sympy.SparseMatrix(G).row_list() if value != 0)
+
+
+def _matrix_like(G, dok, n):
+    """ Makes square matrix of the same kind as G (sympy Matrix or ExactMatrix) from sparse dictionary
+
+        G: matrix which kind is copied
+
+        dok: dictionary (row,column):value of entries
+
+        n: size of the matrix
+    """
+    if isinstance(G, ExactMatrix):
+        entries = [{} for i in range(n)]
+        for (i, j), value in dok.iteritems():
+            if value:
+                entries[i].update({j: value})
+        return ExactMatrix(G.field, entries, n)
+    dok = dict((key, sympy.cancel(value)) for key, value in dok.iteritems())
+    return sympy.SparseMatrix(n, n, dict((key, value) for key, value in dok.iteritems() if value != 0))
+
+
+def unmatched(G, n):
+    """ Looks for structural singularity of sparse square matrix with maximum bipartite matching of rows and columns
+
+        G: dictionary (row,column):value of non-zero entries
+
+        n: size of the matrix
+
+        Row can be matched with column if their entry is non-zero, matching is grown by augmenting paths found with
+        breadth first search. If some rows can't be matched, matrix is singular whatever values its entries have.
+        Returns lists of unmatched rows and columns, both empty if matrix is structurally non singular.
+    """
+    adjacency = [[] for i in range(n)]
+    for i, j in sorted(G):
+        adjacency[i].append(j)
+    match_row = [None] * n  # column matched with row
+    match_column = [None] * n  # row matched with column
+    for root in range(n):
+        parent = {}
+        queue = [root]
+        end = None
+        for i in queue:
+            for j in adjacency[i]:
+                if j in parent:
+                    continue
+                parent.update({j: i})
+                if match_column[j] is None:
+                    end = j
+                    break
+                queue.append(match_column[j])
+            if end is not None:
+                break
+        # Flip the path, every row on it gets column which led to the next row
+        while end is not None:
+            i = parent[end]
+            match_row[i], match_column[end], end = end, i, match_row[i]
+    return [i for i in range(n) if match_row[i] is None], [j for j in range(n) if match_column[j] is None]
+
+
+def numeric_solve(G, B, n, tolerance=1e-9):
+    """ Solves numeric system G*X = B with Gaussian elimination with partial pivoting
+
+        G: dictionary (row,column):number of non-zero entries of square matrix
+
+        B: list of right hand sides, each being a list of n numbers
+
+        n: size of the matrix
+
+        tolerance: column is taken as dependent when its largest pivot is below tolerance times largest entry of G
+
+        Returns list of solutions and None, or None and list of indexes of non-zero entries of vector x for which
+        G*x = 0 if G is singular, which are unknowns that have no unique solution.
+    """
+    A = [[0j] * n + [complex(b[i]) for b in B] for i in range(n)]
+    for (i, j), value in G.iteritems():
+        A[i][j] = complex(value)
+    scale = max([abs(value) for row in A for value in row[:n]] + [1e-300])
+    pivots = []
+    free = []
+    for k in range(n):
+        r = len(pivots)
+        p = max(range(r, n), key=lambda i: abs(A[i][k])) if r < n else None
+        if p is None or abs(A[p][k]) <= tolerance * scale:
+            free.append(k)
+            continue
+        A[r], A[p] = A[p], A[r]
+        for i in range(r + 1, n):
+            f = A[i][k] / A[r][k]
+            if f:
+                A[i] = [a - f * b for a, b in zip(A[i], A[r])]
+        pivots.append(k)
+
+    def back_substitute(x, column):
+        for r in reversed(range(len(pivots))):
+            k = pivots[r]
+            x[k] = (column(r) - sum(A[r][j] * x[j] for j in range(k + 1, n))) / A[r][k]
+        return x
+
+    if free:
+        x = [0j] * n
+        x[free[0]] = 1
+        x = back_substitute(x, lambda r: 0)
+        largest = max(abs(value) for value in x)
+        return None, [j for j in range(n) if abs(x[j]) > tolerance * largest]
+    return [back_substitute([0j] * n, lambda r: A[r][n + c]) for c in range(len(B))], None
+
+
+def minimum_degree_order(rows):
+    """ Finds fill-reducing elimination order of unknowns of sparse system with minimum degree algorithm
+
+        rows: list of rows of square matrix, each being a dictionary column:value of non-zero entries
+
+        Graph has an edge between unknowns i and j if entry (i,j) or (j,i) is non-zero. At each step unknown with fewest
+        neighbours (lowest index on a tie) is eliminated, and its neighbours are connected with each other as the
+        elimination would do it. Returns order as list of unknowns and predicted fill-in, which is number of entries
+        (counted on both sides of diagonal) which are zero in matrix but become non-zero during elimination.
+    """
+    n = len(rows)
+    graph = dict((i, set()) for i in range(n))
+    for i in range(n):
+        for j in rows[i]:
+            if j != i:
+                graph[i].add(j)
+                graph[j].add(i)
+    order = []
+    fill = 0
+    while graph:
+        k = min(graph, key=lambda i: (len(graph[i]), i))
+        neighbours = graph.pop(k)
+        for i in neighbours:
+            graph[i].discard(k)
+            new = neighbours - graph[i] - set([i])
+            fill += len(new)
+            graph[i] |= new
+        order.append(k)
+    return order, fill
+
+
+def sparse_interpolate(evaluate, count, bounds, domain, rnd, attempts=3):
+    """ Rebuilds sparse multivariate polynomials from their values (Zippel's algorithm)
+
+        Symbols are added one by one. Having monomials of polynomial in first k symbols (with the rest set to random
+        values), polynomial is evaluated for few values of k+1-th symbol, at points where first k symbols are powers of
+        distinct primes. For such points, coefficients of known monomials are solution of transposed Vandermonde system,
+        and each of them is interpolated in k+1-th symbol, which gives monomials in k+1 symbols. Polynomials are
+        checked at a random point at the end, and interpolation is repeated with other points if check fails.
+
+        evaluate: function which takes list of values of symbols, and returns list of count values of polynomials
+
+        count: number of polynomials
+
+        bounds: list of bounds of degree of polynomials in each symbol
+
+        domain: domain of values of polynomials (like QQ)
+
+        rnd: random.Random object used to choose points
+
+        Returns list of polynomials as dictionaries of monomial:coefficient.
+    """
+    m = len(bounds)
+    for attempt in range(attempts):
+        anchors = [domain(rnd.randint(1, 2 ** 20)) for v in range(m)]
+        primes = [domain(p) for p in rnd.sample(list(sympy.primerange(2, max(2 ** 12, 10 * m))), m)]
+        polys = [{(): None} for f in range(count)]
+        if not m:
+            polys = [{(): value} for value in evaluate([])]
+        for k in range(m):
+            size = max([len(poly) for poly in polys])
+            xs = [domain(x) for x in rnd.sample(xrange(1, 2 ** 20), bounds[k] + 1)]
+            samples = [[evaluate([prime ** t for prime in primes[:k]] + [x] + anchors[k + 1:]) for t in range(size)]
+                       for x in xs]
+            for f in range(count):
+                monoms = polys[f].keys()
+                nodes = [domain.one for monom in monoms]
+                for i, monom in enumerate(monoms):
+                    for v, e in enumerate(monom):
+                        nodes[i] *= primes[v] ** e
+                coefficients = [vandermonde_solve(nodes, [values[f] for values in sample[:len(monoms)]])
+                                for sample in samples]
+                polys[f] = {}
+                for i, monom in enumerate(monoms):
+                    for e, coeff in enumerate(interpolate(xs, [values[i] for values in coefficients], domain)):
+                        if coeff:
+                            polys[f].update({monom + (e,): coeff})
+        polys = [dict((monom, coeff) for monom, coeff in poly.iteritems() if coeff) for poly in polys]
+        point = [domain(rnd.randint(1, 2 ** 20)) for v in range(m)]
+        if evaluate(point) == [evaluate_poly(poly, point, domain) for poly in polys]:
+            return polys
+    raise ValueError("Interpolation of polynomials failed.")
+
+
+def evaluate_poly(poly, point, domain):
+    """ Evaluates polynomial given as dictionary of monomial:coefficient at a point
+    """
+    value = domain.zero
+    for monom, coeff in poly.iteritems():
+        for v, e in enumerate(monom):
+            if e:
+                coeff *= point[v] ** e
+        value += coeff
+    return value
+
+
+def interpolate(xs, ys, domain):
+    """ Univariate interpolation of polynomial which takes values ys at points xs (Newton's divided differences)
+
+        Returns list of coefficients, starting from the lowest degree.
+    """
+    differences = list(ys)
+    for k in range(1, len(xs)):
+        for i in reversed(range(k, len(xs))):
+            differences[i] = (differences[i] - differences[i - 1]) / (xs[i] - xs[i - k])
+    coefficients = []
+    for k in reversed(range(len(xs))):
+        # coefficients = coefficients * (x - xs[k]) + differences[k]
+        coefficients = [domain.zero] + coefficients
+        for i in range(len(coefficients) - 1):
+            coefficients[i] -= xs[k] * coefficients[i + 1]
+        coefficients[0] += differences[k]
+    return coefficients
+
+
+def vandermonde_solve(nodes, values):
+    """ Solves transposed Vandermonde system sum(c_j * nodes[j]^t) = values[t] for t = 0..len(nodes)-1
+
+        Returns list of c_j.
+    """
+    # coefficients of master polynomial P(z) = prod(z - node)
+    master = [1]
+    for node in nodes:
+        master = [0] + master
+        for i in range(len(master) - 1):
+            master[i] -= node * master[i + 1]
+    solution = []
+    for node in nodes:
+        # P(z) / (z - node), sum of its coefficients times values gives c_j times its value at node
+        quotient = [0] * len(nodes)
+        quotient[-1] = master[-1]
+        for k in reversed(range(1, len(nodes))):
+            quotient[k - 1] = master[k] + node * quotient[k]
+        scale = 0
+        for coeff in reversed(quotient):
+            scale = scale * node + coeff
+        solution.append(sum(coeff * value for coeff, value in zip(quotient, values)) / scale)
+    return solution
+
+
+class LazySolution(object):
+    """ Solution X of system G*X = B, which entries are calculated only when they are asked for.
+
+        Engine which has G factorized is kept, and for each column of B the state of the engine (like transformed right
+        hand side) is remembered, so asking for next entries of the same column doesn't repeat the work.
+    """
+
+    def __init__(self, engine, B):
+        """ Initialize LazySolution
+
+            engine: engine object with factorized G matrix
+
+            B: sympy Matrix with right hand sides in its columns
+        """
+        self.engine = engine
+        self.B = B
+        self.caches = {}    # dictionary of column: engine state for that column
+        self.values = {}    # dictionary of (row, column): already calculated solution values
+
+    def get(self, i, c):
+        """ Provides single entry of X
+
+            i: row of X (index of unknown)
+
+            c: column of X (index of right hand side)
+        """
+        if (i, c) not in self.values:
+            cache = self.caches.setdefault(c, {})
+            value = self.engine.solve_entries(list(self.B.col(c)), [i], cache)[i]
+            self.values.update({(i, c): value})
+        return self.values[(i, c)]
+
+    def matrix(self):
+        """ Calculates all entries of X and returns them as sympy Matrix.
+        """
+        X = sympy.zeros(self.engine.n, self.B.cols)
+        for c in range(self.B.cols):
+            missing = [i for i in range(self.engine.n) if (i, c) not in self.values]
+            if missing:
+                cache = self.caches.setdefault(c, {})
+                for i, value in self.engine.solve_entries(list(self.B.col(c)), missing, cache).iteritems():
+                    self.values.update({(i, c): value})
+            for i in range(self.engine.n):
+                X[i, c] = self.values[(i, c)]
+        return X
+
+
+class ExactMatrix(object):
+    """ Sparse matrix with entries in field of rational functions of circuit symbols over rationals.
+
+        Entries are kept in list of rows, each row is a dictionary column:value of non-zero entries. Provides just
+        those features of sympy Matrix which engines need.
+    """
+
+    def __init__(self, field, entries, cols):
+        """ Initialize ExactMatrix
+
+            field: FracField of rational functions in which entries are
+
+            entries: list of rows, dictionaries of column:value with values being elements of field
+
+            cols: number of columns
+        """
+        self.field = field
+        self.entries = entries
+        self.rows = len(entries)
+        self.cols = cols
+
+    def __getitem__(self, index):
+        i, j = index
+        return self.entries[i].get(j, self.field.zero)
+
+    def __neg__(self):
+        return ExactMatrix(self.field, [dict((j, -value) for j, value in row.iteritems()) for row in self.entries],
+                           self.cols)
+
+    @property
+    def free_symbols(self):
+        return set(self.field.symbols)
+
+    def col(self, c):
+        """ Provides list of values in column c
+        """
+        return [row.get(c, self.field.zero) for row in self.entries]
+
+    def to_sympy(self):
+        """ Converts matrix into sympy Matrix of expressions.
+        """
+        return sympy.Matrix(self.rows, self.cols, lambda i, j: as_expr(self[i, j]))
+
+    @staticmethod
+    def from_dok(matrices):
+        """ Makes ExactMatrix objects from sparse matrices of sympy expressions, all of them in one common field
+
+            matrices: list of (dok, rows, cols) tuples, where dok is dictionary (row,column):value of non-zero entries
+
+            Field is made of all symbols which appear in any of matrices. Returns list of ExactMatrix objects.
+        """
+        gens = set()
+        for dok, rows, cols in matrices:
+            for value in dok.itervalues():
+                gens |= sympy.sympify(value).free_symbols
+        field = FracField(sorted(gens, key=str), QQ)
+        exact_matrices = []
+        for dok, rows, cols in matrices:
+            entries = [{} for i in range(rows)]
+            for (i, j), value in dok.iteritems():
+                value = to_field(field, value)
+                if value:
+                    entries[i].update({j: value})
+            exact_matrices.append(ExactMatrix(field, entries, cols))
+        return exact_matrices
+
+
+def to_field(field, value):
+    """ Converts sympy expression into element of field of rational functions
+
+        field: FracField of rational functions of circuit symbols over rationals
+
+        value: sympy expression, floats in it are replaced with rationals (see float_to_rational)
+    """
+    value = rationalize(value)
+    try:
+        return field.from_expr(value)
+    except ValueError:
+        raise scs_errors.ScsInstanceError("Can't use %s as rational function of circuit symbols." % value)
+
+
+def rationalize(value):
+    """ Replaces floats in sympy expression with rationals, see float_to_rational
+    """
+    value = sympy.sympify(value)
+    return value.xreplace(dict((f, float_to_rational(f)) for f in value.atoms(sympy.Float)))
+
+
+def float_to_rational(f):
+    """ Converts float into rational without digits which are made only by rounding, so 1.0/3 becomes 1/3 (not
+        truncated 333333333333333/1000000000000000), 1/1.7e3 becomes 1/1700 and 3.3e-9 becomes 33/10000000000
+
+        f: sympy Float
+
+        Two candidates are made: shortest decimal representation of f, and the first convergent of continued fraction
+        of exact binary value of f which is within few units in last place of f. The one with fewer digits is taken.
+    """
+    exact = sympy.Rational(f)
+    text = repr(float(f)) if f._prec <= 53 else str(f)
+    decimal = sympy.Rational(text)
+    decimal_digits = len(text.lower().split('e')[0].replace('-', '').replace('.', '').strip('0'))
+    p, q = exact.p, exact.q
+    tolerance = abs(exact) * 4 / 2 ** f._prec
+    h0, h1, k0, k1 = 0, 1, 1, 0
+    while q:
+        a = p // q
+        p, q = q, p - a * q
+        h0, h1 = h1, a * h1 + h0
+        k0, k1 = k1, a * k1 + k0
+        convergent = sympy.Rational(h1, k1)
+        if abs(convergent - exact) <= tolerance:
+            if len(str(abs(h1))) + len(str(k1)) < decimal_digits:
+                return convergent
+            break
+    return decimal
+
+
+def as_expr(value):
+    """ Converts element of field of rational functions into sympy expression, other values are left as they are.
+    """
+    return value.as_expr() if isinstance(value, FracElement) else value
+
+
+# Dictionary of engine names with appropriate engine objects
+engined = {'inverse': InverseEngine,
+           'bareiss': BareissEngine,
+           'ddd': DDDEngine,
+           'interpolation': InterpolationEngine}
+
+# Dictionary of engine names with coefficients (a, b, c, d, f) of predicted time used by CostEstimate
+cost_model = {'inverse': (-3.34, 0.83, 0.56, 0.12, 0.90),
+              'bareiss': (-7.61, 1.07, 0.16, 0.20, 0.0),
+              'ddd': (-6.72, 0.83, 0.18, 0.19, 0.0),
+              'interpolation': (-6.12, 1.05, 0.55, 0.18, 0.79)}
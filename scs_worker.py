@@ -0,0 +1,219 @@
+#!/depot/Python-2.7.2/bin/python -E
+
+""" Worker script (scs-worker) solving subinstances for scs.py on other hosts.
+
+    Worker listens on TCP port for connections of scs.py started with --worker HOST:PORT options (coordinator).
+    Coordinator sends over connection jobs, each of them is a function with its argument (pickled instance detached
+    from its parent, with evaluated values of elements, and options of solve, see scs_instance_hier._solve_template),
+    and worker sends back result (template_key,solution pairs of the instance and its subinstances), until coordinator
+    closes connection. Worker and coordinator have to run the same version of the scripts.
+
+    Jobs are pickled, and unpickling data from unknown peer can run any code, so connections are authenticated with
+    a key shared by worker and coordinator (--authkey, on default SCS_AUTHKEY environment variable). There is no
+    default key: worker listening on localhost without a key makes a random one and prints it, and worker refuses to
+    listen on other addresses unless the key is given. Several workers on localhost (with different ports) can be used
+    to test the setup on one machine.
+"""
+import argparse
+import sys
+import os
+import socket
+import logging
+import threading
+import Queue
+import multiprocessing
+import multiprocessing.connection
+
+import scs_instance_hier  # jobs are functions of this module and its instances
+import scs_errors
+
+__author__ = "Tomasz Kniola"
+__credits__ = ["Tomasz Kniola"]
+
+__license__ = "LGPL"
+__version__ = "0.0.1"
+__email__ = "kniola.tomasz@gmail.com"
+__status__ = "development"
+
+__description__ = """
+    Symbolic circuit solver worker - solves subinstances sent by scs.py started with --worker HOST:PORT
+
+"""
+
+default_port = 6100
+default_authkey = os.environ.get('SCS_AUTHKEY')
+local_hosts = ('localhost', '127.0.0.1', '::1')
+
+
+class WorkerPool(object):
+    """ Pool of worker processes listening on TCP ports, with map like multiprocessing.Pool
+
+        Can be passed to Instance.solve() as workers. Each job is sent to the first free worker. Worker which can't
+        be reached (connecting is retried for 20 s, as by multiprocessing.connection.Client) or which breaks the
+        connection is dropped for good and its job goes to other workers, jobs left when all workers are dropped are
+        done in this process.
+    """
+
+    def __init__(self, addresses, authkey):
+        """ Initialize WorkerPool
+
+            addresses: list of (host,port) tuples of workers
+
+            authkey: key shared with workers
+        """
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.dropped = set()
+
+    def map(self, function, arguments):
+        """ Calls function for each of arguments on workers
+
+            function: function of one argument, defined at module level so it can be pickled
+
+            arguments: list of arguments
+
+            Returns list of results in the same order as arguments.
+        """
+        arguments = list(arguments)
+        results = [None] * len(arguments)
+        jobs = Queue.Queue()
+        for k in range(len(arguments)):
+            jobs.put(k)
+        threads = [threading.Thread(target=self._feed, args=(address, function, arguments, results, jobs))
+                   for address in self.addresses if address not in self.dropped]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        while not jobs.empty():
+            k = jobs.get()
+            logging.warning('No worker left, job %d done locally' % k)
+            results[k] = function(arguments[k])
+        return results
+
+    def _feed(self, address, function, arguments, results, jobs):
+        """ Sends jobs to one worker until there are no more jobs, run in a thread for each worker
+
+            address: (host,port) of worker
+
+            function, arguments, results: as in map
+
+            jobs: queue of indices of arguments which are not done yet
+        """
+        try:
+            connection = multiprocessing.connection.Client(address, authkey=self.authkey)
+        except (IOError, EOFError, multiprocessing.AuthenticationError), e:
+            logging.warning("Can't connect to worker %s:%d: %s" % (address[0], address[1], e))
+            self.dropped.add(address)
+            return
+        try:
+            while True:
+                try:
+                    k = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    connection.send((function, arguments[k]))
+                    results[k] = connection.recv()
+                except (IOError, EOFError), e:
+                    logging.warning('Worker %s:%d dropped: %s' % (address[0], address[1], e))
+                    self.dropped.add(address)
+                    jobs.put(k)
+                    return
+                logging.info('Job %d done by worker %s:%d' % (k, address[0], address[1]))
+        finally:
+            connection.close()
+
+
+def parse_address(text):
+    """ Parses worker address
+
+        text: string HOST:PORT, or just PORT for localhost
+
+        Returns (host,port) tuple. Raises ValueError if port is not a number.
+    """
+    host, colon, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def serve(address, authkey):
+    """ Solves jobs sent by coordinators, one connection at a time, forever
+
+        address: (host,port) to listen on
+
+        authkey: key shared with coordinators
+
+        Errors of jobs are sent back to coordinator as scs_errors.ScsInstanceError, so it doesn't wait forever.
+    """
+    listener = multiprocessing.connection.Listener(address, authkey=authkey)
+    logging.info('Listening on %s:%d' % address)
+    try:
+        while True:
+            try:
+                connection = listener.accept()
+            except (IOError, EOFError, multiprocessing.AuthenticationError), e:
+                logging.warning('Connection refused: %s' % e)
+                continue
+            logging.info('Connection from %s:%d' % listener.last_accepted)
+            try:
+                while True:
+                    try:
+                        job = connection.recv()
+                    except EOFError:
+                        break
+                    except Exception, e:
+                        logging.error('Job not received: %s' % e)
+                        connection.send(scs_errors.ScsInstanceError('Worker %s:%d failed: %s' %
+                                                                    (address[0], address[1], e)))
+                        continue
+                    try:
+                        function, argument = job
+                        result = function(argument)
+                    except Exception, e:
+                        logging.error('Job failed: %s' % e)
+                        result = scs_errors.ScsInstanceError('Worker %s:%d failed: %s' % (address[0], address[1], e))
+                    connection.send(result)
+                    logging.info('Job done')
+            except IOError, e:
+                logging.warning('Connection lost: %s' % e)
+            finally:
+                connection.close()
+    finally:
+        listener.close()
+
+
+def main():
+    """Main function.
+
+        Look at description of this file.
+    """
+    parser = argparse.ArgumentParser(description=__description__, prog='scs-worker')
+    parser.add_argument('--host', default='localhost',
+                        help='address to listen on, on default localhost only, 0.0.0.0 for all interfaces')
+    parser.add_argument('-p', '--port', type=int, default=default_port,
+                        help='TCP port to listen on, on default %d' % default_port)
+    parser.add_argument('--authkey', default=default_authkey,
+                        help='key shared with scs.py, on default SCS_AUTHKEY environment variable, if neither is given '
+                             'random key is made and printed (only when listening on localhost)')
+    parser.add_argument('-v', action='store_true',
+                        help='log received jobs to standard output')
+    args = parser.parse_args(sys.argv[1:])
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO if args.v else logging.WARNING)
+    if not args.authkey:
+        if args.host not in local_hosts:
+            logging.error("Refusing to listen on %s without a key, give it with --authkey or SCS_AUTHKEY" % args.host)
+            exit(1)
+        args.authkey = os.urandom(16).encode('hex')
+        print 'Authentication key: %s' % args.authkey
+        sys.stdout.flush()
+    try:
+        serve((args.host, args.port), args.authkey)
+    except socket.error, e:
+        logging.error("Can't listen on %s:%d: %s" % (args.host, args.port, e))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
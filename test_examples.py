@@ -0,0 +1,184 @@
+""" Checks solutions of example circuits with every engine and mode against the baseline solve
+
+    Baseline is plain inversion (inverse engine) of equations of each instance as they are written, without reduction,
+    partitioning and splitting into symmetric halves. Voltages of all nets and currents of all elements of the hierarchy
+    are compared numerically, with each symbol replaced by a value of its own (and s by a complex frequency), so
+    solutions which differ only in form are equal. Besides examples/ it solves a few small netlists covering cases which
+    examples don't: voltage sources chained between ports of a subcircuit, and a divider which has to give exact
+    fractions in exact mode.
+
+    Run from the top directory of the repository with (examples take several minutes):
+
+    python -m unittest -v test_examples
+"""
+import os
+import glob
+import random
+import shutil
+import tempfile
+import logging
+import unittest
+
+import sympy
+
+import scs_parser
+import scs_circuit
+import scs_instance_hier
+import scs_analysis
+import scs_solver
+
+__author__ = "Tomasz Kniola"
+__credits__ = ["Tomasz Kniola"]
+
+__license__ = "LGPL"
+__version__ = "0.0.1"
+__email__ = "kniola.tomasz@gmail.com"
+__status__ = "development"
+
+engines = sorted(scs_solver.engined)
+
+# Modes as (name, dictionary of keyword arguments of solve, number of nets of partition or 0, reduce)
+modes = [('plain', {}, 0, False),
+         ('lazy', {'lazy': True}, 0, False),
+         ('exact', {'exact': True}, 0, False),
+         ('nested', {'nested': True}, 0, False),
+         ('no symmetry', {'symmetry': False}, 0, False),
+         ('reduced', {}, 0, True),
+         ('partitioned', {}, 3, True)]
+
+chain_netlist = """
+.param Vin V R
+.subckt a b g vchain
+V1 a x V
+V2 x b V
+R1 x g R
+.ends
+Vs in 0 Vin
+X1 in out 0 vchain
+R2 out 0 R
+.ends
+"""
+
+divider_netlist = """
+Vs in 0 1
+R1 in out 0.25
+R2 out 0 1
+.subckt a c half
+R3 a b 0.3
+R4 b c 0.7
+.ends
+X1 out 0 half
+.ends
+"""
+
+
+def value(symbol):
+    """ Value of symbol used for comparing solutions, the same in every run
+    """
+    if str(symbol) == 's':
+        return sympy.Rational(1, 3) + sympy.I * sympy.Rational(2, 7)
+    rnd = random.Random(str(symbol))
+    return sympy.Rational(rnd.randint(50, 200), 100)
+
+
+def evaluate(expression, instance):
+    """ Evaluates expression given by v() or i() of instance as complex number
+    """
+    expression = sympy.sympify(expression)
+    sequence = instance.sequence([expression])
+    symbols = expression.free_symbols.union(*[definition.free_symbols for symbol, definition in sequence])
+    symbols -= set(symbol for symbol, definition in sequence)
+    subst = [(symbol, value(symbol)) for symbol in symbols]
+    if sequence:
+        expression = scs_analysis.evaluate_sequence(expression, sequence, subst)
+    else:
+        expression = expression.subs(subst)
+    return complex(sympy.N(expression))
+
+
+def instantiate(filename, exact=False, partition=0, reduce=False):
+    """ Parses file and makes its top instance, with numbers read as rationals if exact
+    """
+    scs_parser.exact = exact
+    try:
+        top = scs_parser.parse_file(filename, scs_circuit.TopCircuit())
+    finally:
+        scs_parser.exact = False
+    instance = scs_instance_hier.make_top_instance(top)
+    if not instance.check_path_to_gnd() or not instance.check_voltage_loop():
+        raise AssertionError('%s is not well formed' % filename)
+    if reduce:
+        instance.reduce()
+    if partition:
+        instance.partition(partition)
+    return instance
+
+
+def quantities(instance, prefix=''):
+    """ Provides names in dot notation of nets and elements of instance and its subinstances, as (function, name)
+    """
+    names = [('v', prefix + net) for net in sorted(instance.elements_on_net)]
+    names += [('i', prefix + element) for element in sorted(instance.elements)]
+    for subname, subinstance in sorted(instance.subinstances.iteritems()):
+        names += quantities(subinstance, '%s%s.' % (prefix, subname))
+    return names
+
+
+def solution(instance, names):
+    """ Numerical values of names (as provided by quantities) in solved instance
+    """
+    return [evaluate(getattr(instance, function)(name), instance) for function, name in names]
+
+
+class ExamplesTest(unittest.TestCase):
+    """ Solves each netlist with every engine in every mode and compares it with baseline
+    """
+
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_netlist(self, name, netlist):
+        filename = os.path.join(self.directory, '%s.sp' % name)
+        with open(filename, 'w') as fil:
+            fil.write(netlist)
+        return filename
+
+    def check_netlist(self, filename):
+        baseline = instantiate(filename)
+        names = quantities(baseline)
+        baseline.solve('inverse', symmetry=False)
+        expected = solution(baseline, names)
+        for engine in engines:
+            for mode, options, partition, reduce in modes:
+                instance = instantiate(filename, options.get('exact', False), partition, reduce)
+                instance.solve(engine, **options)
+                for (function, name), a, b in zip(names, expected, solution(instance, names)):
+                    self.assertTrue(abs(a - b) <= 1e-9 * max(abs(a), abs(b), 1.0),
+                                    '%s with %s engine, %s: %s(%s) is %s instead of %s' %
+                                    (filename, engine, mode, function, name, b, a))
+
+    def test_examples(self):
+        for filename in sorted(glob.glob(os.path.join('examples', '*', '*.sp'))):
+            if 'library' not in filename:
+                self.check_netlist(filename)
+
+    def test_voltage_source_chain(self):
+        self.check_netlist(self.write_netlist('chain', chain_netlist))
+
+    def test_exact_fractions(self):
+        filename = self.write_netlist('divider', divider_netlist)
+        self.check_netlist(filename)
+        for engine in engines:
+            instance = instantiate(filename, exact=True)
+            instance.solve(engine, exact=True)
+            self.assertEqual(sympy.sympify(instance.v('out')), sympy.Rational(2, 3), engine)
+            self.assertEqual(sympy.sympify(instance.v('X1.b')), sympy.Rational(7, 15), engine)
+
+
+if __name__ == '__main__':
+    unittest.main()